@@ -0,0 +1,173 @@
+import os
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Tuple
+
+import numpy as np
+
+PARAMETERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Parameters")
+CAMERA_CONFIG_FILE = "camera_config.json"
+
+# 畸变系数在参数文件中的键，顺序与OpenCV一致
+FISHEYE_DIST_KEYS = ('K1', 'K2', 'K3', 'K4')
+PINHOLE_DIST_KEYS = ('K1', 'K2', 'P1', 'P2', 'K3', 'K4', 'K5', 'K6')
+
+
+def read_camera_parameters(param_file):
+    """从参数文件中读取相机内参和畸变系数"""
+    params = {}
+    with open(param_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    for line in lines:
+        # 使用冒号分割键值
+        if ':' in line:
+            key, value = line.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+
+            # 忽略值为'/'或'null'的参数
+            if value != '/' and value != 'null' and value != '':
+                try:
+                    # 尝试将值转换为浮点数
+                    params[key] = float(value)
+                except ValueError:
+                    # 如果不能转换为浮点数，则保存为字符串
+                    params[key] = value
+
+    return params
+
+
+@dataclass(frozen=True)
+class CameraParameters:
+    """单个相机的内参和畸变系数，解析后不可修改"""
+    name: str
+    model: str
+    fx: float
+    fy: float
+    cx: float
+    cy: float
+    distortion: Tuple[float, ...]
+    values: Mapping[str, Any]
+
+    @classmethod
+    def from_values(cls, name, values):
+        # 检查必要的参数是否存在
+        required_params = ['FX', 'FY', 'CX', 'CY']
+        if not all(param in values for param in required_params):
+            missing = [param for param in required_params if param not in values]
+            raise ValueError(f"缺少必要的相机参数: {', '.join(missing)}")
+
+        # 参数文件中P1/P2为'/'(读取后不存在)的是鱼眼相机
+        model = "fisheye" if 'P1' not in values else "pinhole"
+        dist_keys = FISHEYE_DIST_KEYS if model == "fisheye" else PINHOLE_DIST_KEYS
+        return cls(
+            name=name,
+            model=model,
+            fx=values['FX'],
+            fy=values['FY'],
+            cx=values['CX'],
+            cy=values['CY'],
+            distortion=tuple(float(values.get(k, 0.0)) for k in dist_keys),
+            values=MappingProxyType(dict(values)),
+        )
+
+    @property
+    def is_fisheye(self):
+        return self.model == "fisheye"
+
+    @property
+    def camera_matrix(self):
+        return np.array([
+            [self.fx, 0, self.cx],
+            [0, self.fy, self.cy],
+            [0, 0, 1]
+        ])
+
+    @property
+    def dist_coeffs(self):
+        return np.array(self.distortion)
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class CameraRegistry:
+    """
+    Parameters/目录下所有相机参数的进程内缓存
+    每个参数文件只解析一次，由参数派生的数据(映射表、裁剪后的内参等)也缓存在这里；
+    文件的修改时间或大小变化时，对应相机的参数和派生数据会被重新生成
+    """
+
+    def __init__(self, parameters_dir=PARAMETERS_DIR):
+        self.parameters_dir = parameters_dir
+        self._cameras: Dict[str, Tuple[Tuple[int, int], CameraParameters]] = {}
+        self._derived: Dict[str, Dict[Hashable, Any]] = {}
+        self._config = None
+
+    def param_file(self, name):
+        return os.path.join(self.parameters_dir, f"{name}.txt")
+
+    def names(self) -> List[str]:
+        """所有相机的名称(参数文件名，不含扩展名)"""
+        return sorted(
+            os.path.splitext(f)[0] for f in os.listdir(self.parameters_dir) if f.endswith(".txt")
+        )
+
+    def get(self, name) -> CameraParameters:
+        param_file = self.param_file(name)
+        signature = _file_signature(param_file)
+        cached = self._cameras.get(name)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        camera = CameraParameters.from_values(name, read_camera_parameters(param_file))
+        self._cameras[name] = (signature, camera)
+        self._derived.pop(name, None)
+        return camera
+
+    def derived(self, name, key, build: Callable[[CameraParameters], Any]):
+        """
+        获取由相机参数派生的数据，不存在时调用build(camera)生成
+        参数文件变化后旧的派生数据自动失效
+        """
+        camera = self.get(name)
+        derived = self._derived.setdefault(name, {})
+        if key not in derived:
+            derived[key] = build(camera)
+        return derived[key]
+
+    def camera_config(self):
+        """读取camera_config.json，文件不变时返回缓存的内容(不要修改返回值)"""
+        config_file = os.path.join(self.parameters_dir, CAMERA_CONFIG_FILE)
+        signature = _file_signature(config_file)
+        if self._config is None or self._config[0] != signature:
+            with open(config_file, 'r', encoding='utf-8') as f:
+                self._config = (signature, json.load(f))
+        return self._config[1]
+
+
+_registries: Dict[str, CameraRegistry] = {}
+
+
+def get_registry(parameters_dir=PARAMETERS_DIR) -> CameraRegistry:
+    """每个Parameters目录共享一个注册表"""
+    key = os.path.realpath(parameters_dir)
+    if key not in _registries:
+        _registries[key] = CameraRegistry(parameters_dir)
+    return _registries[key]
+
+
+def get_camera(param_file) -> CameraParameters:
+    """根据参数文件路径获取相机参数"""
+    name = os.path.splitext(os.path.basename(param_file))[0]
+    return get_registry(os.path.dirname(param_file) or ".").get(name)
+
+
+def get_derived(param_file, key, build: Callable[[CameraParameters], Any]):
+    """根据参数文件路径获取由相机参数派生的数据"""
+    name = os.path.splitext(os.path.basename(param_file))[0]
+    return get_registry(os.path.dirname(param_file) or ".").derived(name, key, build)
@@ -2,109 +2,322 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sys
 import shutil
 import argparse
 import json
+import hashlib
 from pathlib import Path
 from collections import defaultdict
 
-def read_camera_parameters(param_file):
-    """从参数文件中读取相机内参和畸变系数"""
-    params = {}
-    with open(param_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        
-    for line in lines:
-        # 使用冒号分割键值
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip()
-            value = value.strip()
-            
-            # 忽略值为'/'或'null'的参数
-            if value != '/' and value != 'null' and value != '':
-                try:
-                    # 尝试将值转换为浮点数
-                    params[key] = float(value)
-                except ValueError:
-                    # 如果不能转换为浮点数，则保存为字符串
-                    params[key] = value
-    
-    return params
+from camera_registry import get_camera
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lidar2camera"))
+from calib_writer import (CALIB_TXT_NAME, DEFAULT_TR_LINE, EXTRINSIC_JSON_NAME, INTRINSIC_JSON_NAME,
+                          publish, render_calib_txt, render_intrinsic_json)
+
+def index_frame_files(camera_folder, sub_folders):
+    """
+    每个子文件夹只遍历一次，建立 帧名 -> 文件路径列表 的索引
+    masks下是以帧名命名的文件夹，其余子文件夹下是以帧名命名的文件
+    """
+    index = defaultdict(list)
+    for sub_folder in sub_folders:
+        folder = os.path.join(camera_folder, sub_folder)
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if sub_folder == "masks":
+                    key = entry.name
+                else:
+                    key = os.path.splitext(entry.name)[0]
+                index[key].append(entry.path)
+    return index
+
+def build_copy_plan(camera_folder, sub_folders, basenames, provider=None):
+    """
+    根据索引生成复制计划 帧名 -> [(操作, 源路径, 目标路径列表)]
+    操作为copy(复制文件)、copytree(复制文件夹)或undistort(去畸变后写入)
+    """
+    index = index_frame_files(camera_folder, sub_folders)
+    auto_calib_dir = os.path.join(camera_folder, "auto-calib")
+    mannual_calib_dir = os.path.join(camera_folder, "mannual-calib")
+
+    plan = {}
+    for basename in basenames:
+        frame_plan = plan[basename] = []
+        save_auto_folder = os.path.join(auto_calib_dir, basename)
+        save_mannual_folder = os.path.join(mannual_calib_dir, basename)
+        if provider is not None:
+            image_name = os.path.basename(provider.source_path(basename))
+            frame_plan.append(("undistort", provider.source_path(basename),
+                         [os.path.join(save_auto_folder, image_name), os.path.join(save_mannual_folder, image_name)]))
+        for file_path in sorted(index.get(basename, [])):
+            if os.path.basename(os.path.dirname(file_path)) == "masks":
+                frame_plan.append(("copytree", file_path, [os.path.join(save_auto_folder, 'masks')]))
+            else:
+                filename = os.path.basename(file_path)
+                frame_plan.append(("copy", file_path,
+                             [os.path.join(save_auto_folder, filename), os.path.join(save_mannual_folder, filename)]))
+    return plan
+
+# Linux上的FICLONE ioctl，用于在支持的文件系统(btrfs、xfs等)上创建reflink
+FICLONE = 0x40049409
+
+def reflink_file(src, dst):
+    """创建写时复制的reflink，文件系统不支持时抛出OSError"""
+    import fcntl
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def place_file(src, dst, link_mode="copy"):
+    """
+    按link_mode把src放到dst：copy直接复制，hardlink创建硬链接，reflink创建写时复制副本
+    链接失败(跨文件系统、文件系统不支持等)时回退为复制
+    """
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif link_mode == "reflink":
+        try:
+            reflink_file(src, dst)
+            return
+        except (OSError, ImportError):
+            pass
+    shutil.copy2(src, dst)
+
+def swap_directory(staging_dir, target_dir):
+    """用staging_dir替换target_dir，旧目录先改名再删除，打包过程中不会留下半成品目录"""
+    old_dir = None
+    if os.path.exists(target_dir):
+        old_dir = f"{target_dir}.old-{os.getpid()}"
+        os.rename(target_dir, old_dir)
+    os.rename(staging_dir, target_dir)
+    if old_dir is not None:
+        shutil.rmtree(old_dir)
+        print(f"已替换: {target_dir}")
+
+def print_copy_plan(plan):
+    for frame_plan in plan.values():
+        for action, src, dsts in frame_plan:
+            print(f"{action}: {src} -> {', '.join(dsts)}")
+
+MANIFEST_NAME = ".package_manifest.json"
+
+# 输入文件按修改时间和大小判断是否变化，不读取文件内容
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def tree_signature(path):
+    """文件夹内所有文件的修改时间和大小的哈希"""
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(f"{os.path.relpath(file_path, path)}:{file_signature(file_path)}".encode())
+    return digest.hexdigest()
+
+def frame_signature(frame_plan, param_file):
+    """一帧所有输入的签名，任一输入变化时签名随之变化"""
+    sources = {}
+    for action, src, dsts in frame_plan:
+        if action == "copytree":
+            sources[src] = tree_signature(src)
+        else:
+            sources[src] = file_signature(src)
+        if action == "undistort":
+            # 去畸变结果还取决于相机参数
+            sources[param_file] = file_signature(param_file)
+    return sources
+
+def load_manifest(camera_folder):
+    manifest_file = os.path.join(camera_folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(camera_folder, manifest):
+    manifest_file = os.path.join(camera_folder, MANIFEST_NAME)
+    tmp_file = f"{manifest_file}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+def write_artefacts(manifest, camera_folder, paths, content, link_mode="write"):
+    """
+    将同一份生成的内容(calib.txt、内外参JSON)批量写入所有路径
+    清单中记录每个文件的内容哈希以及写入时的修改时间和大小；内容哈希一致且磁盘上的文件
+    自写入后没有变化时跳过，被修改或损坏的文件会重新写入，返回写入的路径列表
+    """
+    digest = content_hash(content)
+    artefacts = manifest.setdefault("artefacts", {})
+    keys = {path: os.path.relpath(path, camera_folder) for path in paths}
+    pending = [path for path in paths if not artefact_up_to_date(artefacts.get(keys[path]), digest, path)]
+    written = publish(content, pending, link_mode)
+    for path in written:
+        artefacts[keys[path]] = [digest, file_signature(path)]
+    return written
+
+def artefact_up_to_date(record, digest, path):
+    """清单记录为[内容哈希, 写入时的文件签名]，与新内容和磁盘上的文件都一致时无需重写"""
+    if not isinstance(record, list) or record[0] != digest or not os.path.exists(path):
+        return False
+    return record[1] == file_signature(path)
+
+def execute_frame_plan(frame_plan, link_mode, provider=None, map_path=lambda path: path):
+    """执行一帧的复制计划，map_path用于把目标路径映射到临时目录"""
+    for action, src, dsts in frame_plan:
+        dsts = [map_path(dst) for dst in dsts]
+        if action == "undistort":
+            # 去畸变图像只在这里生成一次
+            import cv2
+            cv2.imwrite(dsts[0], provider.get(Path(src).stem))
+            for dst in dsts[1:]:
+                place_file(dsts[0], dst, link_mode)
+        elif action == "copytree":
+            for dst in dsts:
+                shutil.copytree(src, dst, copy_function=lambda s, d: place_file(s, d, link_mode))
+        else:
+            for dst in dsts:
+                place_file(src, dst, link_mode)
 
-def organize_files(camera_folders,sub_folders):
+def organize_files(camera_folders,sub_folders,lazy_undistort=False,dry_run=False,manifest_path=None,link_mode="copy",incremental=False):
+    """
+    lazy_undistort为True时不读取undistorted文件夹，而是从原始图像按需去畸变后
+    直接写入打包目录，磁盘上不需要保存undistorted副本
+    dry_run为True时只打印复制计划，不做任何修改；manifest_path不为空时将复制计划写入该JSON文件
+    link_mode为copy、hardlink或reflink，决定文件是复制还是链接到打包目录
+    incremental为True时根据相机文件夹下的清单只重新打包输入有变化的帧
+    """
+    if lazy_undistort:
+        from undistort import camera_image_provider
+        sub_folders = [sf for sf in sub_folders if sf != "undistorted"]
+    options = {"sub_folders": list(sub_folders), "lazy_undistort": lazy_undistort, "link_mode": link_mode}
 
+    copy_plans = {}
     for camera_folder in camera_folders:
         auto_calib_dir = os.path.join(camera_folder, "auto-calib")
         mannual_calib_dir = os.path.join(camera_folder, "mannual-calib")
+        param_file = f"Parameters/{camera_folder}.txt"
 
-        #清空原来的数据    
-        if os.path.exists(auto_calib_dir):
-            shutil.rmtree(auto_calib_dir)
-            print(f"已清空: {auto_calib_dir}")
-            os.makedirs(auto_calib_dir)
+        #统计需要创建的文件夹
+        provider = None
+        if lazy_undistort:
+            provider = camera_image_provider(camera_folder)
+            basenames = provider.names()
         else:
-            os.makedirs(auto_calib_dir)
-            
-        if os.path.exists(mannual_calib_dir):
-            shutil.rmtree(mannual_calib_dir)
-            print(f"已清空: {mannual_calib_dir}")
-            os.makedirs(mannual_calib_dir)
+            undistorted_dir = os.path.join(camera_folder, "undistorted")
+            basenames = sorted(Path(f).stem for f in os.listdir(undistorted_dir)) if os.path.isdir(undistorted_dir) else []
+        print(f"共有{len(basenames)}个文件夹被打包")
+
+        plan = build_copy_plan(camera_folder, sub_folders, basenames, provider)
+        copy_plans[camera_folder] = [
+            {"action": action, "src": src, "dst": dsts}
+            for frame_plan in plan.values() for action, src, dsts in frame_plan
+        ]
+        if dry_run:
+            print_copy_plan(plan)
+            continue
+
+        signatures = {basename: frame_signature(frame_plan, param_file) for basename, frame_plan in plan.items()}
+        old_manifest = load_manifest(camera_folder)
+        if (incremental and old_manifest is not None and old_manifest.get("options") == options
+                and os.path.isdir(auto_calib_dir) and os.path.isdir(mannual_calib_dir)):
+            # 增量打包：只重建输入有变化的帧，删除源数据已不存在的帧
+            manifest = old_manifest
+            old_frames = manifest.get("frames", {})
+            artefacts = manifest.setdefault("artefacts", {})
+            changed = [b for b in basenames if old_frames.get(b) != signatures[b]]
+            removed = [b for b in old_frames if b not in plan]
+            for basename in changed + removed:
+                for calib_dir in (auto_calib_dir, mannual_calib_dir):
+                    frame_dir = os.path.join(calib_dir, basename)
+                    if os.path.exists(frame_dir):
+                        shutil.rmtree(frame_dir)
+                # 帧文件夹被重建，其中生成的文件需要重新写入
+                prefixes = tuple(os.path.join(os.path.basename(d), basename) + os.sep for d in (auto_calib_dir, mannual_calib_dir))
+                for key in [k for k in artefacts if k.startswith(prefixes)]:
+                    del artefacts[key]
+            for basename in changed:
+                os.makedirs(os.path.join(auto_calib_dir, basename))
+                os.makedirs(os.path.join(mannual_calib_dir, basename))
+                execute_frame_plan(plan[basename], link_mode, provider)
+            print(f"增量打包: {len(changed)} 帧有变化，删除 {len(removed)} 帧，{len(basenames) - len(changed)} 帧未变化")
         else:
-            os.makedirs(mannual_calib_dir)
+            # 先在临时目录中打包，完成后再替换原来的目录
+            manifest = {}
+            staging = {calib_dir: f"{calib_dir}.tmp-{os.getpid()}" for calib_dir in (auto_calib_dir, mannual_calib_dir)}
+            for staging_dir in staging.values():
+                if os.path.exists(staging_dir):
+                    shutil.rmtree(staging_dir)
+                os.makedirs(staging_dir)
 
-        # 构建当前camera_folder的完整sub_folder路径
-        camera_sub_folders = [os.path.join(camera_folder, sf) for sf in sub_folders]
-        
-        basenames=[]
-        targets={}
+            def staged(path):
+                # 将复制计划中的目标路径映射到对应的临时目录
+                for calib_dir, staging_dir in staging.items():
+                    if path.startswith(calib_dir + os.sep):
+                        return staging_dir + path[len(calib_dir):]
+                raise ValueError(f"目标路径不在打包目录中: {path}")
 
-        #统计需要创建的文件夹
-        for file_path in Path(os.path.join(camera_folder, "undistorted")).glob('*'):
-            print(file_path)
-            basename=file_path.stem
-            basenames.append(basename)
-        print(f"共有{len(basenames)}个文件夹被打包")
+            #开始复制
+            for basename in basenames:
+                for staging_dir in staging.values():
+                    os.makedirs(os.path.join(staging_dir, basename), exist_ok=True)
+                execute_frame_plan(plan[basename], link_mode, provider, staged)
 
-        #保存需要复制的路径
-        for basename in basenames:
-            targets[basename] = []  # 初始化列表
-            for sub_folder in camera_sub_folders:
-                if sub_folder.endswith("masks"):
-                    print(Path(sub_folder))
-                    for file_path in Path(sub_folder).glob('*'):
-                        if(basename==os.path.basename(file_path)):
-                            targets[basename].append(file_path)
-                else:
-                    for file_path in Path(sub_folder).glob('*'):
-                        filename=os.path.basename(file_path)
-                        if(basename==os.path.splitext(filename)[0]):
-                            targets[basename].append(file_path)
-        #开始复制    
-        for basename in basenames:
-            save_auto_folder=os.path.join(auto_calib_dir,basename)
-            save_mannual_folder=os.path.join(mannual_calib_dir,basename)
-            os.makedirs(save_auto_folder, exist_ok=True)
-            os.makedirs(save_mannual_folder, exist_ok=True)
-            for file_path in targets[basename]:
-                if 'masks' in str(file_path):
-                    shutil.copytree(file_path, os.path.join(save_auto_folder, 'masks'))
-                else:
-                    shutil.copy2(file_path, os.path.join(save_auto_folder, os.path.basename(file_path)))
-                    shutil.copy2(file_path, os.path.join(save_mannual_folder, os.path.basename(file_path)))
+            for calib_dir, staging_dir in staging.items():
+                swap_directory(staging_dir, calib_dir)
+
+        manifest["options"] = options
+        manifest["frames"] = signatures
+        save_manifest(camera_folder, manifest)
+
+    if manifest_path:
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(copy_plans, f, indent=4, ensure_ascii=False)
+        print(f"复制计划已写入: {manifest_path}")
+
+def frame_folders(calib_dir):
+    """calib_dir下的所有帧文件夹"""
+    return [
+        os.path.join(calib_dir, name) for name in sorted(os.listdir(calib_dir))
+        if os.path.isdir(os.path.join(calib_dir, name))
+    ]
 
-def copy_json_to_mannualcalib(camera_folders):
+
+def copy_json_to_mannualcalib(camera_folders, link_mode="write"):
     """
     根据每个相机的参数文件，生成包含具体内参的JSON文件到mannual-calib的所有最深层子文件夹中
+    每个相机的内参JSON只生成一次，再批量写入所有子文件夹
     """
-    intrinsic_file = "center_camera-intrinsic.json"
-    extrinsic_file = "top_center_lidar-to-center_camera-extrinsic.json"
+    extrinsic_file = EXTRINSIC_JSON_NAME
     
     # 检查外参文件是否存在（内参将动态生成）
     if not os.path.exists(extrinsic_file):
         print(f"错误: 缺少源外参文件 ({extrinsic_file})！")
         return
 
+    with open(extrinsic_file, 'rb') as f:
+        extrinsic_content = f.read()
+
     copied_files_count = 0
     processed_subfolders = 0
     
@@ -119,111 +332,29 @@ def copy_json_to_mannualcalib(camera_folders):
             print(f"警告: 未找到参数文件 '{param_file_path}'，跳过 {camera_folder}")
             continue
         
-        # 读取相机参数
+        # 读取相机参数并构建内参JSON内容
         try:
-            params = read_camera_parameters(param_file_path)
-            
-            # 提取内参，如果是特殊的pinhole-front，使用硬编码的参数
-            if camera_folder == "pinhole-front":
-                fx = 1910.3417311410
-                fy = 1910.3058674355
-                cx = 1917.7001038394
-                cy = 1081.4421265044
-            else:
-                fx = params.get("FX", 0.0)
-                fy = params.get("FY", 0.0)
-                cx = params.get("CX", 0.0)
-                cy = params.get("CY", 0.0)
-            
-            # 构建内参JSON内容
-            intrinsic_data = {
-                "center_camera-intrinsic": {
-                    "sensor_name": "center_camera",
-                    "target_sensor_name": "center_camera",
-                    "device_type": "camera",
-                    "param_type": "intrinsic",
-                    "param": {
-                        "img_dist_w": 1920,
-                        "img_dist_h": 1536,
-                        "cam_K": {
-                            "rows": 3,
-                            "cols": 3,
-                            "type": 6,
-                            "continuous": True,
-                            "data": [
-                                [fx, 0, cx],
-                                [0, fy, cy],
-                                [0, 0, 1]
-                            ]
-                        },
-                        "cam_dist": {
-                            "rows": 1,
-                            "cols": 5,
-                            "type": 6,
-                            "continuous": True,
-                            "data": [
-                                [0, 0, 0, 0, 0]
-                            ]
-                        }
-                    }
-                }
-            }
-            
+            camera = get_camera(param_file_path)
+            intrinsic_content = render_intrinsic_json(camera.fx, camera.fy, camera.cx, camera.cy)
         except Exception as e:
             print(f"警告: 读取参数文件 '{param_file_path}' 时出错: {e}")
             # 如果读取失败，使用默认内容
-            intrinsic_data = {
-                "center_camera-intrinsic": {
-                    "sensor_name": "center_camera",
-                    "target_sensor_name": "center_camera",
-                    "device_type": "camera",
-                    "param_type": "intrinsic",
-                    "param": {
-                        "img_dist_w": 1920,
-                        "img_dist_h": 1536,
-                        "cam_K": {
-                            "rows": 3,
-                            "cols": 3,
-                            "type": 6,
-                            "continuous": True,
-                            "data": [
-                                [0.0, 0, 0.0],
-                                [0, 0.0, 0.0],
-                                [0, 0, 1]
-                            ]
-                        },
-                        "cam_dist": {
-                            "rows": 1,
-                            "cols": 5,
-                            "type": 6,
-                            "continuous": True,
-                            "data": [
-                                [0, 0, 0, 0, 0]
-                            ]
-                        }
-                    },
-                    "error": f"无法读取参数文件 {param_file_path}"
-                }
-            }
-
-        # 遍历时间戳子文件夹
-        for subfolder_name in os.listdir(mannualcalib_dir):
-            subfolder_path = os.path.join(mannualcalib_dir, subfolder_name)
-            if not os.path.isdir(subfolder_path):
-                continue
-            
-            processed_subfolders += 1
-            
-            # 生成内参JSON文件
-            intrinsic_file_path = os.path.join(subfolder_path, intrinsic_file)
-            with open(intrinsic_file_path, 'w', encoding='utf-8') as f:
-                json.dump(intrinsic_data, f, indent=4, ensure_ascii=False)
-            
-            # 复制外参JSON文件
-            shutil.copy2(extrinsic_file, os.path.join(subfolder_path, extrinsic_file))
-            
-            copied_files_count += 2
-            print(f"已生成JSON文件到: {subfolder_path}")
+            intrinsic_content = render_intrinsic_json(0.0, 0.0, 0.0, 0.0, error=f"无法读取参数文件 {param_file_path}")
+
+        manifest = load_manifest(camera_folder) or {}
+        subfolders = frame_folders(mannualcalib_dir)
+        processed_subfolders += len(subfolders)
+
+        # 内容与清单中记录的一致时跳过
+        written = write_artefacts(manifest, camera_folder,
+                                  [os.path.join(d, INTRINSIC_JSON_NAME) for d in subfolders], intrinsic_content, link_mode)
+        written += write_artefacts(manifest, camera_folder,
+                                   [os.path.join(d, extrinsic_file) for d in subfolders], extrinsic_content, link_mode)
+        save_manifest(camera_folder, manifest)
+
+        copied_files_count += len(written)
+        if written:
+            print(f"已生成 {len(written)} 个JSON文件到: {mannualcalib_dir}")
     
     if processed_subfolders == 0:
         print(f"警告: 在任何相机文件夹下都没有找到 'mannual-calib' 子文件夹！")
@@ -231,9 +362,10 @@ def copy_json_to_mannualcalib(camera_folders):
         print(f"已向 {processed_subfolders} 个子文件夹中生成了 {copied_files_count} 个JSON文件")
 
 
-def copy_calib_to_autocalib(camera_folders):
+def copy_calib_to_autocalib(camera_folders, link_mode="write"):
     """
     根据每个相机的参数文件，生成包含具体内参的calib.txt文件到auto-calib的所有最深层子文件夹中
+    每个相机的calib.txt只生成一次，再批量写入所有子文件夹
     """
     copied_files_count = 0
     processed_subfolders = 0
@@ -249,47 +381,28 @@ def copy_calib_to_autocalib(camera_folders):
             print(f"警告: 未找到参数文件 '{param_file_path}'，跳过 {camera_folder}")
             continue
         
-        # 读取相机参数
+        # 读取相机参数并构建calib.txt内容
         try:
-            params = read_camera_parameters(param_file_path)
-            
-            # 提取内参，如果是特殊的pinhole-front，使用硬编码的参数
-            if camera_folder == "pinhole-front":
-                fx = 1910.3417311410
-                fy = 1910.3058674355
-                cx = 1917.7001038394
-                cy = 1081.4421265044
-            else:
-                fx = params.get("FX", "N/A")
-                fy = params.get("FY", "N/A")
-                cx = params.get("CX", "N/A")
-                cy = params.get("CY", "N/A")
-            
-            # 构建calib.txt内容，按照固定格式
-            calib_content = f"P2: {fx} 0 {cx} 0 {fy} {cy} 0 0 1\n"
-            calib_content += "D: 0 0 0 0 0\n"
-            calib_content += "Tr: -0.994522 -0.00182427 0.104513 4.56915e-05 6.88468e-18 -0.999848 -0.0174524 0.155236 0.104528 -0.0173568 0.99437 0.0173913"
-            
+            camera = get_camera(param_file_path)
+            calib_content = render_calib_txt(camera.fx, camera.fy, camera.cx, camera.cy)
         except Exception as e:
             print(f"警告: 读取参数文件 '{param_file_path}' 时出错: {e}")
             # 如果读取失败，使用默认内容
             calib_content = "P2: 0 0 0 0 0 0 0 0 0 0 1\n"
             calib_content += "D: 0 0 0 0 0\n"
-            calib_content += "Tr: -0.994522 -0.00182427 0.104513 4.56915e-05 6.88468e-18 -0.999848 -0.0174524 0.155236 0.104528 -0.0173568 0.99437 0.0173913 "
-
-        # 遍历时间戳子文件夹
-        for subfolder_name in os.listdir(autocalib_dir):
-            subfolder_path = os.path.join(autocalib_dir, subfolder_name)
-            if not os.path.isdir(subfolder_path):
-                continue
-
-            processed_subfolders += 1
-            # 创建calib.txt文件
-            calib_file_path = os.path.join(subfolder_path, "calib.txt")
-            with open(calib_file_path, 'w', encoding='utf-8') as f:
-                f.write(calib_content)
-            copied_files_count += 1
-            print(f"已生成calib.txt文件到: {subfolder_path}")
+            calib_content += DEFAULT_TR_LINE + " "
+
+        manifest = load_manifest(camera_folder) or {}
+        subfolders = frame_folders(autocalib_dir)
+        processed_subfolders += len(subfolders)
+
+        written = write_artefacts(manifest, camera_folder,
+                                  [os.path.join(d, CALIB_TXT_NAME) for d in subfolders], calib_content, link_mode)
+        save_manifest(camera_folder, manifest)
+
+        copied_files_count += len(written)
+        if written:
+            print(f"已生成 {len(written)} 个calib.txt文件到: {autocalib_dir}")
     
     if processed_subfolders == 0:
         print(f"警告: 在任何相机文件夹下都没有找到 'auto-calib' 子文件夹！")
@@ -301,15 +414,29 @@ def main():
     parser = argparse.ArgumentParser(description='将源文件夹中的同名文件整理到两个指定文件夹中')
     parser.add_argument('--copy-json-only', action='store_true',
                         help='只复制JSON文件到mannual-calib文件夹的子文件夹中，不执行整理操作')
+    parser.add_argument('--lazy-undistort', action='store_true',
+                        help='不读取undistorted文件夹，直接从原始图像去畸变后写入打包目录')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='只打印将要复制的文件，不做任何修改')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='将复制计划写入指定的JSON文件')
+    parser.add_argument('--link-mode', choices=['copy', 'hardlink', 'reflink'], default='copy',
+                        help='文件放入打包目录的方式：复制、硬链接或reflink(不支持时回退为复制)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='根据清单只重新打包输入有变化的帧，未变化的帧和生成文件保持不动')
     
     args = parser.parse_args()
     
     camera_folders = ["fisheye-front", "fisheye-left", "fisheye-right", "pinhole-back", "pinhole-front"]
     sub_folders = ["pointclouds", "undistorted", "masks"]
     
-    organize_files(camera_folders,sub_folders)
-    copy_calib_to_autocalib(camera_folders)
-    copy_json_to_mannualcalib(camera_folders)
+    organize_files(camera_folders,sub_folders,args.lazy_undistort,args.dry_run,args.manifest,args.link_mode,args.incremental)
+    if args.dry_run:
+        return
+    # 生成的文件只有硬链接可选，reflink对这些小文件没有意义
+    artefact_link_mode = "hardlink" if args.link_mode == "hardlink" else "write"
+    copy_calib_to_autocalib(camera_folders, artefact_link_mode)
+    copy_json_to_mannualcalib(camera_folders, artefact_link_mode)
     
     src_dirs = []
     for cam_folder in camera_folders:
@@ -325,7 +452,7 @@ def main():
 
     if args.copy_json_only:
         print(f"开始复制JSON文件到 'mannual-calib' 的所有子文件夹...")
-        copy_json_to_mannualcalib(camera_folders)
+        copy_json_to_mannualcalib(camera_folders, artefact_link_mode)
     else:
         print(f"自动发现的源文件夹: {', '.join(src_dirs)}")
         print(f"目标结构: camera_folder/auto-calib/..., camera_folder/mannual-calib/... ")
@@ -0,0 +1,186 @@
+import numpy as np
+
+from camera_registry import get_camera
+
+
+def is_fisheye(params):
+    """参数文件中P1/P2为'/'(读取后不存在)的是鱼眼相机"""
+    return 'P1' not in params
+
+
+def camera_matrix_from_params(params):
+    """由参数构建相机内参矩阵"""
+    return np.array([
+        [params['FX'], 0, params['CX']],
+        [0, params['FY'], params['CY']],
+        [0, 0, 1]
+    ])
+
+
+def distort_points_fisheye(x, y, params):
+    """
+    对归一化平面坐标施加鱼眼畸变(与cv2.fisheye相同的k1-k4等距模型)
+    x, y为一维数组，返回畸变后的归一化坐标
+    """
+    k1, k2, k3, k4 = (params.get(k, 0.0) for k in ('K1', 'K2', 'K3', 'K4'))
+    r = np.sqrt(x * x + y * y)
+    theta = np.arctan(r)
+    theta2 = theta * theta
+    theta_d = theta * (1 + theta2 * (k1 + theta2 * (k2 + theta2 * (k3 + theta2 * k4))))
+    # r趋近0时theta_d/r趋近1
+    scale = np.ones_like(r)
+    nonzero = r > 1e-12
+    scale[nonzero] = theta_d[nonzero] / r[nonzero]
+    return x * scale, y * scale
+
+
+def distort_points_pinhole(x, y, params):
+    """
+    对归一化平面坐标施加针孔相机畸变(与cv2.projectPoints相同的k1-k6有理模型及p1、p2切向畸变)
+    x, y为一维数组，返回畸变后的归一化坐标
+    """
+    k1, k2, k3, k4, k5, k6 = (params.get(k, 0.0) for k in ('K1', 'K2', 'K3', 'K4', 'K5', 'K6'))
+    p1, p2 = params.get('P1', 0.0), params.get('P2', 0.0)
+    xy = x * y
+    x2 = x * x
+    y2 = y * y
+    r2 = x2 + y2
+    radial = (1 + r2 * (k1 + r2 * (k2 + r2 * k3))) / (1 + r2 * (k4 + r2 * (k5 + r2 * k6)))
+    xd = x * radial + 2 * p1 * xy + p2 * (r2 + 2 * x2)
+    yd = y * radial + p1 * (r2 + 2 * y2) + 2 * p2 * xy
+    return xd, yd
+
+
+def project_points(points, extrinsic, params, image_size=None, min_depth=0.1, chunk_size=1 << 20):
+    """
+    将激光雷达点投影到原始(未去畸变)图像上
+    points: Nx3(或Nx4，多余的列如intensity会被忽略)的激光雷达坐标
+    extrinsic: 4x4激光雷达到相机的外参
+    params: 相机参数字典(如CameraParameters.values)
+    image_size: (width, height)，给定时图像范围外的点标记为无效
+    返回Nx2的像素坐标和长度为N的有效点掩码
+    """
+    points = np.asarray(points)[:, :3]
+    extrinsic = np.asarray(extrinsic, dtype=np.float64)
+    rotation = extrinsic[:3, :3]
+    translation = extrinsic[:3, 3]
+    distort = distort_points_fisheye if is_fisheye(params) else distort_points_pinhole
+    fx, fy, cx, cy = params['FX'], params['FY'], params['CX'], params['CY']
+
+    uv = np.empty((len(points), 2), dtype=np.float64)
+    valid = np.zeros(len(points), dtype=bool)
+    # 分块处理，控制数百万点时中间数组的内存占用
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size].astype(np.float64)
+        cam = chunk @ rotation.T + translation
+        z = cam[:, 2]
+        in_front = z > min_depth
+        safe_z = np.where(in_front, z, 1.0)
+        xd, yd = distort(cam[:, 0] / safe_z, cam[:, 1] / safe_z, params)
+        uv[start:start + len(chunk), 0] = fx * xd + cx
+        uv[start:start + len(chunk), 1] = fy * yd + cy
+        valid[start:start + len(chunk)] = in_front
+
+    if image_size is not None:
+        width, height = image_size
+        valid &= (uv[:, 0] >= 0) & (uv[:, 0] < width) & (uv[:, 1] >= 0) & (uv[:, 1] < height)
+    return uv, valid
+
+
+def project_points_with_param_file(points, extrinsic, param_file, image_size=None, min_depth=0.1):
+    """从相机注册表获取参数后调用project_points"""
+    return project_points(points, extrinsic, get_camera(param_file).values, image_size, min_depth)
+
+
+def sample_mask(mask, uv, valid):
+    """
+    取投影点所在像素的掩码值，无效点和落在图像外的点返回0
+    mask可以是单张二值掩码，也可以是标签图(HxW或HxWxC)
+    """
+    height, width = mask.shape[:2]
+    inside = valid & (uv[:, 0] >= 0) & (uv[:, 0] < width) & (uv[:, 1] >= 0) & (uv[:, 1] < height)
+    values = np.zeros((len(uv),) + mask.shape[2:], dtype=mask.dtype)
+    cols = uv[inside, 0].astype(np.int64)
+    rows = uv[inside, 1].astype(np.int64)
+    values[inside] = mask[rows, cols]
+    return values
+
+
+def project_points_undistorted(points, extrinsic, camera_matrix, image_size=None, min_depth=0.1):
+    """
+    将激光雷达点投影到去畸变后的图像上(无畸变针孔模型)
+    camera_matrix: 去畸变(及裁剪)后图像的3x3内参矩阵
+    返回值与project_points相同
+    """
+    params = {'FX': camera_matrix[0][0], 'FY': camera_matrix[1][1],
+              'CX': camera_matrix[0][2], 'CY': camera_matrix[1][2], 'P1': 0.0, 'P2': 0.0}
+    return project_points(points, extrinsic, params, image_size, min_depth)
+
+
+def read_pcd_points(pcd_file):
+    """读取PCD文件(ascii或未压缩的binary)中的x, y, z，返回Nx3数组"""
+    header = {}
+    with open(pcd_file, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"PCD文件头不完整: {pcd_file}")
+            fields = line.decode('ascii', errors='ignore').strip().split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            header[fields[0].upper()] = fields[1:]
+            if fields[0].upper() == 'DATA':
+                break
+        data = f.read()
+
+    names = header['FIELDS']
+    sizes = [int(v) for v in header['SIZE']]
+    types = header['TYPE']
+    counts = [int(v) for v in header.get('COUNT', ['1'] * len(names))]
+    num_points = int(header['POINTS'][0])
+    columns = [names.index(axis) for axis in ('x', 'y', 'z')]
+
+    mode = header['DATA'][0].lower()
+    if mode == 'ascii':
+        values = np.loadtxt(data.decode('ascii').splitlines(), dtype=np.float64, ndmin=2)
+        offsets = np.cumsum([0] + counts)[:-1]
+        return values[:num_points, [offsets[c] for c in columns]]
+    if mode == 'binary':
+        kinds = {'F': 'f', 'I': 'i', 'U': 'u'}
+        dtype = np.dtype([(name, f"<{kinds[t]}{size}", (count,) if count > 1 else ())
+                          for name, size, t, count in zip(names, sizes, types, counts)])
+        records = np.frombuffer(data, dtype=dtype, count=num_points)
+        return np.stack([records[names[c]].astype(np.float64) for c in columns], axis=1)
+    raise ValueError(f"不支持的PCD数据格式 {mode}: {pcd_file}")
+
+
+def box_sum(values, radius):
+    """每个像素周围(2*radius+1)^2窗口内的和(积分图实现，窗口在图像边界处截断)"""
+    height, width = values.shape
+    table = np.zeros((height + 1, width + 1), dtype=np.float64)
+    table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    rows = np.arange(height)
+    cols = np.arange(width)
+    top, bottom = np.clip(rows - radius, 0, height), np.clip(rows + radius + 1, 0, height)
+    left, right = np.clip(cols - radius, 0, width), np.clip(cols + radius + 1, 0, width)
+    return (table[bottom][:, right] - table[top][:, right]
+            - table[bottom][:, left] + table[top][:, left])
+
+
+def lidar_coverage_map(uv, valid, image_size, radius=16, percentile=95):
+    """
+    由投影点生成激光雷达覆盖图(HxW float32，取值[0,1])
+    每个像素的值为半径radius像素内的投影点数，除以非零像素中第percentile百分位的点数后截断到1；
+    没有激光点投影到附近的区域(天空、自车等)为0
+    """
+    width, height = image_size
+    inside = valid & (uv[:, 0] >= 0) & (uv[:, 0] < width) & (uv[:, 1] >= 0) & (uv[:, 1] < height)
+    cols = uv[inside, 0].astype(np.int64)
+    rows = uv[inside, 1].astype(np.int64)
+    counts = np.bincount(rows * width + cols, minlength=width * height).reshape(height, width)
+    density = box_sum(counts, radius)
+    covered = density[density > 0]
+    if len(covered) == 0:
+        return np.zeros((height, width), dtype=np.float32)
+    scale = max(np.percentile(covered, percentile), 1.0)
+    return np.minimum(density / scale, 1.0).astype(np.float32)
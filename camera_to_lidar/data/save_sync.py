@@ -7,12 +7,256 @@ import numpy as np
 import sensor_msgs.point_cloud2 as pc2
 import struct
 import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def nearest_indices(sorted_times, query_times):
+    """在已排序的时间戳数组中为每个查询时间找到最近邻的下标"""
+    sorted_times = np.asarray(sorted_times, dtype=np.float64)
+    query_times = np.asarray(query_times, dtype=np.float64)
+    if len(sorted_times) == 1:
+        return np.zeros(len(query_times), dtype=np.int64)
+
+    # searchsorted给出右侧邻居，再与左侧邻居比较取更近者
+    idx = np.clip(np.searchsorted(sorted_times, query_times), 1, len(sorted_times) - 1)
+    left_closer = (query_times - sorted_times[idx - 1]) <= (sorted_times[idx] - query_times)
+    return idx - left_closer.astype(np.int64)
+
+
+def estimate_time_offset(lidar_times, image_times, search_window=0.5, bin_width=0.005):
+    """根据最近邻时间差的直方图估计两个传感器之间的固定时延(图像时间 - 点云时间)"""
+    lidar_times = np.asarray(lidar_times, dtype=np.float64)
+    image_times = np.asarray(image_times, dtype=np.float64)
+    if len(lidar_times) == 0 or len(image_times) == 0:
+        return 0.0
+
+    offsets = image_times[nearest_indices(image_times, lidar_times)] - lidar_times
+    offsets = offsets[np.abs(offsets) <= search_window]
+    if len(offsets) == 0:
+        return 0.0
+
+    # 取直方图峰值所在的区间，再用区间内的中位数细化
+    bins = np.arange(-search_window, search_window + bin_width, bin_width)
+    hist, edges = np.histogram(offsets, bins=bins)
+    peak = int(np.argmax(hist))
+    in_peak = offsets[(offsets >= edges[peak]) & (offsets <= edges[peak + 1])]
+    return float(np.median(in_peak))
+
+
+def match_timestamps(lidar_times, image_times, time_tolerance=0.03, estimate_offset=True):
+    """
+    对点云和图像时间戳做全局最近邻匹配
+    输入的时间戳需按升序排列，返回匹配上的点云下标、图像下标以及匹配统计信息
+    """
+    lidar_times = np.asarray(lidar_times, dtype=np.float64)
+    image_times = np.asarray(image_times, dtype=np.float64)
+
+    offset = estimate_time_offset(lidar_times, image_times) if estimate_offset else 0.0
+    shifted = lidar_times + offset
+
+    # 点云 -> 最近图像，再反查图像 -> 最近点云，只保留互为最近邻的配对，保证一一对应
+    img_idx = nearest_indices(image_times, shifted)
+    residuals = image_times[img_idx] - shifted
+    back_idx = nearest_indices(shifted, image_times[img_idx])
+    keep = (np.abs(residuals) <= time_tolerance) & (back_idx == np.arange(len(lidar_times)))
+
+    lidar_idx = np.nonzero(keep)[0]
+    img_idx = img_idx[keep]
+    residuals = residuals[keep]
+
+    stats = {
+        "offset": offset,
+        "lidar_count": len(lidar_times),
+        "image_count": len(image_times),
+        "matched": len(lidar_idx),
+        "mean_residual": float(np.mean(np.abs(residuals))) if len(residuals) else 0.0,
+        "max_residual": float(np.max(np.abs(residuals))) if len(residuals) else 0.0,
+    }
+    return lidar_idx, img_idx, stats
+
+
+# 每个写出线程复用一个CvBridge，避免每帧重新构造
+_thread_local = threading.local()
+
+
+def _get_bridge():
+    bridge = getattr(_thread_local, "bridge", None)
+    if bridge is None:
+        bridge = CvBridge()
+        _thread_local.bridge = bridge
+    return bridge
+
+
+PCD_FIELDS = ("x", "y", "z", "intensity")
+
+# sensor_msgs/PointField的datatype -> numpy类型
+POINT_FIELD_DTYPES = {1: "i1", 2: "u1", 3: "i2", 4: "u2", 5: "i4", 6: "u4", 7: "f4", 8: "f8"}
+
+
+def pointcloud_buffer(pc_msg):
+    """
+    取出PointCloud2中解析点所需的原始数据(可以pickle，交给写出进程)
+    返回 (data, fields, point_step, row_step, width, height, is_bigendian)
+    """
+    fields = [(f.name, f.offset, f.datatype) for f in pc_msg.fields]
+    return (bytes(pc_msg.data), fields, pc_msg.point_step, pc_msg.row_step,
+            pc_msg.width, pc_msg.height, pc_msg.is_bigendian)
+
+
+def pointcloud_records(data, fields, point_step, row_step, width, height, is_bigendian):
+    """用numpy一次解析所有点的x, y, z, intensity，结果与pc2.read_points(skip_nans=True)相同"""
+    byte_order = ">" if is_bigendian else "<"
+    offsets = {name: (offset, datatype) for name, offset, datatype in fields}
+    missing = [name for name in PCD_FIELDS if name not in offsets]
+    if missing:
+        raise ValueError(f"点云缺少字段: {missing}")
+    dtype = np.dtype({
+        "names": list(PCD_FIELDS),
+        "formats": [byte_order + POINT_FIELD_DTYPES[offsets[name][1]] for name in PCD_FIELDS],
+        "offsets": [offsets[name][0] for name in PCD_FIELDS],
+        "itemsize": point_step,
+    })
+    # 每行末尾可能有填充，按row_step切行后只取width个点
+    rows = np.frombuffer(data, dtype=np.uint8, count=row_step * height).reshape(height, row_step)
+    points = np.ascontiguousarray(rows[:, :width * point_step]).view(dtype).reshape(-1)
+    nan = np.zeros(len(points), dtype=bool)
+    for name in PCD_FIELDS:
+        if points.dtype[name].kind == "f":
+            nan |= np.isnan(points[name])
+    return points[~nan]
+
+
+def save_pointcloud_buffer_to_pcd(buffer, output_path):
+    """
+    由pointcloud_buffer的结果写出PCD，在写出进程中运行
+    点的解析和文本格式化都在进程内完成，不占用主进程的GIL
+    """
+    # tolist得到与struct解包相同的Python数值，输出文本与逐点读取时一致
+    points = pointcloud_records(*buffer).tolist()
+    lines = [f"{x} {y} {z} {intensity}\n" for x, y, z, intensity in points]
+    write_pcd_lines(lines, output_path)
+
+
+def save_pointcloud_to_pcd(pc_msg, output_path):
+    """将点云保存为PCD格式"""
+    save_pointcloud_buffer_to_pcd(pointcloud_buffer(pc_msg), output_path)
+
+
+def write_pcd_lines(lines, output_path):
+    """写入ASCII格式的PCD文件，lines为每个点一行的文本"""
+    with open(output_path, 'w') as f:
+        f.write("# .PCD v0.7 - Point Cloud Data\n")
+        f.write("VERSION 0.7\n")
+        f.write("FIELDS x y z intensity\n")
+        f.write("SIZE 4 4 4 4\n")
+        f.write("TYPE F F F F\n")
+        f.write("COUNT 1 1 1 1\n")
+        f.write(f"WIDTH {len(lines)}\n")
+        f.write("HEIGHT 1\n")
+        f.write("VIEWPOINT 0 0 0 1 0 0 0\n")
+        f.write(f"POINTS {len(lines)}\n")
+        f.write("DATA ascii\n")
+        f.writelines(lines)
+
+
+def is_compressed_image(img_msg):
+    """判断消息是否为sensor_msgs/CompressedImage"""
+    return getattr(img_msg, "_type", "") == "sensor_msgs/CompressedImage"
+
+
+def compressed_image_extension(img_msg):
+    """根据CompressedImage的format字段(如 jpeg、bgr8; png compressed bgr8)确定文件扩展名"""
+    return ".png" if "png" in img_msg.format.lower() else ".jpg"
+
+
+def save_image_to_jpeg(img_msg, output_path, png_compression=1):
+    """将图像保存为图像文件，PNG使用较低的压缩等级以加快写出"""
+    cv_image = _get_bridge().imgmsg_to_cv2(img_msg, desired_encoding='bgr8')
+    cv2.imwrite(output_path, cv_image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+
+
+def save_compressed_image(img_msg, output_path, lossless=False, png_compression=1):
+    """
+    保存CompressedImage消息
+    默认直接写出消息中已压缩的字节，不做解码和重新编码；
+    lossless为True时解码后以PNG保存
+    """
+    if lossless:
+        cv_image = cv2.imdecode(np.frombuffer(img_msg.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        cv2.imwrite(output_path, cv_image, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    else:
+        with open(output_path, 'wb') as f:
+            f.write(img_msg.data)
+
+
+class AsyncFrameWriter:
+    """
+    后台写出点云和图像：图像编码和写文件会释放GIL，在线程池中进行；
+    点云转换为文本是纯Python的计算，用submit_process交给进程池，才能用上多个核
+    待写出的任务数受max_pending限制，读取端超前太多时会阻塞，避免消息在内存中堆积
+    任一写出任务失败后，下一次submit立即抛出该异常，不再继续读取
+    """
+
+    def __init__(self, num_workers=None, max_pending=32):
+        num_workers = num_workers or os.cpu_count()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.processes = ProcessPoolExecutor(max_workers=num_workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.error = None
+
+    def _done(self, future):
+        if future.exception() is not None and self.error is None:
+            self.error = future.exception()
+        self.slots.release()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, fn, *args):
+        self._submit(self.executor, fn, args)
+
+    def submit_process(self, fn, *args):
+        """在进程池中运行，fn和参数都需要可以pickle"""
+        self._submit(self.processes, fn, args)
+
+    def _submit(self, executor, fn, args):
+        self.raise_error()
+        self.slots.acquire()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+        self.processes.shutdown(wait=True)
+
+    def close(self):
+        """等待所有写出任务完成，任务中的异常在这里抛出"""
+        self.shutdown()
+        self.raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        if exc_type is None:
+            self.raise_error()
+
 
 class BagExtractor:
-    def __init__(self, bag_path, lidar_topic, image_topic, output_dir):
+    def __init__(self, bag_path, lidar_topic, image_topic, output_dir, lossless=False, png_compression=1):
         self.bag_path = bag_path
         self.lidar_topic = lidar_topic
         self.image_topic = image_topic
+        # 压缩图像话题默认原样写出；需要无损格式时解码后保存为PNG
+        self.lossless = lossless
+        self.png_compression = png_compression
         self.lidar_dir = os.path.join(output_dir, "pointclouds")
         if "pinhole" in output_dir:
             camera_type = "pinhole"
@@ -30,83 +274,83 @@ class BagExtractor:
         os.makedirs(self.lidar_dir, exist_ok=True)
         os.makedirs(self.image_dir, exist_ok=True)
 
-    def extract_sync_data(self, time_tolerance=0.03):
+    def extract_sync_data(self, time_tolerance=0.03, estimate_offset=True, num_workers=None, max_pending=32):
         print("Opening bag file...")
         bag = rosbag.Bag(self.bag_path)
 
-        # 获取消息
-        lidar_msgs = []
-        image_msgs = []
-        
-        print("Reading messages...")
-        for topic, msg, t in tqdm(bag.read_messages(topics=[self.lidar_topic, self.image_topic])):
+        topics = [self.lidar_topic, self.image_topic]
+
+        # 第一遍只读取时间戳(不反序列化消息)，用于匹配
+        lidar_times = []
+        image_times = []
+
+        print("Reading timestamps...")
+        for topic, _, t in tqdm(bag.read_messages(topics=topics, raw=True)):
             if topic == self.lidar_topic:
-                lidar_msgs.append((t.to_sec(), msg))
+                lidar_times.append(t.to_sec())
             elif topic == self.image_topic:
-                image_msgs.append((t.to_sec(), msg))
+                image_times.append(t.to_sec())
 
-        print(f"Found {len(lidar_msgs)} lidar messages and {len(image_msgs)} image messages")
+        print(f"Found {len(lidar_times)} lidar messages and {len(image_times)} image messages")
         
-        if len(lidar_msgs) == 0:
+        if len(lidar_times) == 0:
             print("Error: No lidar messages found")
+            bag.close()
             return
 
-        if len(image_msgs) == 0:
+        if len(image_times) == 0:
             print("Error: No image messages found")
+            bag.close()
             return
 
-        def save_pointcloud_to_pcd(pc_msg, output_path):
-            """将点云保存为PCD格式"""
-            points = []
-            for point in pc2.read_points(pc_msg, field_names=("x", "y", "z", "intensity"), skip_nans=True):
-                x, y, z, intensity = point
-                points.append((x, y, z, intensity))
-
-            # 写入PCD文件
-            with open(output_path, 'w') as f:
-                f.write("# .PCD v0.7 - Point Cloud Data\n")
-                f.write("VERSION 0.7\n")
-                f.write("FIELDS x y z intensity\n")
-                f.write("SIZE 4 4 4 4\n")
-                f.write("TYPE F F F F\n")
-                f.write("COUNT 1 1 1 1\n")
-                f.write(f"WIDTH {len(points)}\n")
-                f.write("HEIGHT 1\n")
-                f.write("VIEWPOINT 0 0 0 1 0 0 0\n")
-                f.write(f"POINTS {len(points)}\n")
-                f.write("DATA ascii\n")
-
-                for point in points:
-                    x, y, z, intensity = point
-                    f.write(f"{x} {y} {z} {intensity}\n")
-
-        def save_image_to_jpeg(img_msg, output_path):
-            """将图像保存为JPEG格式"""
-            bridge = CvBridge()
-            cv_image = bridge.imgmsg_to_cv2(img_msg, desired_encoding='bgr8')
-            cv2.imwrite(output_path, cv_image)
-
-        # 保存点云和图像数据
+        # 按时间戳排序后做最近邻匹配，再换算回各话题内的消息序号
+        lidar_order = np.argsort(lidar_times, kind="stable")
+        image_order = np.argsort(image_times, kind="stable")
+        lidar_times = np.asarray(lidar_times)[lidar_order]
+        image_times = np.asarray(image_times)[image_order]
+        lidar_indices, img_indices, stats = match_timestamps(
+            lidar_times, image_times, time_tolerance, estimate_offset)
+
+        print(f"Estimated image-lidar offset: {stats['offset'] * 1000:.1f} ms")
+        print(f"Matched {stats['matched']} pairs "
+              f"({stats['matched']}/{stats['lidar_count']} lidar, {stats['matched']}/{stats['image_count']} image), "
+              f"mean residual {stats['mean_residual'] * 1000:.1f} ms, max residual {stats['max_residual'] * 1000:.1f} ms")
+
+        # 文件编号在主线程按匹配顺序确定，写出顺序不影响编号
+        # 话题内消息序号 -> 文件编号
+        lidar_files = {}
+        image_files = {}
+        for file_idx, (lidar_idx, img_idx) in enumerate(zip(lidar_indices, img_indices)):
+            print(f"Matching lidar time: {lidar_times[lidar_idx]}, image time: {image_times[img_idx]}")
+            lidar_files[int(lidar_order[lidar_idx])] = file_idx
+            image_files[int(image_order[img_idx])] = file_idx
+
+        # 第二遍顺序读取，只把匹配上的消息交给写出线程池；读取与编码写出重叠，
+        # 内存中最多有max_pending条待写出的消息
         print(f"Saving synchronized point clouds and images...")
-        lidar_idx, img_idx, file_idx = 0, 0, 0
-        while lidar_idx < len(lidar_msgs) and img_idx < len(image_msgs):
-            lidar_time, pc_msg = lidar_msgs[lidar_idx]
-            img_time, img_msg = image_msgs[img_idx]
-            
-            # 检查时间戳是否在时间容差范围内
-            if abs(lidar_time - img_time) <= time_tolerance and lidar_time - img_time <= 0:
-                print(f"Matching lidar time: {lidar_time}, image time: {img_time}")
-                pcd_file = os.path.join(self.lidar_dir, f"{file_idx:04d}.pcd")
-                img_file = os.path.join(self.image_dir, f"{file_idx:04d}.png")
-                save_pointcloud_to_pcd(pc_msg, pcd_file)
-                save_image_to_jpeg(img_msg, img_file)
-                lidar_idx += 1
-                img_idx += 1
-                file_idx += 1
-            elif lidar_time < img_time:
-                lidar_idx += 1
-            else:
-                img_idx += 1
+        lidar_seq = 0
+        image_seq = 0
+        with AsyncFrameWriter(num_workers, max_pending) as writer:
+            for topic, msg, _ in tqdm(bag.read_messages(topics=topics)):
+                if topic == self.lidar_topic:
+                    file_idx = lidar_files.get(lidar_seq)
+                    lidar_seq += 1
+                    if file_idx is None:
+                        continue
+                    pcd_file = os.path.join(self.lidar_dir, f"{file_idx:04d}.pcd")
+                    writer.submit_process(save_pointcloud_buffer_to_pcd, pointcloud_buffer(msg), pcd_file)
+                elif topic == self.image_topic:
+                    file_idx = image_files.get(image_seq)
+                    image_seq += 1
+                    if file_idx is None:
+                        continue
+                    if is_compressed_image(msg):
+                        ext = ".png" if self.lossless else compressed_image_extension(msg)
+                        img_file = os.path.join(self.image_dir, f"{file_idx:04d}{ext}")
+                        writer.submit(save_compressed_image, msg, img_file, self.lossless, self.png_compression)
+                    else:
+                        img_file = os.path.join(self.image_dir, f"{file_idx:04d}.png")
+                        writer.submit(save_image_to_jpeg, msg, img_file, self.png_compression)
 
         bag.close()
         print("Extraction complete!")
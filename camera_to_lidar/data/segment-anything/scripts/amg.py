@@ -6,13 +6,20 @@
 
 import cv2  # type: ignore
 
-from segment_anything import SamAutomaticMaskGenerator, sam_model_registry
+from segment_anything import SamAutomaticMaskGenerator, SamOnnxPredictor, sam_model_registry
+from segment_anything.utils.amg import RLE, mask_to_rle_numpy, rle_foreground_runs, rle_to_mask
+from segment_anything.utils.embedding_cache import EmbeddingCache
 
 import argparse
 import json
 import os
+import sys
 import gc
-from typing import Any, Dict, List
+import queue
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import torch
 
 torch.cuda.empty_cache()
@@ -52,12 +59,122 @@ parser.add_argument(
 parser.add_argument(
     "--checkpoint",
     type=str,
-    required=True,
-    help="The path to the SAM checkpoint to use for mask generation.",
+    required=False,
+    default=None,
+    help=(
+        "The path to the SAM checkpoint to use for mask generation. "
+        "Required unless --onnx-encoder and --onnx-decoder are given."
+    ),
+)
+
+parser.add_argument(
+    "--onnx-encoder",
+    type=str,
+    default=None,
+    help=(
+        "Run the image encoder with ONNXRuntime from this model, exported with "
+        "scripts/export_onnx_model.py --encoder-output. Requires --onnx-decoder. "
+        "Much faster than the PyTorch model on machines without a GPU."
+    ),
+)
+
+parser.add_argument(
+    "--onnx-decoder",
+    type=str,
+    default=None,
+    help="Run the mask decoder with ONNXRuntime from this model. Requires --onnx-encoder.",
+)
+
+parser.add_argument(
+    "--onnx-threads",
+    type=int,
+    default=None,
+    help="The number of intra-op threads ONNXRuntime uses. Defaults to the physical core count.",
 )
 
 parser.add_argument("--device", type=str, default="cuda", help="The device to run generation on.")
 
+parser.add_argument(
+    "--lazy-undistort",
+    action="store_true",
+    help=(
+        "Read the raw camera images and undistort them in memory instead of reading "
+        "the undistorted folders, so no undistorted copies need to exist on disk."
+    ),
+)
+
+parser.add_argument(
+    "--batch-size",
+    type=int,
+    default=1,
+    help=(
+        "The number of images whose crops are encoded together in one forward pass "
+        "of the image encoder. The next batch is read in the background meanwhile."
+    ),
+)
+
+parser.add_argument(
+    "--mask-format",
+    type=str,
+    default="png",
+    choices=["png", "packed", "both"],
+    help=(
+        "How binary masks are saved. 'png' writes one PNG per mask. 'packed' writes a "
+        "single label image with up to 4 overlapping masks per pixel, plus a binary RLE "
+        "sidecar, which the calibrator reads in one pass. 'both' writes both. Packed masks "
+        "need a rebuilt run_lidar2camera, and cannot be used when the calibrator has to "
+        "undistort the masks; use 'both' in that case."
+    ),
+)
+
+parser.add_argument(
+    "--writer-threads",
+    type=int,
+    default=4,
+    help="The number of background threads writing mask files. 0 writes on the main thread.",
+)
+
+parser.add_argument(
+    "--embedding-cache",
+    type=str,
+    default=None,
+    help=(
+        "Directory for an on-disk cache of image embeddings. Re-running with different "
+        "thresholds then skips the image encoder for images that were already encoded."
+    ),
+)
+
+parser.add_argument(
+    "--lidar-extrinsic",
+    type=str,
+    default=None,
+    help=(
+        "Path template of the lidar-to-camera extrinsic for each camera, with {camera} "
+        "replaced by the camera folder, e.g. '../{camera}/extrinsic.txt'. If given, the "
+        "point cloud of each frame is projected into the image and the point grid is "
+        "pruned to the area covered by lidar points."
+    ),
+)
+
+parser.add_argument(
+    "--coverage-mode",
+    type=str,
+    default="mask",
+    choices=["mask", "density"],
+    help=(
+        "How lidar coverage prunes the point grid. 'mask' drops points with no lidar "
+        "points nearby. 'density' keeps a share of points proportional to the local "
+        "lidar point density."
+    ),
+)
+
+parser.add_argument(
+    "--coverage-radius",
+    type=int,
+    default=16,
+    help="The radius in pixels around each projected lidar point that counts as covered.",
+)
+
 parser.add_argument(
     "--convert-to-rle",
     action="store_true",
@@ -111,6 +228,17 @@ amg_settings.add_argument(
     help="The overlap threshold for excluding a duplicate mask.",
 )
 
+amg_settings.add_argument(
+    "--nms-mode",
+    type=str,
+    choices=["box", "mask"],
+    default=None,
+    help=(
+        "How duplicate masks are measured: by the IoU of their boxes ('box') "
+        "or by the true mask IoU computed on RLEs ('mask')."
+    ),
+)
+
 amg_settings.add_argument(
     "--crop-n-layers",
     type=int,
@@ -153,13 +281,27 @@ amg_settings.add_argument(
 )
 
 
-def write_masks_to_folder(masks: List[Dict[str, Any]], path: str) -> None:
+# 打包掩码文件，放在掩码文件夹中；扩展名不是.png，不会被LoadMaskFile当作单个掩码读取
+PACKED_LABELS_NAME = "labels.pack"
+PACKED_RLE_NAME = "masks.rle"
+PACKED_LAYERS = 4
+PACKED_MAX_LABELS = 255
+
+
+def write_masks_to_folder(
+    masks: List[Dict[str, Any]],
+    path: str,
+    executor: Optional[Executor] = None,
+    mask_format: str = "png",
+) -> List[Future]:
+    """
+    写出一张图片的掩码：mask_format为png时每个掩码一张PNG，为packed时写打包文件，为both时都写
+    掩码可以是HxW二值数组，也可以是生成器输出的RLE(output_mode为uncompressed_rle，见folder_output_mode)
+    给定executor时写文件在后台线程中进行，返回对应的Future，否则直接写完
+    """
     header = "id,area,bbox_x0,bbox_y0,bbox_w,bbox_h,point_input_x,point_input_y,predicted_iou,stability_score,crop_box_x0,crop_box_y0,crop_box_w,crop_box_h"  # noqa
     metadata = [header]
     for i, mask_data in enumerate(masks):
-        mask = mask_data["segmentation"]
-        filename = f"{i}.png"
-        cv2.imwrite(os.path.join(path, filename), mask * 255)
         mask_metadata = [
             str(i),
             str(mask_data["area"]),
@@ -171,11 +313,178 @@ def write_masks_to_folder(masks: List[Dict[str, Any]], path: str) -> None:
         ]
         row = ",".join(mask_metadata)
         metadata.append(row)
-    metadata_path = os.path.join(path, "metadata.csv")
-    with open(metadata_path, "w") as f:
-        f.write("\n".join(metadata))
 
-    return
+    tasks: List[Tuple[Callable, tuple]] = [
+        (write_text, (os.path.join(path, "metadata.csv"), "\n".join(metadata)))
+    ]
+    segmentations = [mask_data["segmentation"] for mask_data in masks]
+    if mask_format in ("png", "both"):
+        for i, mask in enumerate(segmentations):
+            tasks.append((write_mask_png, (os.path.join(path, f"{i}.png"), mask)))
+    if mask_format in ("packed", "both") and segmentations:
+        tasks.append((write_packed_masks, (path, segmentations)))
+
+    if executor is None:
+        for fn, fn_args in tasks:
+            fn(*fn_args)
+        return []
+    return [executor.submit(fn, *fn_args) for fn, fn_args in tasks]
+
+
+def write_text(path: str, text: str) -> None:
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def folder_output_mode(mask_format: str) -> str:
+    """写入掩码文件夹时生成器的output_mode：写打包文件时直接使用生成器的RLE，不再从二值掩码重新编码"""
+    return "binary_mask" if mask_format == "png" else "uncompressed_rle"
+
+
+def write_mask_png(path: str, mask: Any) -> None:
+    if not isinstance(mask, np.ndarray):
+        mask = rle_to_mask(mask)
+    # 二值掩码用最低压缩等级即可压得很小，写入快得多
+    png = mask.astype(np.uint8) * 255
+    if not cv2.imwrite(path, png, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        raise IOError(f"写入掩码失败: {path}")
+
+
+def mask_file_order(n: int) -> List[int]:
+    """LoadMaskFile按文件名字符串排序读取 0.png, 1.png, 10.png, ...，返回同样顺序的掩码编号"""
+    return sorted(range(n), key=lambda i: f"{i}.png")
+
+
+def pack_mask_labels(rles: List[RLE], order: List[int]) -> np.ndarray:
+    """
+    与LoadMaskFile相同的打包方式：按order顺序，第n个掩码(最多255个)的像素写入值n+1，
+    每个像素写在第一个为0的通道，最多4层重叠，超出的丢弃；返回HxWx4 uint8
+    """
+    h, w = rles[0].size
+    # 按RLE的列优先顺序填充，最后再转置
+    labels = np.zeros((w * h, PACKED_LAYERS), dtype=np.uint8)
+    depth = np.zeros(w * h, dtype=np.uint8)
+    for label, i in enumerate(order[:PACKED_MAX_LABELS], start=1):
+        starts, ends = rle_foreground_runs(rles[i])
+        lengths = ends - starts
+        if len(lengths) == 0:
+            continue
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        idx = np.arange(lengths.sum()) + offsets
+        layer = depth[idx]
+        free = layer < PACKED_LAYERS
+        idx = idx[free]
+        labels[idx, layer[free]] = label
+        depth[idx] += 1
+    return labels.reshape(w, h, PACKED_LAYERS).transpose(1, 0, 2)
+
+
+def write_packed_masks(path: str, masks: List[Any]) -> None:
+    """
+    写出打包掩码：labels.pack 为 pack_mask_labels 结果的4通道PNG编码，
+    masks.rle 为二进制RLE(小端)：b"MRLE"、版本、高、宽、掩码数(uint32)，
+    然后按labels中的编号顺序，每个掩码为 原始编号、面积、counts个数、counts(uint32，列优先，从背景开始)
+    masks为RLE时直接使用，为二值数组时先编码为RLE
+    """
+    rles = [
+        mask_to_rle_numpy(mask) if isinstance(mask, np.ndarray) else RLE.from_dict(mask)
+        for mask in masks
+    ]
+    order = mask_file_order(len(rles))
+    h, w = rles[0].size
+    labels = pack_mask_labels(rles, order)
+    ok, png = cv2.imencode(".png", labels, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    if not ok:
+        raise IOError(f"编码掩码失败: {path}")
+    with open(os.path.join(path, PACKED_LABELS_NAME), "wb") as f:
+        f.write(png.tobytes())
+
+    chunks = [b"MRLE", np.array([1, h, w, len(rles)], dtype="<u4").tobytes()]
+    for i in order:
+        counts = rles[i].counts
+        chunks.append(np.array([i, rles[i].area(), len(counts)], dtype="<u4").tobytes())
+        chunks.append(counts.astype("<u4").tobytes())
+    with open(os.path.join(path, PACKED_RLE_NAME), "wb") as f:
+        f.write(b"".join(chunks))
+
+
+def prefetch_batches(
+    targets: List[Tuple[str, str]],
+    load_image: Callable,
+    batch_size: int,
+    load_coverage: Optional[Callable] = None,
+) -> Iterator[List[Tuple[Tuple[str, str], Optional[np.ndarray], Optional[np.ndarray]]]]:
+    """
+    在后台线程中按批读取图片(RGB)，读取下一批的同时当前批在推理
+    产出 [((图片路径, 输出路径), 图像, 覆盖图)]，读取失败的图像为 None
+    给定load_coverage(图片路径, (宽, 高))时一并计算激光雷达覆盖图，否则覆盖图为 None
+    """
+    batches: "queue.Queue" = queue.Queue(maxsize=1)
+
+    def loader():
+        try:
+            for i in range(0, len(targets), batch_size):
+                batch = []
+                for target in targets[i : i + batch_size]:
+                    try:
+                        image = load_image(target[0])
+                    except Exception as e:
+                        print(f"读取图片 '{target[0]}' 出错: {e}")
+                        image = None
+                    coverage = None
+                    if image is not None:
+                        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                        if load_coverage is not None:
+                            try:
+                                coverage = load_coverage(target[0], image.shape[1::-1])
+                            except Exception as e:
+                                print(f"计算 '{target[0]}' 的激光雷达覆盖出错，使用完整的点网格: {e}")
+                    batch.append((target, image, coverage))
+                batches.put(batch)
+        finally:
+            batches.put(None)
+
+    threading.Thread(target=loader, daemon=True).start()
+    while True:
+        batch = batches.get()
+        if batch is None:
+            return
+        yield batch
+
+
+def lidar_coverage_loader(
+    camera_folder: str, extrinsic_file: str, data_dir: str, radius: int
+) -> Callable:
+    """
+    创建计算激光雷达覆盖图的函数：把同名帧的点云(<相机>/pointclouds/<帧>.pcd)
+    按外参投影到去畸变图像上，没有点云的帧返回 None(使用完整的点网格)
+    """
+    from calib_result import read_result
+    from projection import lidar_coverage_map, project_points_undistorted, read_pcd_points
+    from undistort import undistorted_camera_matrix
+
+    extrinsic = read_result(extrinsic_file).matrix()
+    camera_matrix = undistorted_camera_matrix(camera_folder, data_dir)
+    pointcloud_dir = os.path.join(data_dir, camera_folder, "pointclouds")
+
+    def load_coverage(image_path: str, image_size: Tuple[int, int]) -> Optional[np.ndarray]:
+        base = os.path.splitext(os.path.basename(image_path))[0]
+        pcd_file = os.path.join(pointcloud_dir, base + ".pcd")
+        if not os.path.exists(pcd_file):
+            print(f"警告：没有找到点云 '{pcd_file}'，使用完整的点网格")
+            return None
+        uv, valid = project_points_undistorted(
+            read_pcd_points(pcd_file), extrinsic, camera_matrix, image_size
+        )
+        return lidar_coverage_map(uv, valid, image_size, radius)
+
+    return load_coverage
+
+
+def wait_writes(futures: List[Future]) -> None:
+    """等待后台写文件完成，写入出错时在主线程抛出"""
+    for future in futures:
+        future.result()
 
 
 def get_amg_kwargs(args):
@@ -186,6 +495,7 @@ def get_amg_kwargs(args):
         "stability_score_thresh": args.stability_score_thresh,
         "stability_score_offset": args.stability_score_offset,
         "box_nms_thresh": args.box_nms_thresh,
+        "nms_mode": args.nms_mode,
         "crop_n_layers": args.crop_n_layers,
         "crop_nms_thresh": args.crop_nms_thresh,
         "crop_overlap_ratio": args.crop_overlap_ratio,
@@ -196,102 +506,177 @@ def get_amg_kwargs(args):
     return amg_kwargs
 
 
-def main(args: argparse.Namespace) -> None:
+def build_generator(args: argparse.Namespace) -> SamAutomaticMaskGenerator:
+    """按命令行参数加载模型(PyTorch或ONNXRuntime)并创建掩码生成器"""
+    use_onnx = args.onnx_encoder is not None or args.onnx_decoder is not None
+    if use_onnx and (args.onnx_encoder is None or args.onnx_decoder is None):
+        parser.error("--onnx-encoder and --onnx-decoder must be given together")
+    if not use_onnx and args.checkpoint is None:
+        parser.error("--checkpoint is required unless running with ONNXRuntime")
+
+    embedding_cache = None
+    if args.embedding_cache is not None:
+        embedding_cache = EmbeddingCache.for_checkpoint(
+            args.embedding_cache,
+            args.model_type,
+            args.onnx_encoder if use_onnx else args.checkpoint,
+        )
+
     print("Loading model...")
-    sam = sam_model_registry[args.model_type](checkpoint=args.checkpoint)
-    _ = sam.to(device=args.device)
-    output_mode = "coco_rle" if args.convert_to_rle else "binary_mask"
+    if use_onnx:
+        model = SamOnnxPredictor(
+            args.onnx_encoder,
+            args.onnx_decoder,
+            num_threads=args.onnx_threads,
+            embedding_cache=embedding_cache,
+        )
+    else:
+        model = sam_model_registry[args.model_type](checkpoint=args.checkpoint)
+        _ = model.to(device=args.device)
+    output_mode = "coco_rle" if args.convert_to_rle else folder_output_mode(args.mask_format)
     amg_kwargs = get_amg_kwargs(args)
-    generator = SamAutomaticMaskGenerator(sam, output_mode=output_mode, **amg_kwargs)
-
-    # 定义需要处理的 5 个 undistorted 文件夹
-    undistorted_folders = [
-        '../fisheye-front/undistorted',
-        '../fisheye-left/undistorted', 
-        '../fisheye-right/undistorted',
-        '../pinhole-back/undistorted',
-        '../pinhole-front/undistorted'
-    ]
-    output_folders = [
-        '../fisheye-front/masks',
-        '../fisheye-left/masks',
-        '../fisheye-right/masks',
-        '../pinhole-back/masks',
-        '../pinhole-front/masks'
+    amg_kwargs["embedding_cache"] = embedding_cache
+    amg_kwargs["coverage_mode"] = args.coverage_mode
+    return SamAutomaticMaskGenerator(model, output_mode=output_mode, **amg_kwargs)
+
+
+def main(args: argparse.Namespace) -> None:
+    generator = build_generator(args)
+    output_mode = generator.output_mode
+
+    # 需要处理的 5 个相机文件夹
+    camera_folders = [
+        'fisheye-front',
+        'fisheye-left',
+        'fisheye-right',
+        'pinhole-back',
+        'pinhole-front'
     ]
-    
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+    if args.lazy_undistort or args.lidar_extrinsic is not None:
+        sys.path.insert(0, data_dir)
+        sys.path.insert(0, os.path.join(data_dir, "..", "lidar2camera"))
+    if args.lazy_undistort:
+        from undistort import camera_image_provider
+
+    # 掩码文件在后台线程中写出，与下一批的推理重叠；最多积压一批未写完
+    writer = ThreadPoolExecutor(args.writer_threads) if args.writer_threads > 0 else None
+    pending_writes: List[List[Future]] = []
+
     total_processed = 0
     image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff')
-    
-    for folder_path, output_folder in zip(undistorted_folders, output_folders):
-        if not os.path.isdir(folder_path):
-            print(f"警告：文件夹 '{folder_path}' 不存在，跳过...")
-            continue           
-        
-        # 获取该文件夹中的所有图片文件
-        targets = [
-            f for f in os.listdir(folder_path) 
-            if not os.path.isdir(os.path.join(folder_path, f)) 
-            and f.lower().endswith(image_extensions)
-        ]
-        
+
+    for camera_folder in camera_folders:
+        folder_path = os.path.join('..', camera_folder, 'undistorted')
+        output_folder = os.path.join('..', camera_folder, 'masks')
+
+        if args.lazy_undistort:
+            # 直接从原始图像按需去畸变，不读取 undistorted 文件夹
+            provider = camera_image_provider(camera_folder, data_dir)
+            folder_path = provider.input_dir
+            targets = provider.names()
+            load_image = provider.get
+        else:
+            if not os.path.isdir(folder_path):
+                print(f"警告：文件夹 '{folder_path}' 不存在，跳过...")
+                continue
+
+            # 获取该文件夹中的所有图片文件
+            targets = [
+                os.path.join(folder_path, f) for f in os.listdir(folder_path)
+                if not os.path.isdir(os.path.join(folder_path, f))
+                and f.lower().endswith(image_extensions)
+            ]
+            load_image = cv2.imread
+
         if not targets:
             print(f"警告：在文件夹 '{folder_path}' 中没有找到图片文件，跳过...")
             continue
-            
-        targets = [os.path.join(folder_path, f) for f in targets]
-        
+
         print(f"\n开始处理文件夹 '{folder_path}'，包含 {len(targets)} 张图片：")
         for t in targets:
             print(f"- {os.path.basename(t)}")
-            
+
         os.makedirs(output_folder, exist_ok=True)
-        
+
+        # 按当前外参把点云投影到图像上，只在有激光雷达覆盖的区域撒点
+        load_coverage = None
+        if args.lidar_extrinsic is not None:
+            extrinsic_file = args.lidar_extrinsic.format(camera=camera_folder)
+            if os.path.exists(extrinsic_file):
+                load_coverage = lidar_coverage_loader(
+                    camera_folder, extrinsic_file, data_dir, args.coverage_radius
+                )
+            else:
+                print(f"警告：外参文件 '{extrinsic_file}' 不存在，使用完整的点网格")
+
+        # 先筛掉已有输出的图片，只把需要处理的图片交给读取线程
+        pending = []
         for t in targets:
             base = os.path.basename(t)
             base = os.path.splitext(base)[0]
             save_base = os.path.join(output_folder, base)
-            
+
             # 检查输出文件夹是否已存在
-            if output_mode == "binary_mask":
+            if output_mode != "coco_rle":
                 if os.path.exists(save_base) and os.listdir(save_base):
                     print(f"跳过 '{t}'，输出文件夹 '{save_base}' 已存在且不为空")
                     total_processed += 1
                     continue
             else:
-                save_file = save_base + ".json"
-                if os.path.exists(save_file):
-                    print(f"跳过 '{t}'，输出文件 '{save_file}' 已存在")
+                if os.path.exists(save_base + ".json"):
+                    print(f"跳过 '{t}'，输出文件 '{save_base}.json' 已存在")
                     total_processed += 1
                     continue
-            
-            print(f"正在处理 '{t}'...")
-            image = cv2.imread(t)
-            if image is None:
-                print(f"无法加载图片 '{t}'，跳过...")
+            pending.append((t, save_base))
+
+        # 读取线程预取下一批图片，与当前批的推理重叠
+        for batch in prefetch_batches(pending, load_image, args.batch_size, load_coverage):
+            for (t, _), image, _ in batch:
+                if image is None:
+                    print(f"无法加载图片 '{t}'，跳过...")
+            batch = [
+                (t, save_base, image, coverage)
+                for (t, save_base), image, coverage in batch
+                if image is not None
+            ]
+            if not batch:
                 continue
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-            masks = generator.generate(image)
-            
-            if output_mode == "binary_mask":
-                os.makedirs(save_base, exist_ok=True)
-                write_masks_to_folder(masks, save_base)
-                print(f"  -> 生成了 {len(masks)} 个掩码，保存到 '{save_base}'")
+            print(f"正在处理 {', '.join(repr(t) for t, _, _, _ in batch)}...")
+            if len(batch) == 1:
+                masks_batch = [generator.generate(batch[0][2], batch[0][3])]
             else:
-                with open(save_file, "w") as f:
-                    json.dump(masks, f)
-                print(f"  -> 生成了 {len(masks)} 个掩码，保存到 '{save_file}'")
-            
-            total_processed += 1
-            
+                masks_batch = generator.generate_batch(
+                    [image for _, _, image, _ in batch], [coverage for _, _, _, coverage in batch]
+                )
+
+            while pending_writes:
+                wait_writes(pending_writes.pop(0))
+            batch_writes: List[Future] = []
+            for (t, save_base, _, _), masks in zip(batch, masks_batch):
+                if output_mode != "coco_rle":
+                    os.makedirs(save_base, exist_ok=True)
+                    batch_writes += write_masks_to_folder(
+                        masks, save_base, writer, args.mask_format
+                    )
+                    print(f"  -> 生成了 {len(masks)} 个掩码，保存到 '{save_base}'")
+                else:
+                    save_file = save_base + ".json"
+                    with open(save_file, "w") as f:
+                        json.dump(masks, f)
+                    print(f"  -> 生成了 {len(masks)} 个掩码，保存到 '{save_file}'")
+
+                total_processed += 1
+            pending_writes.append(batch_writes)
+
             # 清理内存和显存
-            del image, masks
+            del batch, masks_batch
             gc.collect()
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
                 print(f"  -> 已清理显存，当前显存使用: {torch.cuda.memory_allocated() / 1024**2:.1f} MB")
-        
+
         # 处理完一个文件夹后的深度清理
         print(f"完成文件夹 '{folder_path}' 的处理，进行深度内存清理...")
         gc.collect()
@@ -300,6 +685,10 @@ def main(args: argparse.Namespace) -> None:
             torch.cuda.synchronize()
             print(f"深度清理后显存使用: {torch.cuda.memory_allocated() / 1024**2:.1f} MB")
             
+    for futures in pending_writes:
+        wait_writes(futures)
+    if writer is not None:
+        writer.shutdown()
     print(f"\n处理完成！总共处理了 {total_processed} 张图片。")
     
     # 最终清理
@@ -7,7 +7,7 @@
 import torch
 
 from segment_anything import sam_model_registry
-from segment_anything.utils.onnx import SamOnnxModel
+from segment_anything.utils.onnx import SamOnnxEncoder, SamOnnxModel
 
 import argparse
 import warnings
@@ -20,7 +20,10 @@ except ImportError:
     onnxruntime_exists = False
 
 parser = argparse.ArgumentParser(
-    description="Export the SAM prompt encoder and mask decoder to an ONNX model."
+    description=(
+        "Export the SAM prompt encoder and mask decoder to an ONNX model, "
+        "and optionally the image encoder to a second ONNX model."
+    )
 )
 
 parser.add_argument(
@@ -65,6 +68,28 @@ parser.add_argument(
     ),
 )
 
+parser.add_argument(
+    "--encoder-output",
+    type=str,
+    default=None,
+    help=(
+        "If set, will also export the image encoder, including pixel normalization, "
+        "to this filename. Together with the decoder this allows running automatic "
+        "mask generation with ONNXRuntime only, see SamOnnxPredictor."
+    ),
+)
+
+parser.add_argument(
+    "--encoder-quantize-out",
+    type=str,
+    default=None,
+    help=(
+        "If set, will apply dynamic int8 quantization to the exported image encoder "
+        "and save it with this name. This is usually much faster on the CPU, at a "
+        "small cost in mask quality."
+    ),
+)
+
 parser.add_argument(
     "--gelu-approximate",
     action="store_true",
@@ -119,9 +144,11 @@ def run_export(
             if isinstance(m, torch.nn.GELU):
                 m.approximate = "tanh"
 
+    # Prompts can be batched, e.g. one point per prompt for automatic mask generation
     dynamic_axes = {
-        "point_coords": {1: "num_points"},
-        "point_labels": {1: "num_points"},
+        "point_coords": {0: "num_prompts", 1: "num_points"},
+        "point_labels": {0: "num_prompts", 1: "num_points"},
+        "mask_input": {0: "num_mask_inputs"},
     }
 
     embed_dim = sam.prompt_encoder.embed_dim
@@ -167,6 +194,74 @@ def run_export(
         print("Model has successfully been run with ONNXRuntime.")
 
 
+def run_encoder_export(
+    model_type: str,
+    checkpoint: str,
+    output: str,
+    opset: int,
+    gelu_approximate: bool = False,
+):
+    print("Loading model...")
+    sam = sam_model_registry[model_type](checkpoint=checkpoint)
+
+    onnx_model = SamOnnxEncoder(model=sam)
+
+    if gelu_approximate:
+        for n, m in onnx_model.named_modules():
+            if isinstance(m, torch.nn.GELU):
+                m.approximate = "tanh"
+
+    img_size = sam.image_encoder.img_size
+    dummy_inputs = {
+        "input_image": torch.randint(0, 255, (1, 3, img_size, img_size), dtype=torch.float),
+    }
+
+    _ = onnx_model(**dummy_inputs)
+
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=torch.jit.TracerWarning)
+        warnings.filterwarnings("ignore", category=UserWarning)
+        print(f"Exporting onnx image encoder to {output}...")
+        # Export to a path rather than a file object, so that weights of the
+        # larger backbones (>2GB) can be stored as external data.
+        torch.onnx.export(
+            onnx_model,
+            tuple(dummy_inputs.values()),
+            output,
+            export_params=True,
+            verbose=False,
+            opset_version=opset,
+            do_constant_folding=True,
+            input_names=list(dummy_inputs.keys()),
+            output_names=["image_embeddings"],
+        )
+
+    if onnxruntime_exists:
+        ort_inputs = {k: to_numpy(v) for k, v in dummy_inputs.items()}
+        providers = ["CPUExecutionProvider"]
+        ort_session = onnxruntime.InferenceSession(output, providers=providers)
+        _ = ort_session.run(None, ort_inputs)
+        print("Image encoder has successfully been run with ONNXRuntime.")
+
+
+def run_quantize(model_input: str, model_output: str, use_external_data_format: bool = False):
+    assert onnxruntime_exists, "onnxruntime is required to quantize the model."
+    from onnxruntime.quantization import QuantType  # type: ignore
+    from onnxruntime.quantization.quantize import quantize_dynamic  # type: ignore
+
+    print(f"Quantizing model and writing to {model_output}...")
+    quantize_dynamic(
+        model_input=model_input,
+        model_output=model_output,
+        optimize_model=True,
+        per_channel=False,
+        reduce_range=False,
+        weight_type=QuantType.QUInt8,
+        use_external_data_format=use_external_data_format,
+    )
+    print("Done!")
+
+
 def to_numpy(tensor):
     return tensor.cpu().numpy()
 
@@ -185,17 +280,18 @@ if __name__ == "__main__":
     )
 
     if args.quantize_out is not None:
-        assert onnxruntime_exists, "onnxruntime is required to quantize the model."
-        from onnxruntime.quantization import QuantType  # type: ignore
-        from onnxruntime.quantization.quantize import quantize_dynamic  # type: ignore
-
-        print(f"Quantizing model and writing to {args.quantize_out}...")
-        quantize_dynamic(
-            model_input=args.output,
-            model_output=args.quantize_out,
-            optimize_model=True,
-            per_channel=False,
-            reduce_range=False,
-            weight_type=QuantType.QUInt8,
+        run_quantize(args.output, args.quantize_out)
+
+    if args.encoder_output is not None:
+        run_encoder_export(
+            model_type=args.model_type,
+            checkpoint=args.checkpoint,
+            output=args.encoder_output,
+            opset=args.opset,
+            gelu_approximate=args.gelu_approximate,
         )
-        print("Done!")
+
+    if args.encoder_quantize_out is not None:
+        assert args.encoder_output is not None, "--encoder-quantize-out requires --encoder-output."
+        # The vit_h encoder exceeds the 2GB protobuf limit while it is being quantized.
+        run_quantize(args.encoder_output, args.encoder_quantize_out, use_external_data_format=True)
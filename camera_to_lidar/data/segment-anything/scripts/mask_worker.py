@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+常驻的掩码生成进程：模型只加载一次，之后通过本地socket(或进程内的队列)接收任务，
+每个任务生成一张图片的掩码，不需要重新启动、也不在每张图片后清理显存
+
+启动(模型参数与amg.py相同):
+    python scripts/mask_worker.py --address /tmp/sam_mask_worker.sock -- \
+        --checkpoint sam_vit_l_0b3195.pth --model-type vit_l --stability-score-thresh 0.9
+
+提交任务:
+    python scripts/mask_worker.py --address /tmp/sam_mask_worker.sock \
+        --submit ../fisheye-front/undistorted/*.png --output-dir ../fisheye-front/masks
+
+任务是一个dict:
+    image: 图片路径(按BGR读取)或HWC uint8的RGB数组
+    output: 掩码输出文件夹；以.json结尾时写COCO RLE格式的JSON；为None时不写文件
+    mask_format: png / packed / both，默认使用启动时的设置
+    coverage: 可选的HxW激光雷达覆盖图，只在覆盖区域撒点(见projection.lidar_coverage_map)
+    return_masks: 为True时在结果中返回掩码记录
+返回 {"ok": True, "num_masks": ..., "output": ..., "seconds": ...}，出错时为 {"ok": False, "error": ...}
+"""
+
+import cv2  # type: ignore
+import numpy as np
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener
+from typing import Any, Dict, List, Optional
+
+import amg
+
+DEFAULT_ADDRESS = "/tmp/sam_mask_worker.sock"
+
+
+class MaskWorker:
+    """
+    持有一个已加载模型的掩码生成器，依次处理队列中的任务
+    任务可以在进程内用submit提交，也可以由serve从socket接收
+    """
+
+    def __init__(self, generator, writer_threads: int = 4, mask_format: str = "png"):
+        self.generator = generator
+        self.mask_format = mask_format
+        self.writer = ThreadPoolExecutor(writer_threads) if writer_threads > 0 else None
+        self.jobs: "queue.Queue" = queue.Queue()
+        # 同一路相机的图片尺寸相同，RGB转换的目标数组在任务之间复用
+        self._rgb: Optional[np.ndarray] = None
+
+    def submit(self, job: Dict[str, Any]) -> Future:
+        """提交一个任务，返回的Future在掩码写完后得到结果"""
+        future: Future = Future()
+        self.jobs.put((job, future))
+        return future
+
+    def stop(self) -> None:
+        self.jobs.put(None)
+
+    def run(self) -> None:
+        """在当前线程中处理任务，直到调用stop"""
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                break
+            job, future = item
+            try:
+                response, writes = self.process(job)
+            except Exception as e:
+                future.set_result({"ok": False, "error": f"{type(e).__name__}: {e}"})
+                continue
+            # 写文件在后台进行，主循环直接处理下一个任务；写完后才返回结果
+            resolve_after_writes(future, response, writes)
+        if self.writer is not None:
+            self.writer.shutdown()
+
+    def process(self, job: Dict[str, Any]):
+        """生成一张图片的掩码，返回(结果, 写文件的Future列表)"""
+        start = time.time()
+        image = job["image"]
+        if isinstance(image, str):
+            path = image
+            image = cv2.imread(path)
+            if image is None:
+                raise IOError(f"无法加载图片 '{path}'")
+            if self._rgb is None or self._rgb.shape != image.shape:
+                self._rgb = np.empty_like(image)
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+        output = job.get("output")
+        to_json = output is not None and output.endswith(".json")
+        mask_format = job.get("mask_format", self.mask_format)
+        # 输出形式随任务传给generate，不修改生成器本身的设置
+        if to_json:
+            output_mode = "coco_rle"
+        elif output is not None and not job.get("return_masks"):
+            output_mode = amg.folder_output_mode(mask_format)
+        else:
+            output_mode = "binary_mask"
+        masks = self.generator.generate(
+            np.ascontiguousarray(image), job.get("coverage"), output_mode=output_mode
+        )
+
+        writes: List[Future] = []
+        if to_json:
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            with open(output, "w") as f:
+                json.dump(masks, f)
+        elif output is not None:
+            os.makedirs(output, exist_ok=True)
+            writes = amg.write_masks_to_folder(masks, output, self.writer, mask_format)
+
+        response = {
+            "ok": True,
+            "num_masks": len(masks),
+            "output": output,
+            "seconds": time.time() - start,
+        }
+        if job.get("return_masks"):
+            response["masks"] = masks
+        return response, writes
+
+    def serve(self, address: str, authkey: Optional[bytes] = None) -> None:
+        """在address上接收任务，每个连接一个线程，任务仍然依次交给模型处理"""
+        if isinstance(address, str) and os.path.exists(address):
+            # 地址上已有进程在监听时不接管，只清理上次异常退出留下的socket文件
+            if is_listening(address):
+                raise RuntimeError(f"地址 {address} 上已有掩码生成进程在运行")
+            os.remove(address)
+        listener = Listener(address, authkey=authkey)
+        closed = threading.Event()
+        print(f"掩码生成进程已启动，等待任务: {address}")
+
+        def accept():
+            while True:
+                try:
+                    conn = listener.accept()
+                except OSError as e:
+                    if closed.is_set():
+                        return
+                    print(f"接受连接失败: {e}")
+                    continue
+                except Exception as e:
+                    print(f"接受连接失败: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        try:
+            self.run()
+        finally:
+            closed.set()
+            listener.close()
+
+    def handle(self, conn) -> None:
+        """一个客户端连接：依次接收任务并返回结果，收到None或连接断开时结束"""
+        with conn:
+            while True:
+                try:
+                    job = conn.recv()
+                except EOFError:
+                    return
+                if job is None:
+                    return
+                try:
+                    conn.send(self.submit(job).result())
+                except OSError:
+                    return
+
+
+def is_listening(address: str) -> bool:
+    """address上是否有进程在监听(能建立连接)"""
+    try:
+        Client(address).close()
+    except OSError:
+        return False
+    return True
+
+
+def resolve_after_writes(future: Future, response: Dict[str, Any], writes: List[Future]) -> None:
+    """所有写文件完成后设置任务结果，写入出错时返回错误"""
+    if not writes:
+        future.set_result(response)
+        return
+    remaining = [len(writes)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        errors = [w.exception() for w in writes if w.exception() is not None]
+        if errors:
+            future.set_result({"ok": False, "error": f"写入掩码失败: {errors[0]}"})
+        else:
+            future.set_result(response)
+
+    for w in writes:
+        w.add_done_callback(done)
+
+
+def submit_jobs(address: str, jobs: List[Dict[str, Any]], authkey: Optional[bytes] = None):
+    """把任务依次发送给常驻进程，返回每个任务的结果"""
+    results = []
+    with Client(address, authkey=authkey) as conn:
+        for job in jobs:
+            conn.send(job)
+            results.append(conn.recv())
+        conn.send(None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="常驻的掩码生成进程；不带--submit时启动进程，'--'之后的参数与amg.py相同",
+        allow_abbrev=False,
+    )
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS,
+                        help="本地socket地址(Unix socket路径)")
+    parser.add_argument("--authkey", type=str, default=None, help="连接认证密钥")
+    parser.add_argument("--submit", type=str, nargs="+", default=None,
+                        help="作为客户端提交这些图片")
+    parser.add_argument("--output-dir", type=str, default=None,
+                        help="提交时的掩码输出目录，每张图片输出到 <output-dir>/<图片名>")
+    parser.add_argument("--json", action="store_true",
+                        help="提交时输出COCO RLE格式的 <output-dir>/<图片名>.json")
+    args, amg_argv = parser.parse_known_args()
+    authkey = args.authkey.encode() if args.authkey is not None else None
+
+    if args.submit is not None:
+        if args.output_dir is None:
+            parser.error("--submit 需要 --output-dir")
+        jobs = []
+        for image_path in args.submit:
+            base = os.path.splitext(os.path.basename(image_path))[0]
+            output = os.path.join(args.output_dir, base + (".json" if args.json else ""))
+            jobs.append({"image": os.path.abspath(image_path), "output": os.path.abspath(output)})
+        for job, result in zip(jobs, submit_jobs(args.address, jobs, authkey)):
+            if result["ok"]:
+                print(f"{job['image']}: 生成了 {result['num_masks']} 个掩码，"
+                      f"用时 {result['seconds']:.1f}s，保存到 '{result['output']}'")
+            else:
+                print(f"{job['image']}: 失败，{result['error']}")
+        return
+
+    if amg_argv and amg_argv[0] == "--":
+        amg_argv = amg_argv[1:]
+    amg_args = amg.parser.parse_args(amg_argv)
+    worker = MaskWorker(
+        amg.build_generator(amg_args), amg_args.writer_threads, amg_args.mask_format
+    )
+    try:
+        worker.serve(args.address, authkey)
+    except KeyboardInterrupt:
+        print("掩码生成进程已退出")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,3 +13,4 @@ from .build_sam import (
 )
 from .predictor import SamPredictor
 from .automatic_mask_generator import SamAutomaticMaskGenerator
+from .onnx_predictor import SamOnnxPredictor
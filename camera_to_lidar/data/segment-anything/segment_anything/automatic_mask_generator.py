@@ -8,24 +8,29 @@ import numpy as np
 import torch
 from torchvision.ops.boxes import batched_nms, box_area  # type: ignore
 
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from .modeling import Sam
 from .predictor import SamPredictor
+from .utils.embedding_cache import EmbeddingCache
 from .utils.amg import (
     MaskData,
     area_from_rle,
     batch_iterator,
     batched_mask_to_box,
     box_xyxy_to_xywh,
+    boxes_from_rles,
     build_all_layer_point_grids,
     calculate_stability_score,
     coco_encode_rle,
     generate_crop_boxes,
     is_box_near_crop_edge,
-    mask_to_rle_pytorch,
-    remove_small_regions,
+    mask_to_rle_compact_pytorch,
+    remove_small_regions_rle,
+    rle_nms,
     rle_to_mask,
+    select_points_by_coverage,
     uncrop_boxes_xyxy,
     uncrop_masks,
     uncrop_points,
@@ -35,7 +40,7 @@ from .utils.amg import (
 class SamAutomaticMaskGenerator:
     def __init__(
         self,
-        model: Sam,
+        model: Union[Sam, SamPredictor],
         points_per_side: Optional[int] = 32,
         points_per_batch: int = 64,
         pred_iou_thresh: float = 0.88,
@@ -49,6 +54,10 @@ class SamAutomaticMaskGenerator:
         point_grids: Optional[List[np.ndarray]] = None,
         min_mask_region_area: int = 0,
         output_mode: str = "binary_mask",
+        nms_mode: str = "box",
+        postprocess_workers: Optional[int] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        coverage_mode: str = "mask",
     ) -> None:
         """
         Using a SAM model, generates masks for the entire image.
@@ -57,7 +66,9 @@ class SamAutomaticMaskGenerator:
         for SAM with a ViT-H backbone.
 
         Arguments:
-          model (Sam): The SAM model to use for mask prediction.
+          model (Sam or SamPredictor): The SAM model to use for mask prediction,
+            or a predictor to run it with, such as a SamOnnxPredictor that runs
+            exported ONNX models on the CPU.
           points_per_side (int or None): The number of points to be sampled
             along one side of the image. The total number of points is
             points_per_side**2. If None, 'point_grids' must provide explicit
@@ -93,6 +104,21 @@ class SamAutomaticMaskGenerator:
             'uncompressed_rle', or 'coco_rle'. 'coco_rle' requires pycocotools.
             For large resolutions, 'binary_mask' may consume large amounts of
             memory.
+          nms_mode (str): How duplicate masks are measured during non-maximal
+            suppression. 'box' uses the IoU of the masks' bounding boxes.
+            'mask' uses the true mask IoU, computed on the RLEs without
+            decoding them to dense masks.
+          postprocess_workers (int or None): The number of threads used to
+            remove small regions when min_mask_region_area > 0. If None, uses
+            the ThreadPoolExecutor default.
+          embedding_cache (EmbeddingCache or None): An on-disk cache of image
+            embeddings. Re-running with different thresholds on the same
+            images then only runs the mask decoder. Ignored if model is a
+            SamPredictor, which carries its own cache.
+          coverage_mode (str): How a coverage map passed to 'generate' prunes
+            the point grid. 'mask' drops the points where the coverage is zero.
+            'density' keeps a share of the points equal to the coverage, which
+            is expected in [0,1].
         """
 
         assert (points_per_side is None) != (
@@ -109,18 +135,16 @@ class SamAutomaticMaskGenerator:
         else:
             raise ValueError("Can't have both points_per_side and point_grid be None.")
 
-        assert output_mode in [
-            "binary_mask",
-            "uncompressed_rle",
-            "coco_rle",
-        ], f"Unknown output_mode {output_mode}."
-        if output_mode == "coco_rle":
-            from pycocotools import mask as mask_utils  # type: ignore # noqa: F401
-
+        self._check_output_mode(output_mode)
+        assert nms_mode in ["box", "mask"], f"Unknown nms_mode {nms_mode}."
+        assert coverage_mode in ["mask", "density"], f"Unknown coverage_mode {coverage_mode}."
         if min_mask_region_area > 0:
             import cv2  # type: ignore # noqa: F401
 
-        self.predictor = SamPredictor(model)
+        if isinstance(model, SamPredictor):
+            self.predictor = model
+        else:
+            self.predictor = SamPredictor(model, embedding_cache)
         self.points_per_batch = points_per_batch
         self.pred_iou_thresh = pred_iou_thresh
         self.stability_score_thresh = stability_score_thresh
@@ -132,14 +156,42 @@ class SamAutomaticMaskGenerator:
         self.crop_n_points_downscale_factor = crop_n_points_downscale_factor
         self.min_mask_region_area = min_mask_region_area
         self.output_mode = output_mode
+        self.nms_mode = nms_mode
+        self.postprocess_workers = postprocess_workers
+        self.coverage_mode = coverage_mode
+        # Point prompts of a batch, kept between batches to avoid reallocating them
+        self._point_buffer: Optional[torch.Tensor] = None
+        self._label_buffer: Optional[torch.Tensor] = None
+
+    @staticmethod
+    def _check_output_mode(output_mode: str) -> None:
+        assert output_mode in [
+            "binary_mask",
+            "uncompressed_rle",
+            "coco_rle",
+        ], f"Unknown output_mode {output_mode}."
+        if output_mode == "coco_rle":
+            from pycocotools import mask as mask_utils  # type: ignore # noqa: F401
 
     @torch.no_grad()
-    def generate(self, image: np.ndarray) -> List[Dict[str, Any]]:
+    def generate(
+        self,
+        image: np.ndarray,
+        coverage: Optional[np.ndarray] = None,
+        output_mode: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
         """
         Generates masks for the given image.
 
         Arguments:
           image (np.ndarray): The image to generate masks for, in HWC uint8 format.
+          coverage (np.ndarray or None): An HW map of where masks are wanted,
+            such as the density of lidar points projected into the image.
+            Grid points are pruned with it according to coverage_mode, and
+            crops left without points are not encoded. If None, the full
+            point grid is used.
+          output_mode (str or None): The form masks are returned in for this
+            call, overriding the generator's output_mode if given.
 
         Returns:
            list(dict(str, any)): A list over records for masks. Each record is
@@ -158,9 +210,77 @@ class SamAutomaticMaskGenerator:
                crop_box (list(float)): The crop of the image used to generate
                  the mask, given in XYWH format.
         """
+        _, crop_points = self._crop_points_for_image(image.shape[:2], coverage)
+        return self._generate(image, crop_points, output_mode=output_mode)
+
+    @torch.no_grad()
+    def generate_batch(
+        self,
+        images: List[np.ndarray],
+        coverages: Optional[List[Optional[np.ndarray]]] = None,
+        output_mode: Optional[str] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Generates masks for several images. The image encoder runs once on
+        the crops of all images together, which uses the hardware better than
+        encoding one image at a time; the point grids are then decoded image
+        by image. Memory use of the encoder grows with the number of images.
+
+        Arguments:
+          images (list(np.ndarray)): The images to generate masks for, each in
+            HWC uint8 format. The images may have different sizes.
+          coverages (list(np.ndarray or None) or None): A coverage map for
+            each image, as in 'generate'.
+          output_mode (str or None): Overrides the generator's output_mode,
+            as in 'generate'.
+
+        Returns:
+          list(list(dict(str, any))): For each image, the mask records as
+            returned by 'generate'.
+        """
+        if coverages is None:
+            coverages = [None] * len(images)
+        # Only the crops with points left after pruning are encoded
+        image_crop_points = []
+        transformed_crops = []
+        for image, coverage in zip(images, coverages):
+            crop_boxes, crop_points = self._crop_points_for_image(image.shape[:2], coverage)
+            for (x0, y0, x1, y1), points in zip(crop_boxes, crop_points):
+                if len(points) > 0:
+                    transformed_crops.append(self.predictor.prepare_image(image[y0:y1, x0:x1, :]))
+            image_crop_points.append(crop_points)
+        embeddings = (
+            self.predictor.encode_torch_images(transformed_crops) if transformed_crops else None
+        )
+        del transformed_crops
+
+        records = []
+        start = 0
+        for image, crop_points in zip(images, image_crop_points):
+            crop_embeddings: List[Optional[torch.Tensor]] = []
+            for points in crop_points:
+                if len(points) > 0:
+                    crop_embeddings.append(embeddings[start : start + 1])  # type: ignore
+                    start += 1
+                else:
+                    crop_embeddings.append(None)
+            records.append(self._generate(image, crop_points, crop_embeddings, output_mode))
+        return records
+
+    def _generate(
+        self,
+        image: np.ndarray,
+        crop_points: List[np.ndarray],
+        crop_embeddings: Optional[List[Optional[torch.Tensor]]] = None,
+        output_mode: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        if output_mode is None:
+            output_mode = self.output_mode
+        else:
+            self._check_output_mode(output_mode)
 
         # Generate masks
-        mask_data = self._generate_masks(image)
+        mask_data = self._generate_masks(image, crop_points, crop_embeddings)
 
         # Filter small disconnected regions and holes in masks
         if self.min_mask_region_area > 0:
@@ -168,15 +288,17 @@ class SamAutomaticMaskGenerator:
                 mask_data,
                 self.min_mask_region_area,
                 max(self.box_nms_thresh, self.crop_nms_thresh),
+                self.nms_mode,
+                self.postprocess_workers,
             )
 
         # Encode masks
-        if self.output_mode == "coco_rle":
+        if output_mode == "coco_rle":
             mask_data["segmentations"] = [coco_encode_rle(rle) for rle in mask_data["rles"]]
-        elif self.output_mode == "binary_mask":
+        elif output_mode == "binary_mask":
             mask_data["segmentations"] = [rle_to_mask(rle) for rle in mask_data["rles"]]
         else:
-            mask_data["segmentations"] = mask_data["rles"]
+            mask_data["segmentations"] = [rle.to_dict() for rle in mask_data["rles"]]
 
         # Write mask records
         curr_anns = []
@@ -194,16 +316,21 @@ class SamAutomaticMaskGenerator:
 
         return curr_anns
 
-    def _generate_masks(self, image: np.ndarray) -> MaskData:
+    def _generate_masks(
+        self,
+        image: np.ndarray,
+        crop_points: List[np.ndarray],
+        crop_embeddings: Optional[List[Optional[torch.Tensor]]] = None,
+    ) -> MaskData:
         orig_size = image.shape[:2]
-        crop_boxes, layer_idxs = generate_crop_boxes(
-            orig_size, self.crop_n_layers, self.crop_overlap_ratio
-        )
+        crop_boxes, _ = generate_crop_boxes(orig_size, self.crop_n_layers, self.crop_overlap_ratio)
+        if crop_embeddings is None:
+            crop_embeddings = [None] * len(crop_boxes)  # type: ignore
 
         # Iterate over image crops
         data = MaskData()
-        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
-            crop_data = self._process_crop(image, crop_box, layer_idx, orig_size)
+        for crop_box, points, embedding in zip(crop_boxes, crop_points, crop_embeddings):
+            crop_data = self._process_crop(image, crop_box, points, orig_size, embedding)
             data.cat(crop_data)
 
         # Remove duplicate masks between crops
@@ -211,11 +338,8 @@ class SamAutomaticMaskGenerator:
             # Prefer masks from smaller crops
             scores = 1 / box_area(data["crop_boxes"])
             scores = scores.to(data["boxes"].device)
-            keep_by_nms = batched_nms(
-                data["boxes"].float(),
-                scores,
-                torch.zeros_like(data["boxes"][:, 0]),  # categories
-                iou_threshold=self.crop_nms_thresh,
+            keep_by_nms = self.remove_duplicates(
+                data["rles"], data["boxes"], scores, self.crop_nms_thresh, self.nms_mode
             )
             data.filter(keep_by_nms)
 
@@ -226,18 +350,32 @@ class SamAutomaticMaskGenerator:
         self,
         image: np.ndarray,
         crop_box: List[int],
-        crop_layer_idx: int,
+        points_for_image: np.ndarray,
         orig_size: Tuple[int, ...],
+        embedding: Optional[torch.Tensor] = None,
     ) -> MaskData:
-        # Crop the image and calculate embeddings
+        # Skip the crop if no points are left after pruning
+        if len(points_for_image) == 0:
+            return MaskData(
+                rles=[],
+                boxes=torch.zeros((0, 4), dtype=torch.long),
+                iou_preds=torch.zeros(0),
+                points=torch.zeros((0, 2), dtype=torch.float64),
+                stability_score=torch.zeros(0),
+                crop_boxes=torch.zeros((0, 4), dtype=torch.long),
+            )
+
+        # Crop the image and calculate embeddings, unless they were precomputed
         x0, y0, x1, y1 = crop_box
         cropped_im = image[y0:y1, x0:x1, :]
         cropped_im_size = cropped_im.shape[:2]
-        self.predictor.set_image(cropped_im)
-
-        # Get points for this crop
-        points_scale = np.array(cropped_im_size)[None, ::-1]
-        points_for_image = self.point_grids[crop_layer_idx] * points_scale
+        if embedding is None:
+            self.predictor.set_image(cropped_im)
+        else:
+            input_size = self.predictor.transform.get_preprocess_shape(
+                *cropped_im_size, self.predictor.transform.target_length
+            )
+            self.predictor.set_image_embedding(embedding, cropped_im_size, input_size)
 
         # Generate masks for this crop in batches
         data = MaskData()
@@ -248,11 +386,8 @@ class SamAutomaticMaskGenerator:
         self.predictor.reset_image()
 
         # Remove duplicates within this crop.
-        keep_by_nms = batched_nms(
-            data["boxes"].float(),
-            data["iou_preds"],
-            torch.zeros_like(data["boxes"][:, 0]),  # categories
-            iou_threshold=self.box_nms_thresh,
+        keep_by_nms = self.remove_duplicates(
+            data["rles"], data["boxes"], data["iou_preds"], self.box_nms_thresh, self.nms_mode
         )
         data.filter(keep_by_nms)
 
@@ -263,6 +398,51 @@ class SamAutomaticMaskGenerator:
 
         return data
 
+    def _crop_points_for_image(
+        self, orig_size: Tuple[int, ...], coverage: Optional[np.ndarray] = None
+    ) -> Tuple[List[List[int]], List[np.ndarray]]:
+        """
+        Returns the crop boxes of an image and the point prompts of each
+        crop in crop coordinates, pruned with the coverage map if given.
+        """
+        if coverage is not None:
+            assert coverage.shape[:2] == orig_size, "The coverage map must match the image size."
+        crop_boxes, layer_idxs = generate_crop_boxes(
+            orig_size, self.crop_n_layers, self.crop_overlap_ratio
+        )
+        crop_points = []
+        for (x0, y0, x1, y1), layer_idx in zip(crop_boxes, layer_idxs):
+            points_scale = np.array([[x1 - x0, y1 - y0]])
+            points_for_image = self.point_grids[layer_idx] * points_scale
+            if coverage is not None:
+                keep = select_points_by_coverage(
+                    points_for_image, coverage[y0:y1, x0:x1], self.coverage_mode
+                )
+                points_for_image = points_for_image[keep]
+            crop_points.append(points_for_image)
+        return crop_boxes, crop_points
+
+    def _point_prompts(self, points: np.ndarray) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Copies a batch of transformed points into the reused prompt buffers,
+        returning views of the points and their (foreground) labels.
+        """
+        n, device = len(points), self.predictor.device
+        src = torch.from_numpy(points)
+        if (
+            self._point_buffer is None
+            or self._point_buffer.shape[0] < n
+            or self._point_buffer.dtype != src.dtype
+            or self._point_buffer.device != device
+        ):
+            size = max(n, self.points_per_batch)
+            self._point_buffer = torch.empty((size, 2), dtype=src.dtype, device=device)
+            self._label_buffer = torch.ones(size, dtype=torch.int, device=device)
+        assert self._label_buffer is not None
+        in_points = self._point_buffer[:n]
+        in_points.copy_(src)
+        return in_points, self._label_buffer[:n]
+
     def _process_batch(
         self,
         points: np.ndarray,
@@ -274,8 +454,7 @@ class SamAutomaticMaskGenerator:
 
         # Run model on this batch
         transformed_points = self.predictor.transform.apply_coords(points, im_size)
-        in_points = torch.as_tensor(transformed_points, device=self.predictor.device)
-        in_labels = torch.ones(in_points.shape[0], dtype=torch.int, device=in_points.device)
+        in_points, in_labels = self._point_prompts(transformed_points)
         masks, iou_preds, _ = self.predictor.predict_torch(
             in_points[:, None, :],
             in_labels[:, None],
@@ -298,14 +477,14 @@ class SamAutomaticMaskGenerator:
 
         # Calculate stability score
         data["stability_score"] = calculate_stability_score(
-            data["masks"], self.predictor.model.mask_threshold, self.stability_score_offset
+            data["masks"], self.predictor.mask_threshold, self.stability_score_offset
         )
         if self.stability_score_thresh > 0.0:
             keep_mask = data["stability_score"] >= self.stability_score_thresh
             data.filter(keep_mask)
 
         # Threshold masks and calculate boxes
-        data["masks"] = data["masks"] > self.predictor.model.mask_threshold
+        data["masks"] = data["masks"] > self.predictor.mask_threshold
         data["boxes"] = batched_mask_to_box(data["masks"])
 
         # Filter boxes that touch crop boundaries
@@ -313,20 +492,54 @@ class SamAutomaticMaskGenerator:
         if not torch.all(keep_mask):
             data.filter(keep_mask)
 
-        # Compress to RLE
+        # Compress to compact RLEs
         data["masks"] = uncrop_masks(data["masks"], crop_box, orig_h, orig_w)
-        data["rles"] = mask_to_rle_pytorch(data["masks"])
+        data["rles"] = mask_to_rle_compact_pytorch(data["masks"])
         del data["masks"]
 
         return data
 
+    @staticmethod
+    def remove_duplicates(
+        rles: List[Any],
+        boxes: torch.Tensor,
+        scores: torch.Tensor,
+        iou_threshold: float,
+        nms_mode: str = "box",
+    ) -> torch.Tensor:
+        """
+        Runs non-maximal suppression over masks and returns the indices to
+        keep in decreasing score order. With nms_mode='box' the boxes are
+        compared, with nms_mode='mask' the RLEs are compared directly.
+        """
+        if nms_mode == "mask":
+            keep = rle_nms(
+                rles,
+                torch.as_tensor(scores).cpu().numpy(),
+                iou_threshold,
+                boxes=torch.as_tensor(boxes).cpu().numpy(),
+            )
+            return torch.as_tensor(keep, dtype=torch.long)
+        boxes = torch.as_tensor(boxes)
+        return batched_nms(
+            boxes.float(),
+            torch.as_tensor(scores, device=boxes.device),
+            torch.zeros_like(boxes[:, 0]),  # categories
+            iou_threshold=iou_threshold,
+        )
+
     @staticmethod
     def postprocess_small_regions(
-        mask_data: MaskData, min_area: int, nms_thresh: float
+        mask_data: MaskData,
+        min_area: int,
+        nms_thresh: float,
+        nms_mode: str = "box",
+        num_workers: Optional[int] = None,
     ) -> MaskData:
         """
         Removes small disconnected regions and holes in masks, then reruns
-        box NMS to remove any new duplicates.
+        NMS to remove any new duplicates. Masks are processed on crops around
+        their boxes across a thread pool, since OpenCV releases the GIL.
 
         Edits mask_data in place.
 
@@ -336,36 +549,25 @@ class SamAutomaticMaskGenerator:
             return mask_data
 
         # Filter small disconnected regions and holes
-        new_masks = []
-        scores = []
-        for rle in mask_data["rles"]:
-            mask = rle_to_mask(rle)
-
-            mask, changed = remove_small_regions(mask, min_area, mode="holes")
-            unchanged = not changed
-            mask, changed = remove_small_regions(mask, min_area, mode="islands")
-            unchanged = unchanged and not changed
-
-            new_masks.append(torch.as_tensor(mask).unsqueeze(0))
-            # Give score=0 to changed masks and score=1 to unchanged masks
-            # so NMS will prefer ones that didn't need postprocessing
-            scores.append(float(unchanged))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = list(
+                executor.map(lambda rle: remove_small_regions_rle(rle, min_area), mask_data["rles"])
+            )
+        new_rles = [rle for rle, _ in results]
+        # Give score=0 to changed masks and score=1 to unchanged masks
+        # so NMS will prefer ones that didn't need postprocessing
+        scores = [float(not changed) for _, changed in results]
 
         # Recalculate boxes and remove any new duplicates
-        masks = torch.cat(new_masks, dim=0)
-        boxes = batched_mask_to_box(masks)
-        keep_by_nms = batched_nms(
-            boxes.float(),
-            torch.as_tensor(scores),
-            torch.zeros_like(boxes[:, 0]),  # categories
-            iou_threshold=nms_thresh,
+        boxes = torch.as_tensor(boxes_from_rles(new_rles))
+        keep_by_nms = SamAutomaticMaskGenerator.remove_duplicates(
+            new_rles, boxes, torch.as_tensor(scores), nms_thresh, nms_mode
         )
 
-        # Only recalculate RLEs for masks that have changed
+        # Only update RLEs and boxes for masks that have changed
         for i_mask in keep_by_nms:
             if scores[i_mask] == 0.0:
-                mask_torch = masks[i_mask].unsqueeze(0)
-                mask_data["rles"][i_mask] = mask_to_rle_pytorch(mask_torch)[0]
+                mask_data["rles"][i_mask] = new_rles[i_mask]
                 mask_data["boxes"][i_mask] = boxes[i_mask]  # update res directly
         mask_data.filter(keep_by_nms)
 
@@ -0,0 +1,180 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import torch
+
+from typing import Dict, List, Optional, Tuple
+
+from .predictor import SamPredictor
+from .utils.embedding_cache import EmbeddingCache
+from .utils.transforms import ResizeLongestSide
+
+
+class SamOnnxPredictor(SamPredictor):
+    def __init__(
+        self,
+        encoder_path: str,
+        decoder_path: str,
+        num_threads: Optional[int] = None,
+        img_size: int = 1024,
+        pixel_mean: List[float] = [123.675, 116.28, 103.53],
+        mask_threshold: float = 0.0,
+        image_format: str = "RGB",
+        providers: Optional[List[str]] = None,
+        embedding_cache: Optional[EmbeddingCache] = None,
+    ) -> None:
+        """
+        A SamPredictor that runs exported ONNX models with ONNXRuntime instead
+        of the PyTorch model, which is much faster on the CPU. It can be passed
+        to SamAutomaticMaskGenerator in place of a Sam model. Both models are
+        exported with scripts/export_onnx_model.py; the decoder must be
+        exported without --return-extra-metrics, and without
+        --return-single-mask for automatic mask generation.
+
+        Arguments:
+          encoder_path (str): The image encoder exported with --encoder-output,
+            optionally quantized with --encoder-quantize-out.
+          decoder_path (str): The prompt encoder and mask decoder model.
+          num_threads (int or None): The number of intra-op threads ONNXRuntime
+            uses for each model. If None, uses ONNXRuntime's default of one
+            thread per physical core.
+          img_size (int): The input size of the image encoder.
+          pixel_mean (list(float)): The pixel mean of the exported model, used
+            to pad images to the encoder's input size.
+          mask_threshold (float): The threshold for binarizing mask logits.
+          image_format (str): The color format the model expects.
+          providers (list(str) or None): ONNXRuntime execution providers.
+            Defaults to the CPU provider.
+          embedding_cache (EmbeddingCache or None): If set, image embeddings
+            are loaded from and saved to this on-disk cache.
+        """
+        import onnxruntime  # type: ignore
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        providers = providers or ["CPUExecutionProvider"]
+        self.encoder = onnxruntime.InferenceSession(
+            encoder_path, sess_options=options, providers=providers
+        )
+        self.decoder = onnxruntime.InferenceSession(
+            decoder_path, sess_options=options, providers=providers
+        )
+        # Decoders exported before prompt batching was supported take one prompt per run
+        decoder_inputs = {node.name: node for node in self.decoder.get_inputs()}
+        self.batched_decoder = not isinstance(decoder_inputs["point_coords"].shape[0], int)
+        self.embedding_cache = embedding_cache
+        self.img_size = img_size
+        self.pixel_mean = np.array(pixel_mean, dtype=np.float32).reshape(-1, 1, 1)
+        # Padded encoder input, kept between images to avoid reallocating it
+        self._input_buffer = np.empty((1, 3, img_size, img_size), dtype=np.float32)
+        self._mask_threshold = mask_threshold
+        self._image_format = image_format
+        self.transform = ResizeLongestSide(img_size)
+        self.reset_image()
+
+    def _encode(self, transformed_images: List[torch.Tensor]) -> torch.Tensor:
+        # The exported encoder takes one image per run. Padding with the pixel
+        # mean matches the zero padding after normalization in Sam.preprocess.
+        embeddings = []
+        input_image = self._input_buffer
+        for transformed_image in transformed_images:
+            h, w = transformed_image.shape[-2:]
+            input_image[...] = self.pixel_mean
+            input_image[0, :, :h, :w] = transformed_image[0].cpu().numpy()
+            embeddings.extend(self.encoder.run(None, {"input_image": input_image}))
+        return torch.from_numpy(np.concatenate(embeddings, axis=0))
+
+    def predict_torch(
+        self,
+        point_coords: Optional[torch.Tensor],
+        point_labels: Optional[torch.Tensor],
+        boxes: Optional[torch.Tensor] = None,
+        mask_input: Optional[torch.Tensor] = None,
+        multimask_output: bool = True,
+        return_logits: bool = False,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Predict masks for the given input prompts, using the currently set image.
+        Takes the same arguments and returns the same outputs as
+        SamPredictor.predict_torch.
+        """
+        if not self.is_image_set:
+            raise RuntimeError("An image must be set with .set_image(...) before mask prediction.")
+        if point_coords is None and boxes is None:
+            raise ValueError("At least one of point_coords or boxes must be supplied.")
+
+        # Boxes are given to the decoder as two corner points with labels 2 and 3.
+        # Without a box, a padding point with label -1 is appended, as in PromptEncoder.
+        coords: List[np.ndarray] = []
+        labels: List[np.ndarray] = []
+        if point_coords is not None:
+            coords.append(point_coords.cpu().numpy().astype(np.float32))
+            labels.append(point_labels.cpu().numpy().astype(np.float32))  # type: ignore
+        if boxes is not None:
+            corners = boxes.cpu().numpy().astype(np.float32).reshape(-1, 2, 2)
+            coords.append(corners)
+            labels.append(np.tile(np.array([[2, 3]], dtype=np.float32), (len(corners), 1)))
+        else:
+            coords.append(np.zeros((len(coords[0]), 1, 2), dtype=np.float32))
+            labels.append(-np.ones((len(labels[0]), 1), dtype=np.float32))
+
+        if mask_input is None:
+            mask = np.zeros((1, 1, 4 * self.features.shape[2], 4 * self.features.shape[3]))
+            has_mask = np.zeros(1)
+        else:
+            mask = mask_input.cpu().numpy()
+            has_mask = np.ones(1)
+        inputs = {
+            "image_embeddings": self.features.numpy(),
+            "point_coords": np.concatenate(coords, axis=1),
+            "point_labels": np.concatenate(labels, axis=1),
+            "mask_input": mask.astype(np.float32),
+            "has_mask_input": has_mask.astype(np.float32),
+            "orig_im_size": np.array(self.original_size, dtype=np.float32),
+        }
+        if self.batched_decoder or len(inputs["point_coords"]) == 1:
+            masks, iou_predictions, low_res_masks = self.decoder.run(None, inputs)
+        else:
+            masks, iou_predictions, low_res_masks = self._run_unbatched(inputs)
+
+        # The decoder returns all mask tokens, the first one being the single mask output
+        if masks.shape[1] > 1:
+            mask_slice = slice(1, None) if multimask_output else slice(0, 1)
+            masks = masks[:, mask_slice]
+            iou_predictions = iou_predictions[:, mask_slice]
+            low_res_masks = low_res_masks[:, mask_slice]
+
+        masks_torch = torch.from_numpy(masks)
+        if not return_logits:
+            masks_torch = masks_torch > self.mask_threshold
+
+        return masks_torch, torch.from_numpy(iou_predictions), torch.from_numpy(low_res_masks)
+
+    def _run_unbatched(self, inputs: Dict[str, np.ndarray]) -> List[np.ndarray]:
+        outputs = []
+        for i in range(len(inputs["point_coords"])):
+            prompt_inputs = dict(inputs)
+            for k in ["point_coords", "point_labels"]:
+                prompt_inputs[k] = inputs[k][i : i + 1]
+            if len(inputs["mask_input"]) > 1:
+                prompt_inputs["mask_input"] = inputs["mask_input"][i : i + 1]
+            outputs.append(self.decoder.run(None, prompt_inputs))
+        return [np.concatenate(output, axis=0) for output in zip(*outputs)]
+
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cpu")
+
+    @property
+    def image_format(self) -> str:
+        return self._image_format
+
+    @property
+    def mask_threshold(self) -> float:
+        return self._mask_threshold
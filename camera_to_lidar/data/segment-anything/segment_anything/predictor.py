@@ -9,8 +9,9 @@ import torch
 
 from segment_anything.modeling import Sam
 
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
+from .utils.embedding_cache import EmbeddingCache
 from .utils.transforms import ResizeLongestSide
 
 
@@ -18,6 +19,7 @@ class SamPredictor:
     def __init__(
         self,
         sam_model: Sam,
+        embedding_cache: Optional[EmbeddingCache] = None,
     ) -> None:
         """
         Uses SAM to calculate the image embedding for an image, and then
@@ -25,10 +27,16 @@ class SamPredictor:
 
         Arguments:
           sam_model (Sam): The model to use for mask prediction.
+          embedding_cache (EmbeddingCache or None): If set, image embeddings
+            are loaded from and saved to this on-disk cache, so setting an
+            image that was already encoded skips the image encoder.
         """
         super().__init__()
         self.model = sam_model
+        self.embedding_cache = embedding_cache
         self.transform = ResizeLongestSide(sam_model.image_encoder.img_size)
+        # Padded encoder input, kept between images to avoid reallocating it
+        self._input_buffer: Optional[torch.Tensor] = None
         self.reset_image()
 
     def set_image(
@@ -45,19 +53,37 @@ class SamPredictor:
             image in HWC uint8 format, with pixel values in [0, 255].
           image_format (str): The color format of the image, in ['RGB', 'BGR'].
         """
+        input_image_torch = self.prepare_image(image, image_format)
+        self.set_torch_image(input_image_torch, image.shape[:2])
+
+    def prepare_image(
+        self,
+        image: np.ndarray,
+        image_format: str = "RGB",
+    ) -> torch.Tensor:
+        """
+        Transforms an image to the form expected by 'set_torch_image' and
+        'encode_torch_images'.
+
+        Arguments:
+          image (np.ndarray): The image in HWC uint8 format, with pixel values
+            in [0, 255].
+          image_format (str): The color format of the image, in ['RGB', 'BGR'].
+
+        Returns:
+          (torch.Tensor): The transformed image, with shape 1x3xHxW.
+        """
         assert image_format in [
             "RGB",
             "BGR",
         ], f"image_format must be in ['RGB', 'BGR'], is {image_format}."
-        if image_format != self.model.image_format:
+        if image_format != self.image_format:
             image = image[..., ::-1]
 
         # Transform the image to the form expected by the model
         input_image = self.transform.apply_image(image)
         input_image_torch = torch.as_tensor(input_image, device=self.device)
-        input_image_torch = input_image_torch.permute(2, 0, 1).contiguous()[None, :, :, :]
-
-        self.set_torch_image(input_image_torch, image.shape[:2])
+        return input_image_torch.permute(2, 0, 1).contiguous()[None, :, :, :]
 
     @torch.no_grad()
     def set_torch_image(
@@ -76,17 +102,86 @@ class SamPredictor:
           original_image_size (tuple(int, int)): The size of the image
             before transformation, in (H, W) format.
         """
-        assert (
-            len(transformed_image.shape) == 4
-            and transformed_image.shape[1] == 3
-            and max(*transformed_image.shape[2:]) == self.model.image_encoder.img_size
-        ), f"set_torch_image input must be BCHW with long side {self.model.image_encoder.img_size}."
+        features = self.encode_torch_images([transformed_image])
+        self.set_image_embedding(features, original_image_size, transformed_image.shape[-2:])
+
+    @torch.no_grad()
+    def encode_torch_images(self, transformed_images: List[torch.Tensor]) -> torch.Tensor:
+        """
+        Calculates the image embeddings for several images with a single
+        forward pass of the image encoder. Images found in the embedding
+        cache are not encoded again.
+
+        Arguments:
+          transformed_images (list(torch.Tensor)): The input images, each with
+            shape 1x3xHxW, which have been transformed with ResizeLongestSide.
+            The images may have different sizes.
+
+        Returns:
+          (torch.Tensor): The image embeddings, with shape BxCxHxW.
+        """
+        long_side = self.transform.target_length
+        for transformed_image in transformed_images:
+            assert (
+                len(transformed_image.shape) == 4
+                and transformed_image.shape[0] == 1
+                and transformed_image.shape[1] == 3
+                and max(*transformed_image.shape[2:]) == long_side
+            ), f"Input images must be 1x3xHxW with long side {long_side}."
+
+        features: List[Optional[torch.Tensor]] = [None] * len(transformed_images)
+        cache_keys: List[str] = []
+        if self.embedding_cache is not None:
+            cache_keys = [self.embedding_cache.key(image) for image in transformed_images]
+            features = [self.embedding_cache.load(key, self.device) for key in cache_keys]
+
+        missing = [i for i, f in enumerate(features) if f is None]
+        if missing:
+            encoded = self._encode([transformed_images[i] for i in missing])
+            for j, i in enumerate(missing):
+                features[i] = encoded[j : j + 1]
+                if self.embedding_cache is not None:
+                    self.embedding_cache.save(cache_keys[i], encoded[j : j + 1])
+        return torch.cat(features, dim=0)  # type: ignore
+
+    def _encode(self, transformed_images: List[torch.Tensor]) -> torch.Tensor:
+        # Normalize and pad into the reused input buffer, as Sam.preprocess does
+        n, size = len(transformed_images), self.transform.target_length
+        if (
+            self._input_buffer is None
+            or self._input_buffer.shape[0] < n
+            or self._input_buffer.device != self.device
+        ):
+            self._input_buffer = torch.empty((n, 3, size, size), device=self.device)
+        input_images = self._input_buffer[:n]
+        input_images.zero_()
+        for i, x in enumerate(transformed_images):
+            h, w = x.shape[-2:]
+            input_images[i, :, :h, :w] = (x[0] - self.model.pixel_mean) / self.model.pixel_std
+        return self.model.image_encoder(input_images)
+
+    def set_image_embedding(
+        self,
+        features: torch.Tensor,
+        original_image_size: Tuple[int, ...],
+        input_size: Tuple[int, ...],
+    ) -> None:
+        """
+        Sets a precomputed image embedding, e.g. from 'encode_torch_images',
+        allowing masks to be predicted with the 'predict' method.
+
+        Arguments:
+          features (torch.Tensor): The image embedding, with shape 1xCxHxW.
+          original_image_size (tuple(int, int)): The size of the image
+            before transformation, in (H, W) format.
+          input_size (tuple(int, int)): The size of the image after
+            transformation with ResizeLongestSide, in (H, W) format.
+        """
         self.reset_image()
 
         self.original_size = original_image_size
-        self.input_size = tuple(transformed_image.shape[-2:])
-        input_image = self.model.preprocess(transformed_image)
-        self.features = self.model.image_encoder(input_image)
+        self.input_size = tuple(input_size)
+        self.features = features
         self.is_image_set = True
 
     def predict(
@@ -238,7 +333,7 @@ class SamPredictor:
         masks = self.model.postprocess_masks(low_res_masks, self.input_size, self.original_size)
 
         if not return_logits:
-            masks = masks > self.model.mask_threshold
+            masks = masks > self.mask_threshold
 
         return masks, iou_predictions, low_res_masks
 
@@ -259,6 +354,14 @@ class SamPredictor:
     def device(self) -> torch.device:
         return self.model.device
 
+    @property
+    def image_format(self) -> str:
+        return self.model.image_format
+
+    @property
+    def mask_threshold(self) -> float:
+        return self.model.mask_threshold
+
     def reset_image(self) -> None:
         """Resets the currently set image."""
         self.is_image_set = False
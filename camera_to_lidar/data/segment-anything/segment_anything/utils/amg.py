@@ -10,7 +10,7 @@ import torch
 import math
 from copy import deepcopy
 from itertools import product
-from typing import Any, Dict, Generator, ItemsView, List, Tuple
+from typing import Any, Dict, Generator, ItemsView, List, Optional, Tuple
 
 
 class MaskData:
@@ -104,53 +104,299 @@ def batch_iterator(batch_size: int, *args) -> Generator[List[Any], None, None]:
         yield [arg[b * batch_size : (b + 1) * batch_size] for arg in args]
 
 
-def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
+class RLE:
     """
-    Encodes masks to an uncompressed RLE, in the format expected by
-    pycoco tools.
+    A compact uncompressed RLE of a single mask. Runs are in fortran order
+    and alternate between background and foreground, starting with
+    background, as in pycocotools. Counts are stored as an int32 array,
+    so a mask costs a few bytes per run instead of a full HxW boolean array.
+    Supports the same "size" and "counts" item access as an RLE dict.
+    """
+
+    __slots__ = ("size", "counts")
+
+    def __init__(self, size: Tuple[int, int], counts: Any) -> None:
+        self.size = (int(size[0]), int(size[1]))
+        self.counts = np.asarray(counts, dtype=np.int32)
+
+    @classmethod
+    def from_dict(cls, rle: Dict[str, Any]) -> "RLE":
+        if isinstance(rle, RLE):
+            return rle
+        return cls(rle["size"], rle["counts"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"size": list(self.size), "counts": self.counts.tolist()}
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "size":
+            return list(self.size)
+        if key == "counts":
+            return self.counts
+        raise KeyError(key)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "RLE":
+        return RLE(self.size, self.counts.copy())
+
+    def __repr__(self) -> str:
+        return f"RLE(size={self.size}, runs={len(self.counts)}, area={self.area()})"
+
+    def area(self) -> int:
+        return area_from_rle(self)
+
+    def box(self) -> np.ndarray:
+        return box_from_rle(self)
+
+    def to_mask(self) -> np.ndarray:
+        return rle_to_mask(self)
+
+
+def rle_foreground_runs(rle: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the start and end (exclusive) of every foreground run of an RLE,
+    as indices into the fortran-order flattened mask.
+    """
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    fg_runs = np.arange(1, len(counts), 2)
+    fg_runs = fg_runs[counts[fg_runs] > 0]
+    return starts[fg_runs], ends[fg_runs]
+
+
+def mask_to_rle_counts_pytorch(tensor: torch.Tensor) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encodes a batch of masks to uncompressed RLE counts in a single pass.
+    Returns a flat array of run lengths for all masks and an array of B+1
+    offsets, so that the counts of mask i are counts[offsets[i]:offsets[i+1]].
+    Counts follow the pycoco convention: they start with a run of zeros,
+    which has length 0 if the mask begins with a foreground pixel.
     """
     # Put in fortran order and flatten h,w
     b, h, w = tensor.shape
     tensor = tensor.permute(0, 2, 1).flatten(1)
+    device = tensor.device
 
-    # Compute change indices
+    # Compute change indices, already sorted by mask then by position
     diff = tensor[:, 1:] ^ tensor[:, :-1]
     change_indices = diff.nonzero()
+    mask_idxs, positions = change_indices[:, 0], change_indices[:, 1] + 1
+
+    # Each mask has one run per change plus a final run, plus a leading
+    # zero-length run if it starts with a foreground pixel
+    changes_per_mask = torch.bincount(mask_idxs, minlength=b)
+    if h * w > 0:
+        leading_zero = tensor[:, 0].long()
+    else:
+        leading_zero = torch.zeros(b, dtype=torch.long, device=device)
+    lengths = changes_per_mask + 1 + leading_zero
+    offsets = torch.zeros(b + 1, dtype=torch.long, device=device)
+    offsets[1:] = torch.cumsum(lengths, dim=0)
+    change_offsets = torch.cumsum(changes_per_mask, dim=0) - changes_per_mask
+
+    # Fill the end position of every run, then difference against the
+    # previous end within the same mask
+    ends = torch.full((int(offsets[-1]),), h * w, dtype=torch.long, device=device)
+    rank = torch.arange(len(mask_idxs), device=device) - change_offsets[mask_idxs]
+    ends[offsets[mask_idxs] + leading_zero[mask_idxs] + rank] = positions
+    ends[offsets[:-1][leading_zero.bool()]] = 0
+    starts = torch.zeros_like(ends)
+    starts[1:] = ends[:-1]
+    starts[offsets[:-1]] = 0
+    counts = ends - starts
+
+    return counts.cpu().numpy(), offsets.cpu().numpy()
 
-    # Encode run length
-    out = []
-    for i in range(b):
-        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
-        cur_idxs = torch.cat(
-            [
-                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
-                cur_idxs + 1,
-                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
-            ]
-        )
-        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
-        counts = [] if tensor[i, 0] == 0 else [0]
-        counts.extend(btw_idxs.detach().cpu().tolist())
-        out.append({"size": [h, w], "counts": counts})
-    return out
+
+def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
+    """
+    Encodes masks to an uncompressed RLE, in the format expected by
+    pycoco tools.
+    """
+    b, h, w = tensor.shape
+    counts, offsets = mask_to_rle_counts_pytorch(tensor)
+    counts_list = counts.tolist()
+    return [
+        {"size": [h, w], "counts": counts_list[offsets[i] : offsets[i + 1]]} for i in range(b)
+    ]
+
+
+def mask_to_rle_compact_pytorch(tensor: torch.Tensor) -> List[RLE]:
+    """Encodes masks to compact RLEs that share one flat int32 counts array."""
+    b, h, w = tensor.shape
+    counts, offsets = mask_to_rle_counts_pytorch(tensor)
+    counts = counts.astype(np.int32)
+    return [RLE((h, w), counts[offsets[i] : offsets[i + 1]]) for i in range(b)]
 
 
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
-    mask = np.empty(h * w, dtype=bool)
-    idx = 0
-    parity = False
-    for count in rle["counts"]:
-        mask[idx : idx + count] = parity
-        idx += count
-        parity ^= True
+    counts = np.asarray(rle["counts"])
+    parity = np.arange(len(counts)) % 2 == 1
+    mask = np.repeat(parity, counts)
     mask = mask.reshape(w, h)
     return mask.transpose()  # Put in C order
 
 
 def area_from_rle(rle: Dict[str, Any]) -> int:
-    return sum(rle["counts"][1::2])
+    return int(np.sum(rle["counts"][1::2]))
+
+
+def box_from_rle(rle: Dict[str, Any]) -> np.ndarray:
+    """
+    Calculates the XYXY box around an RLE without decoding it, matching
+    batched_mask_to_box. Returns [0,0,0,0] for an empty mask.
+    """
+    h, _ = rle["size"]
+    starts, ends = rle_foreground_runs(rle)
+    if len(starts) == 0:
+        return np.zeros(4, dtype=np.int64)
+    first_col, last_col = starts // h, (ends - 1) // h
+    # A run that wraps into the next column covers the bottom of its first
+    # column and the top of its last one
+    wraps = last_col > first_col
+    top = np.where(wraps, 0, starts % h).min()
+    bottom = np.where(wraps, h - 1, (ends - 1) % h).max()
+    return np.array([first_col.min(), top, last_col.max(), bottom], dtype=np.int64)
+
+
+def intersection_from_rles(rle_a: Dict[str, Any], rle_b: Dict[str, Any]) -> int:
+    """Computes the intersection area of two RLEs of the same size without decoding them."""
+    starts_a, ends_a = rle_foreground_runs(rle_a)
+    starts_b, ends_b = rle_foreground_runs(rle_b)
+    if len(starts_a) == 0 or len(starts_b) == 0:
+        return 0
+    # Foreground area of b before each run boundary of a
+    covered_b = np.concatenate([[0], np.cumsum(ends_b - starts_b)])
+
+    def area_b_before(x: np.ndarray) -> np.ndarray:
+        i = np.searchsorted(starts_b, x, side="left")
+        overhang = np.maximum(ends_b[np.maximum(i - 1, 0)] - x, 0) * (i > 0)
+        return covered_b[i] - overhang
+
+    return int(np.sum(area_b_before(ends_a) - area_b_before(starts_a)))
+
+
+def iou_from_rles(rle_a: Dict[str, Any], rle_b: Dict[str, Any]) -> float:
+    """Computes the mask IoU of two RLEs of the same size without decoding them."""
+    intersection = intersection_from_rles(rle_a, rle_b)
+    union = area_from_rle(rle_a) + area_from_rle(rle_b) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def mask_to_rle_numpy(mask: np.ndarray) -> RLE:
+    """Encodes a single HxW binary mask to a compact RLE."""
+    h, w = mask.shape
+    flat = np.asarray(mask, dtype=bool).transpose().reshape(-1)  # Fortran order
+    change_indices = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], change_indices, [h * w]]))
+    if h * w > 0 and flat[0]:
+        counts = np.concatenate([[0], counts])
+    return RLE((h, w), counts)
+
+
+def boxes_from_rles(rles: List[Dict[str, Any]]) -> np.ndarray:
+    """Calculates Nx4 XYXY boxes around RLEs without decoding them."""
+    if len(rles) == 0:
+        return np.zeros((0, 4), dtype=np.int64)
+    return np.stack([box_from_rle(rle) for rle in rles])
+
+
+def _boxes_overlap(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """AxB matrix of whether inclusive XYXY boxes share at least one pixel."""
+    return (
+        (boxes_a[:, None, 0] <= boxes_b[None, :, 2])
+        & (boxes_b[None, :, 0] <= boxes_a[:, None, 2])
+        & (boxes_a[:, None, 1] <= boxes_b[None, :, 3])
+        & (boxes_b[None, :, 1] <= boxes_a[:, None, 3])
+    )
+
+
+def rle_intersection_matrix(
+    rles_a: List[Dict[str, Any]], rles_b: Optional[List[Dict[str, Any]]] = None
+) -> np.ndarray:
+    """
+    Computes the AxB matrix of intersection areas between two sets of RLEs
+    in run space. Pairs whose boxes do not overlap are skipped. If rles_b
+    is None, computes the matrix of rles_a against itself.
+    """
+    symmetric = rles_b is None
+    rles_b = rles_a if rles_b is None else rles_b
+    inter = np.zeros((len(rles_a), len(rles_b)), dtype=np.int64)
+    if len(rles_a) == 0 or len(rles_b) == 0:
+        return inter
+    boxes_a = boxes_from_rles(rles_a)
+    boxes_b = boxes_a if symmetric else boxes_from_rles(rles_b)
+    overlap = _boxes_overlap(boxes_a, boxes_b)
+    if symmetric:
+        overlap = np.triu(overlap, k=1)
+        inter[np.diag_indices(len(rles_a))] = [area_from_rle(rle) for rle in rles_a]
+    for i, j in zip(*np.nonzero(overlap)):
+        inter[i, j] = intersection_from_rles(rles_a[i], rles_b[j])
+    if symmetric:
+        inter = np.maximum(inter, inter.T)
+    return inter
+
+
+def rle_union_matrix(
+    rles_a: List[Dict[str, Any]],
+    rles_b: Optional[List[Dict[str, Any]]] = None,
+    intersections: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Computes the AxB matrix of union areas between two sets of RLEs."""
+    areas_a = np.array([area_from_rle(rle) for rle in rles_a], dtype=np.int64)
+    areas_b = areas_a if rles_b is None else np.array([area_from_rle(rle) for rle in rles_b])
+    if intersections is None:
+        intersections = rle_intersection_matrix(rles_a, rles_b)
+    return areas_a[:, None] + areas_b[None, :].astype(np.int64) - intersections
+
+
+def rle_iou_matrix(
+    rles_a: List[Dict[str, Any]], rles_b: Optional[List[Dict[str, Any]]] = None
+) -> np.ndarray:
+    """Computes the AxB matrix of mask IoUs between two sets of RLEs in run space."""
+    intersections = rle_intersection_matrix(rles_a, rles_b)
+    unions = rle_union_matrix(rles_a, rles_b, intersections)
+    return np.divide(
+        intersections, unions, out=np.zeros(unions.shape, dtype=np.float64), where=unions > 0
+    )
+
+
+def rle_nms(
+    rles: List[Dict[str, Any]],
+    scores: np.ndarray,
+    iou_threshold: float,
+    boxes: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Greedy non-maximal suppression using mask IoU computed on RLEs. Masks are
+    only compared against already kept masks whose boxes overlap theirs.
+    Returns the indices of the kept masks in decreasing score order, like
+    torchvision's nms.
+    """
+    if len(rles) == 0:
+        return np.zeros(0, dtype=np.int64)
+    boxes = boxes_from_rles(rles) if boxes is None else np.asarray(boxes)
+    areas = np.array([area_from_rle(rle) for rle in rles], dtype=np.int64)
+    order = np.argsort(-np.asarray(scores, dtype=np.float64), kind="stable")
+
+    keep: List[int] = []
+    for i in order:
+        if keep:
+            kept = np.array(keep)
+            candidates = kept[_boxes_overlap(boxes[i : i + 1], boxes[kept])[0]]
+            suppressed = False
+            for j in candidates:
+                inter = intersection_from_rles(rles[i], rles[j])
+                union = areas[i] + areas[j] - inter
+                if union > 0 and inter / union > iou_threshold:
+                    suppressed = True
+                    break
+            if suppressed:
+                continue
+        keep.append(int(i))
+    return np.array(keep, dtype=np.int64)
 
 
 def calculate_stability_score(
@@ -197,6 +443,27 @@ def build_all_layer_point_grids(
     return points_by_layer
 
 
+def select_points_by_coverage(
+    points: np.ndarray, coverage: np.ndarray, mode: str = "mask"
+) -> np.ndarray:
+    """
+    Selects grid points with a coverage map of the crop they lie in, given
+    as (x, y) pixel coordinates of the map. 'mask' keeps the points where the
+    coverage is above zero. 'density' keeps each point where the coverage is
+    above a threshold from the golden ratio sequence, so a region keeps a
+    share of its points equal to its coverage, spread evenly over the grid.
+    Returns a boolean keep mask.
+    """
+    h, w = coverage.shape[:2]
+    cols = np.clip(points[:, 0].astype(np.int64), 0, w - 1)
+    rows = np.clip(points[:, 1].astype(np.int64), 0, h - 1)
+    values = coverage[rows, cols]
+    if mode == "mask":
+        return values > 0
+    thresholds = (np.arange(1, len(points) + 1) * 0.6180339887498949) % 1.0
+    return values > thresholds
+
+
 def generate_crop_boxes(
     im_size: Tuple[int, ...], n_layers: int, overlap_ratio: float
 ) -> Tuple[List[List[int]], List[int]]:
@@ -291,10 +558,119 @@ def remove_small_regions(
     return mask, True
 
 
+def rle_to_mask_crop(rle: Dict[str, Any], box: List[int]) -> np.ndarray:
+    """
+    Decodes only the inclusive XYXY box of an RLE. Only the columns spanned
+    by the box are expanded, so the cost scales with the box, not the image.
+    """
+    h, _ = rle["size"]
+    x0, y0, x1, y1 = box
+    lo, hi = x0 * h, (x1 + 1) * h
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    lengths = np.clip(ends, lo, hi) - np.clip(starts, lo, hi)
+    parity = np.arange(len(counts)) % 2 == 1
+    columns = np.repeat(parity, lengths).reshape(x1 - x0 + 1, h)
+    return columns[:, y0 : y1 + 1].transpose()
+
+
+def rle_from_mask_crop(crop: np.ndarray, box: List[int], size: Tuple[int, int]) -> RLE:
+    """
+    Encodes a mask that is empty outside the inclusive XYXY box, given only
+    its crop, without building the full HxW mask.
+    """
+    h, w = size
+    x0, y0, _, _ = box
+    # Pad every column with background so each run has a start and an end
+    padded = np.zeros((crop.shape[1], crop.shape[0] + 2), dtype=np.int8)
+    padded[:, 1:-1] = crop.transpose()
+    edges = np.diff(padded, axis=1)
+    cols, rows = np.nonzero(edges == 1)
+    starts = (x0 + cols) * h + y0 + rows
+    cols, rows = np.nonzero(edges == -1)
+    ends = (x0 + cols) * h + y0 + rows
+    # Join runs that continue from the bottom of one column into the next
+    if len(starts) > 0:
+        separate = starts[1:] != ends[:-1]
+        starts = starts[np.concatenate([[True], separate])]
+        ends = ends[np.concatenate([separate, [True]])]
+    bounds = np.concatenate([[0], np.stack([starts, ends], axis=1).reshape(-1), [h * w]])
+    counts = np.diff(bounds)
+    if len(ends) > 0 and ends[-1] == h * w:
+        counts = counts[:-1]
+    return RLE((h, w), counts)
+
+
+def remove_small_regions_rle(rle: Dict[str, Any], area_thresh: float) -> Tuple[RLE, bool]:
+    """
+    Removes small holes, then small disconnected regions, from an RLE like
+    remove_small_regions in both modes. Works on a crop around the mask's box
+    padded by one pixel, so the connected components cost scales with the
+    mask rather than the image. Falls back to the full mask in the rare case
+    where background reaching the image outside the crop would be filled.
+    Returns the new RLE and whether the mask has been modified.
+    """
+    import cv2  # type: ignore
+
+    h, w = rle["size"]
+    x0, y0, x1, y1 = box_from_rle(rle).tolist()
+    if area_from_rle(rle) == 0:
+        return _remove_small_regions_full(rle, area_thresh)
+    x0, y0, x1, y1 = max(x0 - 1, 0), max(y0 - 1, 0), min(x1 + 1, w - 1), min(y1 + 1, h - 1)
+    # OpenCV labels components in 2x2 blocks, keep the crop aligned to them
+    # so ties between equally small islands resolve as on the full mask
+    x0, y0 = x0 - x0 % 2, y0 - y0 % 2
+    box = [x0, y0, x1, y1]
+    crop = rle_to_mask_crop(rle, box)
+
+    # Holes: background components touching the padding ring continue
+    # outside the crop, so add the outside area they connect to
+    working_mask = (~crop).astype(np.uint8)
+    n_labels, regions, stats, _ = cv2.connectedComponentsWithStats(working_mask, 8)
+    sizes = stats[:, -1].astype(np.int64)
+    border_labels = set()
+    outside = [
+        (y0 > 0, regions[0, 0], y0 * w),
+        (y1 < h - 1, regions[-1, 0], (h - 1 - y1) * w),
+        (x0 > 0, regions[0, 0], x0 * (y1 - y0 + 1)),
+        (x1 < w - 1, regions[0, -1], (w - 1 - x1) * (y1 - y0 + 1)),
+    ]
+    for touches, label, area in outside:
+        if touches:
+            sizes[label] += area
+            border_labels.add(label)
+    small_regions = [i for i in range(1, n_labels) if sizes[i] < area_thresh]
+    if border_labels.intersection(small_regions):
+        return _remove_small_regions_full(rle, area_thresh)
+    changed = len(small_regions) > 0
+    if changed:
+        crop = np.isin(regions, [0] + small_regions)
+
+    # Islands: foreground never touches the padding ring, so the crop is exact
+    crop, islands_changed = remove_small_regions(crop, area_thresh, mode="islands")
+    changed = changed or islands_changed
+    if not changed:
+        return RLE.from_dict(rle), False
+    return rle_from_mask_crop(crop, box, (h, w)), True
+
+
+def _remove_small_regions_full(rle: Dict[str, Any], area_thresh: float) -> Tuple[RLE, bool]:
+    mask = rle_to_mask(rle)
+    mask, changed = remove_small_regions(mask, area_thresh, mode="holes")
+    unchanged = not changed
+    mask, changed = remove_small_regions(mask, area_thresh, mode="islands")
+    unchanged = unchanged and not changed
+    if unchanged:
+        return RLE.from_dict(rle), False
+    return mask_to_rle_numpy(mask), True
+
+
 def coco_encode_rle(uncompressed_rle: Dict[str, Any]) -> Dict[str, Any]:
     from pycocotools import mask as mask_utils  # type: ignore
 
     h, w = uncompressed_rle["size"]
+    uncompressed_rle = {"size": [h, w], "counts": np.asarray(uncompressed_rle["counts"]).tolist()}
     rle = mask_utils.frPyObjects(uncompressed_rle, h, w)
     rle["counts"] = rle["counts"].decode("utf-8")  # Necessary to serialize with json
     return rle
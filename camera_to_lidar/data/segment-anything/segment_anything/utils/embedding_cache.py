@@ -0,0 +1,102 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import torch
+
+import hashlib
+import os
+import tempfile
+from typing import Dict, Optional, Tuple
+
+_checkpoint_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def checkpoint_hash(checkpoint: str) -> str:
+    """
+    Returns the sha1 of a checkpoint file. The result is memoized per
+    path, modification time and size, so it is only computed once per run.
+    """
+    stat = os.stat(checkpoint)
+    key = (os.path.realpath(checkpoint), stat.st_mtime_ns, stat.st_size)
+    if key not in _checkpoint_hashes:
+        digest = hashlib.sha1()
+        with open(checkpoint, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 24), b""):
+                digest.update(chunk)
+        _checkpoint_hashes[key] = digest.hexdigest()
+    return _checkpoint_hashes[key]
+
+
+class EmbeddingCache:
+    """
+    An on-disk cache of SAM image embeddings. Entries are keyed by the model
+    and by a hash of the exact encoder input (which covers the image content
+    and the input size), stored as .npy files in float16 by default and
+    loaded through a memory map.
+    """
+
+    def __init__(self, cache_dir: str, model_key: str, dtype: np.dtype = np.float16) -> None:
+        """
+        Arguments:
+          cache_dir (str): The directory to store embeddings in.
+          model_key (str): Identifies the model weights, e.g. the model type and
+            checkpoint hash. Embeddings from different models never collide.
+          dtype (np.dtype): The storage type. float16 halves the size on disk
+            at a small loss of precision; use np.float32 for exact embeddings.
+        """
+        self.cache_dir = cache_dir
+        self.model_key = model_key
+        self.dtype = np.dtype(dtype)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def for_checkpoint(
+        cls, cache_dir: str, model_type: str, checkpoint: str, dtype: np.dtype = np.float16
+    ) -> "EmbeddingCache":
+        """Creates a cache keyed by the model type and the checkpoint's content hash."""
+        return cls(cache_dir, f"{model_type}-{checkpoint_hash(checkpoint)}", dtype)
+
+    def key(self, transformed_image: torch.Tensor) -> str:
+        """Hashes an encoder input, as passed to SamPredictor.set_torch_image."""
+        image = transformed_image.detach().cpu().contiguous().numpy()
+        digest = hashlib.sha1()
+        digest.update(f"{self.model_key}:{image.dtype}:{image.shape}:{self.dtype}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def load(self, key: str, device: torch.device) -> Optional[torch.Tensor]:
+        """
+        Returns the cached float32 embedding for a key on the given device, or
+        None. The entry is memory-mapped and moved to the device in its stored
+        dtype, then converted to float32 there, so no float32 copy is made on
+        the host for a GPU device.
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            # Copy-on-write so torch gets a writable buffer; the file is never modified
+            embedding = torch.from_numpy(np.load(path, mmap_mode="c"))
+        except (OSError, ValueError):
+            # A corrupted entry is treated as a miss and overwritten on save
+            return None
+        return embedding.to(device=device).float()
+
+    def save(self, key: str, embedding: torch.Tensor) -> None:
+        """Stores an embedding. The file is written atomically."""
+        array = embedding.detach().cpu().numpy().astype(self.dtype)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
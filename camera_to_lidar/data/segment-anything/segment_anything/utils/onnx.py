@@ -142,3 +142,23 @@ class SamOnnxModel(nn.Module):
             return upscaled_masks, scores, stability_scores, areas, masks
 
         return upscaled_masks, scores, masks
+
+
+class SamOnnxEncoder(nn.Module):
+    """
+    This model should not be called directly, but is used in ONNX export.
+    It wraps the image encoder of Sam together with pixel normalization. The
+    exported model expects a 1x3xSxS float image, where S is the encoder's
+    input size. Images smaller than SxS should be padded with the model's
+    pixel mean, which normalizes to the zero padding used by Sam.preprocess.
+    """
+
+    def __init__(self, model: Sam) -> None:
+        super().__init__()
+        self.image_encoder = model.image_encoder
+        self.register_buffer("pixel_mean", model.pixel_mean.clone(), False)
+        self.register_buffer("pixel_std", model.pixel_std.clone(), False)
+
+    @torch.no_grad()
+    def forward(self, input_image: torch.Tensor) -> torch.Tensor:
+        return self.image_encoder((input_image - self.pixel_mean) / self.pixel_std)
@@ -9,6 +9,19 @@ import json
 import argparse
 import random
 import shutil
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from camera_registry import get_camera, get_derived
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 去畸变映射表缓存目录，与Parameters/同级
+REMAP_CACHE_DIR = os.path.join(DATA_DIR, "remap_cache")
+
+# pinhole-front去畸变后从中心裁剪得到的图像尺寸
+PINHOLE_CROP_SIZE = (1920, 1536)
 
 def update_camera_config(camera_config_path, param_files, input_dirs):
     # 初始化空的配置数组
@@ -17,17 +30,8 @@ def update_camera_config(camera_config_path, param_files, input_dirs):
     # 遍历每个相机配置
     for i, (param_file, input_dir) in enumerate(zip(param_files, input_dirs)):
         # 获取内参
-        if "pinhole-front" in input_dir: # Special case for pinhole-front
-            fx = 1910.3417311410
-            fy = 1910.3058674355
-            cx = 1917.7001038394
-            cy = 1081.4421265044
-        else:
-            internal_params = read_camera_parameters(param_file)
-            fx = internal_params.get("FX")
-            fy = internal_params.get("FY")
-            cx = internal_params.get("CX")
-            cy = internal_params.get("CY")
+        camera = get_camera(param_file)
+        fx, fy, cx, cy = camera.fx, camera.fy, camera.cx, camera.cy
 
         # 构建单个相机配置 (移除外参)
         camera_entry = {
@@ -58,273 +62,330 @@ def generate_camera_config_dir(camera_config_path, output_dirs):
     # If you need this functionality, we can fix it separately.
     pass
 
-def read_camera_parameters(param_file):
-    """从参数文件中读取相机内参和畸变系数"""
-    params = {}
-    with open(param_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        
-    for line in lines:
-        # 使用冒号分割键值
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip()
-            value = value.strip()
-            
-            # 忽略值为'/'或'null'的参数
-            if value != '/' and value != 'null' and value != '':
-                try:
-                    # 尝试将值转换为浮点数
-                    params[key] = float(value)
-                except ValueError:
-                    # 如果不能转换为浮点数，则保存为字符串
-                    params[key] = value
-    
-    return params
+def get_remap_maps(param_file, model, size, build_maps, cache_dir=REMAP_CACHE_DIR):
+    """
+    获取去畸变映射表(CV_16SC2定点格式)
+    先查相机注册表中的进程内缓存，再查磁盘上以参数文件内容、相机模型和图像尺寸的哈希
+    命名的.npz缓存，都没有时调用build_maps(params, size)生成并写入缓存
+    """
+    def load_maps(camera):
+        with open(param_file, 'rb') as f:
+            digest = hashlib.sha1(f.read())
+        digest.update(f"{model}:{size[0]}x{size[1]}".encode())
+        key = digest.hexdigest()[:16]
 
+        cache_file = os.path.join(cache_dir, f"{camera.name}-{size[0]}x{size[1]}-{key}.npz")
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as data:
+                return data["map1"], data["map2"]
 
-def undistort_fisheye_images(param_file, input_dir, output_dir):
-    """对鱼眼相机拍摄的图像进行去畸变处理"""
-    # 读取参数
-    params = read_camera_parameters(param_file)
-    
-    # 提取相机内参
-    fx = params.get('FX')
-    fy = params.get('FY')
-    cx = params.get('CX')
-    cy = params.get('CY')
-    
-    # 提取畸变系数
-    k1 = params.get('K1', 0.0)
-    k2 = params.get('K2', 0.0)
-    k3 = params.get('K3', 0.0)
-    k4 = params.get('K4', 0.0)
-    
-    # 检查必要的参数是否存在
-    required_params = ['FX', 'FY', 'CX', 'CY']
-    if not all(param in params for param in required_params):
-        missing = [param for param in required_params if param not in params]
-        raise ValueError(f"缺少必要的相机参数: {', '.join(missing)}")
-    
-    # 创建相机矩阵
+        maps = build_maps(camera.values, size)
+        os.makedirs(cache_dir, exist_ok=True)
+        # 先写临时文件再重命名，避免并行进程读到不完整的缓存
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, map1=maps[0], map2=maps[1])
+        os.replace(tmp_file, cache_file)
+        print(f"已生成去畸变映射表缓存: {cache_file}")
+        return maps
+
+    return get_derived(param_file, ("remap", model, tuple(size), cache_dir), load_maps)
+
+
+def build_fisheye_maps(params, size):
+    """根据鱼眼相机参数生成去畸变映射表"""
     camera_matrix = np.array([
-        [fx, 0, cx],
-        [0, fy, cy],
+        [params['FX'], 0, params['CX']],
+        [0, params['FY'], params['CY']],
         [0, 0, 1]
     ])
-    
-    # 畸变系数 (k1, k2, p1, p2, k3, k4, k5, k6)
     # OpenCV的鱼眼相机模型使用k1, k2, k3, k4作为畸变系数
-    dist_coeffs = np.array([k1, k2, k3, k4])
-    
-    # 清空并重新创建输出目录
-    if os.path.exists(output_dir):
-        shutil.rmtree(output_dir)
-    os.makedirs(output_dir, exist_ok=True)
-    print(f"已清空并重新创建输出目录: {output_dir}")
-    
-    # 获取输入目录中的所有图像
-    image_files = glob.glob(os.path.join(input_dir, '*.png')) + glob.glob(os.path.join(input_dir, '*.jpg'))
-    
-    # 随机选择3张图片进行处理
-    if len(image_files) > 3:
-        image_files = random.sample(image_files, 3)
-        print(f"从 {len(glob.glob(os.path.join(input_dir, '*.png')) + glob.glob(os.path.join(input_dir, '*.jpg')))} 张图片中随机选择了 3 张进行处理")
-    else:
-        print(f"总共只有 {len(image_files)} 张图片，全部处理")
-    
-    # 处理选中的图像
-    for image_file in image_files:
-        # 读取图像
-        img = cv2.imread(image_file)
-        if img is None:
-            print(f"无法读取图像: {image_file}")
-            continue
-        
-        # 获取图像尺寸
-        h, w = img.shape[:2]
-        
-        # 计算新的相机矩阵
-        new_camera_matrix = camera_matrix.copy()
-        
-        # 使用OpenCV的鱼眼相机模型进行去畸变
-        map1, map2 = cv2.fisheye.initUndistortRectifyMap(
-            camera_matrix, 
-            dist_coeffs, 
-            np.eye(3), 
-            new_camera_matrix, 
-            (w, h), 
-            cv2.CV_16SC2
-        )
-        undistorted_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
-        
-        # 打印去畸变后的图像尺寸
-        # print(f"去畸变后的图像尺寸: {undistorted_img.shape[1]}x{undistorted_img.shape[0]}")
-        
-        # 构建输出文件路径
-        filename = os.path.basename(image_file)
-        output_file = os.path.join(output_dir, filename)
-        
-        # 保存去畸变后的图像
-        cv2.imwrite(output_file, undistorted_img)
-        print(f"已处理: {image_file}")
-
-def crop_image(image, cx, cy, crop_percent=1):
-    """从光学中心裁剪图像"""
-    width=3840
-    height=2160
-    
-    # 计算裁剪区域
-    crop_width = 1920  # 直接指定目标宽度
-    crop_height = 1536  # 直接指定目标高度
-    
-    # 计算裁剪区域的边界（从中心开始）
-    left = int((width - crop_width) / 2)
-    right = left + crop_width
-    top = int((height - crop_height) / 2)
-    bottom = top + crop_height
-    
-    # 裁剪图像
-    cropped = image[top:bottom, left:right]
-    # print(f"\n裁剪后的图像尺寸: {cropped.shape[1]}x{cropped.shape[0]}")
-    return cropped
-
-def calculate_new_camera_matrix(params, input_dir, crop_percent=1):
-    """计算裁剪后的相机内参矩阵"""
-    fx = params.get('FX')
-    fy = params.get('FY')
-    cx = params.get('CX')
-    cy = params.get('CY')
-    
-    # 读取一张图片来获取尺寸，支持jpg和png格式
-    input_path = Path(input_dir)
-    sample_image = next(chain(input_path.glob("*.jpg"), input_path.glob("*.png")), None)
-    if sample_image:
-        image = cv2.imread(str(sample_image))
-        if image is not None:
-            width=3840
-            height=2160
-
-            
-            # 计算裁剪区域
-            crop_width = width-1920
-            crop_height = height-1536
-            # 计算裁剪边界
-            left = max(0, int(cx - crop_width/2))
-            top = max(0, int(cy - crop_height/2))
-            
-            # 计算裁剪后的主点坐标
-            # 新的主点坐标需要减去裁剪的偏移量
-            new_cx = cx - left  # left是裁剪的起始x坐标
-            new_cy = cy - top   # top是裁剪的起始y坐标
-            
-            # 构建原始相机矩阵
-            camera_matrix = np.array([
-                [fx, 0, cx],
-                [0, fy, cy],
-                [0, 0, 1]
-            ])
-            
-            # 构建新的相机矩阵
-            new_camera_matrix = np.array([
-                [fx, 0, new_cx],
-                [0, fy, new_cy],
-                [0, 0, 1]
-            ])
-            
-            return camera_matrix, new_camera_matrix
-    
-    return None, None
+    dist_coeffs = np.array([params.get('K1', 0.0), params.get('K2', 0.0),
+                            params.get('K3', 0.0), params.get('K4', 0.0)])
+    return cv2.fisheye.initUndistortRectifyMap(
+        camera_matrix,
+        dist_coeffs,
+        np.eye(3),
+        camera_matrix.copy(),
+        size,
+        cv2.CV_16SC2
+    )
 
-def process_fisheye_camera(param_file, input_dir, output_dir):
-    try:
-        print(f'开始处理camera: {input_dir}中的图片')
-        undistort_fisheye_images(param_file, input_dir, output_dir)
-        print(f"所有图像已处理完成并保存到 {output_dir} 目录")
-    except Exception as e:
-        print(f"处理出错: {e}")
 
-def undistort_pinhole_image(image_path, params, input_dir):
+def undistort_fisheye_image(image_path, param_file):
+    """对单张鱼眼相机拍摄的图像进行去畸变处理"""
     # 读取图像
     img = cv2.imread(image_path)
     if img is None:
         raise ValueError(f"无法读取图像: {image_path}")
 
-    # 获取原始图像尺寸
+    # 获取图像尺寸
     h, w = img.shape[:2]
-    
-    # 构建相机矩阵
+
+    # 映射表只与相机参数和图像尺寸有关，按相机缓存复用
+    map1, map2 = get_remap_maps(param_file, "fisheye", (w, h), build_fisheye_maps)
+    return cv2.remap(img, map1, map2, interpolation=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
+
+def pinhole_crop_offset(size, crop_size=PINHOLE_CROP_SIZE):
+    """从图像中心裁剪时左上角的偏移(left, top)"""
+    width, height = size
+    crop_width, crop_height = crop_size
+    return int((width - crop_width) / 2), int((height - crop_height) / 2)
+
+def pinhole_output_camera_matrix(params, size, crop=False):
+    """计算去畸变(及裁剪)后图像对应的相机内参矩阵"""
     camera_matrix = np.array([
         [params['FX'], 0, params['CX']],
         [0, params['FY'], params['CY']],
         [0, 0, 1]
     ])
-    
-    # 构建畸变系数
+    if crop:
+        # 裁剪只平移主点，焦距不变
+        left, top = pinhole_crop_offset(size)
+        camera_matrix[0, 2] -= left
+        camera_matrix[1, 2] -= top
+    return camera_matrix
+
+def build_pinhole_maps(params, size, crop=False):
+    """
+    根据针孔相机参数生成去畸变映射表
+    crop为True时以裁剪后的内参作为新相机矩阵、以裁剪尺寸作为输出尺寸，
+    去畸变和中心裁剪合并为一次remap
+    """
+    camera_matrix = pinhole_output_camera_matrix(params, size)
     dist_coeffs = np.array([
         params['K1'], params['K2'], params['P1'], params['P2'],
         params['K3'], params['K4'], params['K5'], params['K6']
     ])
-    
-    # 去畸变
-    undistorted_img = cv2.undistort(img, camera_matrix, dist_coeffs)
-
-    if input_dir==f"pinhole-front/pinhole-images":
-          undistorted_img=crop_image(undistorted_img,params['CX'],params['CY'])
-          camera_matrix, new_camera_matrix=calculate_new_camera_matrix(params, input_dir)
-        #   print("\n原始相机矩阵:")
-        #   print(camera_matrix)
-        #   print("\n新的相机矩阵:")
-        #   print(new_camera_matrix)
-    
-    return undistorted_img, camera_matrix
-
-def process_pinhole_image(param_file, input_dir, output_dir):
-        try:
-            # 清空并重新创建输出目录
-            if os.path.exists(output_dir):
-                shutil.rmtree(output_dir)
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"已清空并重新创建输出目录: {output_dir}")
-            
-            params = read_camera_parameters(param_file)
-            image_files = glob.glob(os.path.join(input_dir, '*.jpg'))+glob.glob(os.path.join(input_dir, '*.png'))
-            
-            # 随机选择3张图片进行处理
-            if len(image_files) > 3:
-                image_files = random.sample(image_files, 3)
-                print(f"从 {len(glob.glob(os.path.join(input_dir, '*.jpg'))+glob.glob(os.path.join(input_dir, '*.png')))} 张图片中随机选择了 3 张进行处理")
-            else:
-                print(f"总共只有 {len(image_files)} 张图片，全部处理")
-            
-            # 处理选中的图片
-            for image_path in image_files:
-                try:
-                    cropped_img, new_camera_matrix = undistort_pinhole_image(image_path, params,input_dir)
-                    # 获取原始文件名
-                    filename = os.path.basename(image_path)
-                    # 构建输出文件路径
-                    output_path = os.path.join(output_dir, f'{filename}')
-                    # 保存处理后的图片
-                    cv2.imwrite(output_path, cropped_img)
-                    print(f"已保存处理后的图片: {output_path}")
-
-
-                except Exception as e:
-                    print(f"处理图像 {image_path} 时出错: {str(e)}")
+    new_camera_matrix = pinhole_output_camera_matrix(params, size, crop)
+    output_size = PINHOLE_CROP_SIZE if crop else size
+    return cv2.initUndistortRectifyMap(
+        camera_matrix,
+        dist_coeffs,
+        None,
+        new_camera_matrix,
+        output_size,
+        cv2.CV_16SC2
+    )
+
+def is_crop_camera(input_dir):
+    """pinhole-front需要从中心裁剪到1920x1536"""
+    return os.path.normpath(input_dir).endswith(os.path.join("pinhole-front", "pinhole-images"))
 
+def get_camera_maps(param_file, input_dir, size):
+    """根据相机类型获取对应的去畸变映射表"""
+    if "pinhole" not in input_dir:
+        return get_remap_maps(param_file, "fisheye", size, build_fisheye_maps)
+
+    crop = is_crop_camera(input_dir)
+    model = "pinhole-crop" if crop else "pinhole"
+    return get_remap_maps(param_file, model, size,
+                          lambda params, size: build_pinhole_maps(params, size, crop))
+
+def output_camera_matrix(param_file, input_dir, size):
+    """去畸变(及裁剪)后图像的内参矩阵，每个相机和尺寸只计算一次"""
+    crop = is_crop_camera(input_dir)
+    return get_derived(param_file, ("output_camera_matrix", tuple(size), crop),
+                       lambda camera: pinhole_output_camera_matrix(camera.values, size, crop))
+
+def undistort_pinhole_image(image_path, param_file, input_dir):
+    # 读取图像
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"无法读取图像: {image_path}")
+
+    # 获取原始图像尺寸
+    h, w = img.shape[:2]
+
+    # pinhole-front的中心裁剪直接合并到映射表中
+    map1, map2 = get_camera_maps(param_file, input_dir, (w, h))
+    undistorted_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+
+    return undistorted_img, output_camera_matrix(param_file, input_dir, (w, h))
+
+def undistort_image(image_path, param_file, input_dir):
+    """根据相机类型对单张图像去畸变"""
+    if "pinhole" in input_dir:
+        return undistort_pinhole_image(image_path, param_file, input_dir)[0]
+    return undistort_fisheye_image(image_path, param_file)
+
+class UndistortedImageProvider:
+    """
+    按需从原始图像生成去畸变(及裁剪)后的图像，不在磁盘上保存去畸变副本
+    映射表来自缓存，最近使用的图像保存在进程内LRU缓存中
+    """
+
+    def __init__(self, param_file, input_dir, cache_size=8):
+        self.param_file = param_file
+        self.input_dir = input_dir
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._sources = {Path(f).stem: f for f in list_images(input_dir)}
+
+    def names(self):
+        """按名称排序返回所有可用图像的文件名(不含扩展名)"""
+        return sorted(self._sources)
+
+    def source_path(self, name):
+        return self._sources[name]
+
+    def get(self, name):
+        """返回去畸变后的BGR图像，返回的数组为只读"""
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return self._cache[name]
+        if name not in self._sources:
+            raise KeyError(f"{self.input_dir} 中没有图像 {name}")
+
+        img = undistort_image(self._sources[name], self.param_file, self.input_dir)
+        img.flags.writeable = False
+        self._cache[name] = img
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return img
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __len__(self):
+        return len(self._sources)
+
+    def __iter__(self):
+        return iter(self.names())
+
+def camera_paths(camera_folder, data_dir=DATA_DIR):
+    """相机文件夹名(如fisheye-front)对应的参数文件和原始图像目录"""
+    camera_type = "pinhole" if "pinhole" in camera_folder else "fisheye"
+    return (os.path.join(data_dir, "Parameters", f"{camera_folder}.txt"),
+            os.path.join(data_dir, camera_folder, f"{camera_type}-images"))
+
+def camera_image_provider(camera_folder, data_dir=DATA_DIR, cache_size=8):
+    """根据相机文件夹名(如fisheye-front)创建去畸变图像提供器"""
+    param_file, input_dir = camera_paths(camera_folder, data_dir)
+    return UndistortedImageProvider(param_file, input_dir, cache_size)
+
+def undistorted_camera_matrix(camera_folder, data_dir=DATA_DIR):
+    """
+    相机去畸变(及裁剪)后图像的内参矩阵
+    裁剪的偏移与原始图像尺寸有关，此时读取第一张原始图像获得尺寸
+    """
+    param_file, input_dir = camera_paths(camera_folder, data_dir)
+    if not is_crop_camera(input_dir):
+        return get_camera(param_file).camera_matrix
+    image_files = list_images(input_dir)
+    if not image_files:
+        raise FileNotFoundError(f"{input_dir} 中没有原始图像，无法确定裁剪后的内参")
+    img = cv2.imread(image_files[0])
+    if img is None:
+        raise ValueError(f"无法读取图像: {image_files[0]}")
+    h, w = img.shape[:2]
+    return output_camera_matrix(param_file, input_dir, (w, h))
+
+IMAGE_EXTENSIONS = ('.png', '.jpg')
+
+def list_images(input_dir):
+    """按文件名排序列出目录中的图像"""
+    return sorted(chain.from_iterable(glob.glob(os.path.join(input_dir, '*' + ext)) for ext in IMAGE_EXTENSIONS))
+
+def select_images(image_files, sample=0, seed=0):
+    """sample<=0时处理全部图像，否则按随机种子确定性地抽取sample张"""
+    if sample <= 0 or len(image_files) <= sample:
+        return image_files
+    return sorted(random.Random(seed).sample(image_files, sample))
+
+def is_up_to_date(image_file, output_file, param_file):
+    """输出比源图像和参数文件都新时无需重新处理"""
+    if not os.path.exists(output_file):
+        return False
+    output_mtime = os.path.getmtime(output_file)
+    return output_mtime >= os.path.getmtime(image_file) and output_mtime >= os.path.getmtime(param_file)
+
+def _undistort_task(image_file, param_file, input_dir, output_file):
+    """
+    进程池任务，映射表在每个工作进程内只加载一次
+    先写入临时文件再替换，中断或失败时不会留下比源图像新的不完整输出
+    """
+    root, ext = os.path.splitext(output_file)
+    tmp_file = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        if not cv2.imwrite(tmp_file, undistort_image(image_file, param_file, input_dir)):
+            raise IOError(f"写入图像失败: {output_file}")
+        os.replace(tmp_file, output_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return output_file
+
+def undistort_cameras(cameras, sample=0, seed=0, workers=None, force=False):
+    """
+    用进程池对所有相机的图像去畸变
+    cameras为(param_file, input_dir, output_dir)列表；已是最新的输出会被跳过，
+    源图像已删除的输出会被清理
+    """
+    tasks = []
+    for param_file, input_dir, output_dir in cameras:
+        image_files = list_images(input_dir)
+        if not image_files:
+            print(f"警告: {input_dir} 中没有图像，跳过")
+            continue
+        os.makedirs(output_dir, exist_ok=True)
+
+        # 清理源图像已不存在的输出，只删除图像文件(包括中断后残留的临时文件)
+        source_names = {os.path.basename(f) for f in image_files}
+        for name in os.listdir(output_dir):
+            path = os.path.join(output_dir, name)
+            if name not in source_names and name.endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                os.remove(path)
+
+        selected = select_images(image_files, sample, seed)
+        pending = []
+        for image_file in selected:
+            output_file = os.path.join(output_dir, os.path.basename(image_file))
+            if force or not is_up_to_date(image_file, output_file, param_file):
+                pending.append((image_file, param_file, input_dir, output_file))
+        print(f"{input_dir}: 共 {len(image_files)} 张图片，选择 {len(selected)} 张，需要处理 {len(pending)} 张")
+        if not pending:
+            continue
+
+        # 先在主进程中准备映射表缓存，工作进程直接加载(fork时直接共享)
+        sample_img = cv2.imread(pending[0][0])
+        if sample_img is None:
+            print(f"无法读取图像: {pending[0][0]}")
+            continue
+        h, w = sample_img.shape[:2]
+        get_camera_maps(param_file, input_dir, (w, h))
+        if "pinhole" in input_dir:
+            new_camera_matrix = output_camera_matrix(param_file, input_dir, (w, h))
             # 打印新的相机参数
             print("新的相机参数:")
             print(f"FX: {new_camera_matrix[0, 0]:.10f}")
             print(f"FY: {new_camera_matrix[1, 1]:.10f}")
             print(f"CX: {new_camera_matrix[0, 2]:.10f}")
             print(f"CY: {new_camera_matrix[1, 2]:.10f}\n")
-            
-        except Exception as e:
-            print(f"处理图像时出错: {str(e)}")
+        tasks.extend(pending)
+
+    if not tasks:
+        print("所有输出均为最新，无需处理")
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_undistort_task, *task): task[0] for task in tasks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                print(f"已处理: {futures[future]}")
+            except Exception as e:
+                print(f"处理图像 {futures[future]} 时出错: {str(e)}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='对所有相机的图像去畸变')
+    parser.add_argument('--sample', type=int, default=0,
+                        help='每个相机随机抽取的图像数量，0表示处理全部图像')
+    parser.add_argument('--seed', type=int, default=0, help='随机抽取图像时使用的随机种子')
+    parser.add_argument('--workers', type=int, default=None, help='并行进程数，默认为CPU核数')
+    parser.add_argument('--force', action='store_true', help='忽略已有输出，全部重新处理')
+    args = parser.parse_args()
+
     param_files = ["Parameters/pinhole-back.txt","Parameters/pinhole-front.txt","Parameters/fisheye-front.txt", 
                     "Parameters/fisheye-left.txt", "Parameters/fisheye-right.txt"]
     input_dirs = [f"pinhole-back/pinhole-images", f"pinhole-front/pinhole-images", f"fisheye-front/fisheye-images",
@@ -332,12 +393,8 @@ if __name__ == "__main__":
     output_dirs = [f"pinhole-back/undistorted", f"pinhole-front/undistorted", f"fisheye-front/undistorted",
                    f"fisheye-left/undistorted", f"fisheye-right/undistorted"]
     
-    for param_file, input_dir, output_dir in zip(param_files, input_dirs, output_dirs):
-        # 输出目录的清空和创建现在在各自的处理函数内部完成
-        if "pinhole" in input_dir:
-            process_pinhole_image(param_file, input_dir, output_dir)
-        else:
-            process_fisheye_camera(param_file, input_dir, output_dir)
+    undistort_cameras(list(zip(param_files, input_dirs, output_dirs)),
+                      sample=args.sample, seed=args.seed, workers=args.workers, force=args.force)
 
     camera_config_path = "Parameters/camera_config.json"
     update_camera_config(camera_config_path, param_files, input_dirs)
@@ -1,7 +1,5 @@
 #!/bin/bash
 
-for d in ./data/*/ ; do
-    echo "Processing $d ..."
-    ./bin/run_lidar2camera "$d"
-    python update.py
-done
\ No newline at end of file
+# 依次标定./data下的每一帧，外参在帧之间传递，全部完成后一次性更新所有文件
+# 加上 --parallel 可让各帧并行标定
+python calib_session.py "$@"
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自动标定会话：依次(或并行)对data下的每一帧运行./bin/run_lidar2camera
+当前外参保存在内存中，每帧的结果作为下一帧的初始值，
+全部帧标定完成后才一次性更新extrinsic.txt、所有calib.txt和手动标定的外参JSON
+
+每帧在results/<帧名>/下运行标定程序，标定程序输出的extrinsic.txt和投影图片保存在这里，
+并行运行时各帧互不覆盖；标定程序从工作目录读取./data/initial_error.txt，
+因此运行期间在该目录下建立指向data的链接
+"""
+
+import os
+import sys
+import glob
+import shutil
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from calib_result import CalibrationResult, format_extrinsic_txt, read_result
+from calib_writer import CALIB_TXT_NAME, EXTRINSIC_JSON_NAME, atomic_write, format_tr_line, replace_tr_line, update_extrinsic
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def mean_extrinsic(extrinsics):
+    """多个外参的平均：平移取均值，旋转取矩阵均值后投影回旋转矩阵(SVD)"""
+    extrinsics = np.asarray(extrinsics, dtype=np.float64)
+    U, _, Vt = np.linalg.svd(extrinsics[:, :3, :3].sum(axis=0))
+    correction = np.diag([1.0, 1.0, np.sign(np.linalg.det(U @ Vt))])
+    mean = np.eye(4)
+    mean[:3, :3] = U @ correction @ Vt
+    mean[:3, 3] = extrinsics[:, :3, 3].mean(axis=0)
+    return mean
+
+
+class CalibrationSession:
+    """
+    一次自动标定会话
+    data_dir: 自动标定数据目录，每个子文件夹是一帧
+    manual_data_dir: 手动标定数据目录，结束时同步更新其中的外参JSON，为None时不更新
+    """
+
+    def __init__(self, data_dir=os.path.join(CURRENT_DIR, "data"),
+                 binary=os.path.join(CURRENT_DIR, "bin", "run_lidar2camera"),
+                 results_dir=os.path.join(CURRENT_DIR, "results"),
+                 manual_data_dir=os.path.join(CURRENT_DIR, "..", "manual_calib", "data")):
+        self.data_dir = os.path.abspath(data_dir)
+        self.binary = os.path.abspath(binary)
+        self.results_dir = os.path.abspath(results_dir)
+        self.manual_data_dir = manual_data_dir
+        self.results = {}
+        self.extrinsic = None
+
+    def frames(self):
+        """所有帧文件夹，按名称排序"""
+        return sorted(
+            os.path.join(self.data_dir, name) for name in os.listdir(self.data_dir)
+            if os.path.isdir(os.path.join(self.data_dir, name))
+        )
+
+    def initial_extrinsic(self, frame_dir):
+        """帧的calib.txt中的Tr作为初始外参"""
+        return read_result(os.path.join(frame_dir, CALIB_TXT_NAME)).extrinsic
+
+    def set_initial_extrinsic(self, frame_dir, extrinsic):
+        """只改写这一帧calib.txt中的Tr行，标定程序从这里读取初始外参"""
+        calib_file = os.path.join(frame_dir, CALIB_TXT_NAME)
+        with open(calib_file, 'r', encoding='utf-8') as f:
+            calib_content = f.read()
+        new_content = replace_tr_line(calib_content, format_tr_line(np.asarray(extrinsic).tolist()))
+        if new_content != calib_content:
+            atomic_write(calib_file, new_content)
+
+    def run_frame(self, frame_dir):
+        """
+        对一帧运行标定程序，返回CalibrationResult，失败时返回None
+        输出保存在results/<帧名>/下
+        """
+        name = os.path.basename(frame_dir)
+        workdir = os.path.join(self.results_dir, name)
+        os.makedirs(workdir, exist_ok=True)
+        result_file = os.path.join(workdir, "extrinsic.txt")
+        if os.path.exists(result_file):
+            os.remove(result_file)
+
+        # 标定程序读取 ./data/initial_error.txt
+        data_link = os.path.join(workdir, "data")
+        if os.path.lexists(data_link):
+            os.remove(data_link)
+        os.symlink(self.data_dir, data_link)
+        try:
+            with open(os.path.join(workdir, "run.log"), 'w') as log:
+                returncode = subprocess.call([self.binary, frame_dir], cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            os.remove(data_link)
+
+        if returncode != 0 or not os.path.exists(result_file):
+            print(f"警告: 帧 {name} 标定失败，详见 {os.path.join(workdir, 'run.log')}")
+            return None
+        result = read_result(result_file)
+        print(f"帧 {name} 标定完成")
+        return result
+
+    def run(self, frames=None):
+        """
+        依次标定每一帧，每帧的结果作为下一帧的初始外参
+        标定失败的帧不改变当前外参
+        """
+        frames = self.frames() if frames is None else frames
+        if self.extrinsic is None and frames:
+            self.extrinsic = self.initial_extrinsic(frames[0])
+        for frame_dir in frames:
+            self.set_initial_extrinsic(frame_dir, self.extrinsic)
+            result = self.run_frame(frame_dir)
+            if result is not None:
+                self.results[frame_dir] = result
+                self.extrinsic = result.extrinsic
+        return self.results
+
+    def run_parallel(self, frames=None, workers=None):
+        """
+        各帧互相独立时并行标定：所有帧使用相同的初始外参，
+        最终外参取所有成功帧结果的平均
+        """
+        frames = self.frames() if frames is None else frames
+        if self.extrinsic is None and frames:
+            self.extrinsic = self.initial_extrinsic(frames[0])
+        for frame_dir in frames:
+            self.set_initial_extrinsic(frame_dir, self.extrinsic)
+
+        # 标定程序是独立进程，用线程等待即可
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for frame_dir, result in zip(frames, executor.map(self.run_frame, frames)):
+                if result is not None:
+                    self.results[frame_dir] = result
+        if self.results:
+            self.extrinsic = mean_extrinsic([r.extrinsic for r in self.results.values()])
+        return self.results
+
+    def save(self, extrinsic_file=os.path.join(CURRENT_DIR, "extrinsic.txt")):
+        """
+        把最终外参一次性写入extrinsic.txt、所有帧的calib.txt和手动标定的外参JSON
+        没有任何帧标定成功时不写入，当前外参只是初始值，不能覆盖之前的结果
+        """
+        if not self.results or self.extrinsic is None:
+            print("错误: 没有可保存的标定结果")
+            return 0
+        result = CalibrationResult(extrinsic=np.asarray(self.extrinsic))
+        # 依次标定时最终外参就是最后一帧的结果，直接保留标定程序的原始输出
+        source = next((r.source for r in self.results.values() if r.extrinsic is self.extrinsic), None)
+        if source is not None:
+            shutil.copyfile(source, extrinsic_file)
+        else:
+            atomic_write(extrinsic_file, format_extrinsic_txt(result))
+
+        calib_files = glob.glob(os.path.join(self.data_dir, "**", CALIB_TXT_NAME), recursive=True)
+        json_files = []
+        if self.manual_data_dir and os.path.isdir(self.manual_data_dir):
+            json_files = glob.glob(os.path.join(self.manual_data_dir, "**", EXTRINSIC_JSON_NAME), recursive=True)
+        updated = update_extrinsic(result.matrix(), json_files, calib_files)
+        print(f"最终外参已写入 {extrinsic_file}，并更新了 {updated}/{len(calib_files) + len(json_files)} 个文件")
+        return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对data下的所有帧运行自动标定')
+    parser.add_argument('--data-dir', type=str, default=os.path.join(CURRENT_DIR, "data"),
+                        help='自动标定数据目录')
+    parser.add_argument('--parallel', action='store_true',
+                        help='各帧使用相同的初始外参并行标定，最终外参取平均；默认依次标定并把结果传给下一帧')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='并行标定的进程数，默认为CPU核数')
+    args = parser.parse_args()
+
+    session = CalibrationSession(data_dir=args.data_dir)
+    frames = session.frames()
+    if not frames:
+        print(f"错误: {args.data_dir} 下没有数据")
+        return 1
+    print(f"共 {len(frames)} 帧")
+
+    if args.parallel:
+        session.run_parallel(frames, args.workers)
+    else:
+        session.run(frames)
+    print(f"成功标定 {len(session.results)}/{len(frames)} 帧")
+    if not session.results:
+        print("错误: 所有帧都标定失败，extrinsic.txt、calib.txt和外参JSON保持不变")
+        return 1
+    session.save()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 #pragma once
+#include <iterator>
 #include <utility.hpp>
 
 class DataLoader {
@@ -6,8 +7,56 @@ class DataLoader {
         DataLoader() = default;
         ~DataLoader() = default;
 
+        // amg.py --mask-format packed/both 生成的打包掩码：labels.pack 是4通道PNG，
+        // 每个像素最多4层掩码编号(与下面逐个读取PNG的打包方式相同)，masks.rle 中记录每个掩码的面积
+        // 掩码不需要去畸变时一次读取即可，否则返回false，改为逐个读取PNG
+        static bool LoadPackedMaskFile(const std::string mask_dir, const Eigen::MatrixXf intrinsic, const std::vector<double> dist, cv::Mat &masks, std::vector<int> &mask_point_num)
+        {
+            if (intrinsic.cols() == 3 && std::any_of(dist.begin(), dist.end(), [](double d) { return d != 0; }))
+                return false;
+            std::ifstream label_file(mask_dir + "/labels.pack", std::ios::binary);
+            std::ifstream rle_file(mask_dir + "/masks.rle", std::ios::binary);
+            if (!label_file.is_open() || !rle_file.is_open())
+                return false;
+
+            std::vector<uchar> buffer((std::istreambuf_iterator<char>(label_file)), std::istreambuf_iterator<char>());
+            cv::Mat labels = cv::imdecode(buffer, cv::IMREAD_UNCHANGED);
+            if (labels.empty() || labels.type() != CV_8UC4 || labels.size() != masks.size())
+                return false;
+
+            // 头部: "MRLE", 版本, 高, 宽, 掩码数; 每个掩码: 原始编号, 面积, counts个数, counts
+            char magic[4];
+            uint32_t header[4];
+            rle_file.read(magic, sizeof(magic));
+            rle_file.read(reinterpret_cast<char *>(header), sizeof(header));
+            if (!rle_file || std::string(magic, 4) != "MRLE" || header[0] != 1)
+                return false;
+            uint32_t N = header[3];
+            if (N > 255){
+                std::cout << "Mask file number is larger than 255. Redundant masks are discarded." << std::endl;
+                N = 255;
+            }
+            std::vector<int> point_num;
+            for (uint32_t n = 0; n < N; n++)
+            {
+                uint32_t record[3];
+                rle_file.read(reinterpret_cast<char *>(record), sizeof(record));
+                if (!rle_file)
+                    return false;
+                point_num.push_back(record[1]);
+                rle_file.seekg(record[2] * sizeof(uint32_t), std::ios::cur);
+            }
+
+            labels.copyTo(masks);
+            mask_point_num.insert(mask_point_num.end(), point_num.begin(), point_num.end());
+            return true;
+        }
+
         static void LoadMaskFile(const std::string mask_dir, const Eigen::MatrixXf intrinsic, const std::vector<double> dist, cv::Mat &masks, std::vector<int> &mask_point_num)
         {
+            if (LoadPackedMaskFile(mask_dir, intrinsic, dist, masks, mask_point_num))
+                return;
+
             std::vector<std::string> mask_files;
             DIR *dir;
             struct dirent *ptr;
@@ -25,6 +74,17 @@ class DataLoader {
             }
             if (mask_files.size() == 0)
             {
+                // 只有打包掩码(amg.py --mask-format packed)但无法使用时，给出具体原因
+                if (std::ifstream(mask_dir + "/labels.pack").good())
+                {
+                    if (intrinsic.cols() == 3 && std::any_of(dist.begin(), dist.end(), [](double d) { return d != 0; }))
+                        std::cout << "Packed masks under " << mask_dir << " need undistortion, which requires one PNG per mask. "
+                                  << "Rerun amg.py with --mask-format both." << std::endl;
+                    else
+                        std::cout << "Packed masks under " << mask_dir << " are invalid (corrupted or image size mismatch) "
+                                  << "and no PNG masks were found. Rerun amg.py with --mask-format both." << std::endl;
+                    exit(1);
+                }
                 std::cout << "No valid mask file under dir." << std::endl;
                 exit(1);
             }
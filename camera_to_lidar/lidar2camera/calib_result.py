@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+标定结果的读写：把各种结果文件解析为统一的CalibrationResult，再由它生成所有目标格式
+支持的输入格式：
+  - 自动标定的extrinsic.txt (Extrinsic = 矩阵块，Roll/Pitch/Yaw与x/y/z行)
+  - 手动标定的calibration_*.txt (R:/t:块以及json format块)
+  - calib.txt (P2:/D:/Tr:行)
+  - 外参JSON (top_center_lidar-to-center_camera-extrinsic.json)
+用法: python calib_result.py records/ --output converted --format extrinsic_json calib_txt
+"""
+
+import os
+import re
+import json
+import glob
+import math
+import argparse
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from calib_writer import format_tr_line, render_calib_txt, render_extrinsic_json
+
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_ROW = rf"\[\s*{_NUMBER}(?:\s*,\s*{_NUMBER})*\s*\]"
+
+# 自动标定extrinsic.txt中的 "Extrinsic =" 块，后面是4行 [a,b,c,d],
+_EXTRINSIC_BLOCK = re.compile(rf"^Extrinsic\s*=\s*\n((?:\s*{_ROW}\s*,?\s*\n?){{4}})", re.M)
+# 手动标定calibration_*.txt中 json format 部分的 "Extrinsic:"，下一行是 [..],[..],[..],[..]
+_JSON_FORMAT_BLOCK = re.compile(r"json format.*$", re.M)
+_JSON_EXTRINSIC = re.compile(rf"^Extrinsic:\s*\n\s*((?:{_ROW}\s*,?\s*){{4}})", re.M)
+_JSON_INTRINSIC = re.compile(rf"^Intrinsic:\s*\n\s*((?:{_ROW}\s*,?\s*){{3}})", re.M)
+_JSON_DISTORTION = re.compile(rf"^Distortion:\s*\n\s*({_ROW})", re.M)
+# 手动标定calibration_*.txt中的 R: (3行) 和 t: 行
+_RT_BLOCK = re.compile(rf"^R:\s*\n((?:\s*{_NUMBER}\s+{_NUMBER}\s+{_NUMBER}\s*\n){{3}})\s*t:\s*({_NUMBER}\s+{_NUMBER}\s+{_NUMBER})", re.M)
+_PLAIN_INTRINSIC = re.compile(rf"^Intrinsic:\s*\n((?:\s*{_NUMBER}\s+{_NUMBER}\s+{_NUMBER}\s*\n?){{3}})", re.M)
+# calib.txt中的行
+_CALIB_LINE = re.compile(r"^(P2|D|Tr):(.*)$", re.M)
+# extrinsic.txt中的 Roll = 2.68 等行
+_SCALAR_LINE = re.compile(rf"^(Roll|Pitch|Yaw|x|y|z)\s*=\s*({_NUMBER})\s*$", re.M)
+
+_ROW_PATTERN = re.compile(_ROW)
+_NUMBER_PATTERN = re.compile(_NUMBER)
+
+
+def _parse_rows(text):
+    """把 [a,b,c],[d,e,f] 形式的文本解析为二维数组"""
+    return np.array([[float(x) for x in _NUMBER_PATTERN.findall(row)] for row in _ROW_PATTERN.findall(text)])
+
+
+def _parse_numbers(text):
+    return np.array([float(x) for x in _NUMBER_PATTERN.findall(text)])
+
+
+def euler_to_rotation(roll, pitch, yaw):
+    """由欧拉角(角度)计算旋转矩阵，R = Rz(yaw) * Ry(pitch) * Rx(roll)，与help/euler_matrix.py一致"""
+    roll, pitch, yaw = (math.radians(a) for a in (roll, pitch, yaw))
+    R_x = np.array([[1, 0, 0], [0, math.cos(roll), -math.sin(roll)], [0, math.sin(roll), math.cos(roll)]])
+    R_y = np.array([[math.cos(pitch), 0, math.sin(pitch)], [0, 1, 0], [-math.sin(pitch), 0, math.cos(pitch)]])
+    R_z = np.array([[math.cos(yaw), -math.sin(yaw), 0], [math.sin(yaw), math.cos(yaw), 0], [0, 0, 1]])
+    return R_z @ R_y @ R_x
+
+
+def rotation_to_euler(rotation):
+    """旋转矩阵转换为欧拉角(角度)，返回(roll, pitch, yaw)"""
+    roll = math.atan2(rotation[2][1], rotation[2][2])
+    pitch = -math.asin(max(-1.0, min(1.0, rotation[2][0])))
+    yaw = math.atan2(rotation[1][0], rotation[0][0])
+    return math.degrees(roll), math.degrees(pitch), math.degrees(yaw)
+
+
+@dataclass(frozen=True)
+class CalibrationResult:
+    """一次标定的结果：4x4激光雷达到相机的外参，以及可选的内参和畸变系数"""
+    extrinsic: np.ndarray
+    intrinsic: Optional[np.ndarray] = None
+    distortion: Optional[np.ndarray] = None
+    source: Optional[str] = None
+
+    @classmethod
+    def from_euler(cls, roll, pitch, yaw, x, y, z, **kwargs):
+        extrinsic = np.eye(4)
+        extrinsic[:3, :3] = euler_to_rotation(roll, pitch, yaw)
+        extrinsic[:3, 3] = (x, y, z)
+        return cls(extrinsic=extrinsic, **kwargs)
+
+    @property
+    def rotation(self):
+        return self.extrinsic[:3, :3]
+
+    @property
+    def translation(self):
+        return self.extrinsic[:3, 3]
+
+    @property
+    def euler(self):
+        """(roll, pitch, yaw)，单位为角度"""
+        return rotation_to_euler(self.rotation)
+
+    def matrix(self):
+        """4x4外参的嵌套列表，用于写入JSON和calib.txt"""
+        return self.extrinsic.tolist()
+
+
+def parse_result_text(text, source=None):
+    """
+    从标定结果文本中解析外参，按以下顺序尝试：
+    json format块、Extrinsic =块、R:/t:块、Tr:行、Roll/Pitch/Yaw与x/y/z行
+    都找不到时抛出ValueError
+    """
+    text = text.replace("\r\n", "\n")
+    stripped = text.lstrip()
+    if stripped.startswith("{"):
+        return parse_result_json(json.loads(stripped), source)
+
+    extrinsic = intrinsic = distortion = None
+
+    json_format = _JSON_FORMAT_BLOCK.search(text)
+    if json_format:
+        tail = text[json_format.end():]
+        match = _JSON_EXTRINSIC.search(tail)
+        if match:
+            extrinsic = _parse_rows(match.group(1))
+        match = _JSON_INTRINSIC.search(tail)
+        if match:
+            intrinsic = _parse_rows(match.group(1))
+        match = _JSON_DISTORTION.search(tail)
+        if match:
+            distortion = _parse_rows(match.group(1)).ravel()
+
+    if extrinsic is None:
+        match = _EXTRINSIC_BLOCK.search(text)
+        if match:
+            extrinsic = _parse_rows(match.group(1))
+
+    if extrinsic is None:
+        match = _RT_BLOCK.search(text)
+        if match:
+            extrinsic = np.eye(4)
+            extrinsic[:3, :3] = _parse_numbers(match.group(1)).reshape(3, 3)
+            extrinsic[:3, 3] = _parse_numbers(match.group(2))
+            plain_intrinsic = _PLAIN_INTRINSIC.search(text)
+            if intrinsic is None and plain_intrinsic:
+                intrinsic = _parse_numbers(plain_intrinsic.group(1)).reshape(3, 3)
+
+    calib_lines = {key: _parse_numbers(values) for key, values in _CALIB_LINE.findall(text)}
+    if extrinsic is None and len(calib_lines.get("Tr", ())) == 12:
+        extrinsic = np.vstack([calib_lines["Tr"].reshape(3, 4), [0, 0, 0, 1]])
+    if intrinsic is None and len(calib_lines.get("P2", ())) >= 9:
+        intrinsic = calib_lines["P2"][:9].reshape(3, 3)
+    if distortion is None and "D" in calib_lines:
+        distortion = calib_lines["D"]
+
+    if extrinsic is None:
+        scalars = {key: float(value) for key, value in _SCALAR_LINE.findall(text)}
+        if len(scalars) == 6:
+            extrinsic = CalibrationResult.from_euler(**{k.lower(): v for k, v in scalars.items()}).extrinsic
+
+    if extrinsic is None or extrinsic.shape != (4, 4):
+        raise ValueError(f"未找到完整的4x4外参矩阵: {source or '<text>'}")
+    return CalibrationResult(extrinsic=extrinsic, intrinsic=intrinsic, distortion=distortion, source=source)
+
+
+def parse_result_json(data, source=None):
+    """解析外参JSON(top_center_lidar-to-center_camera-extrinsic.json)"""
+    for value in data.values():
+        if isinstance(value, dict) and "sensor_calib" in value.get("param", {}):
+            extrinsic = np.array(value["param"]["sensor_calib"]["data"], dtype=np.float64)
+            return CalibrationResult(extrinsic=extrinsic, source=source)
+    raise ValueError(f"JSON中没有sensor_calib外参: {source or '<json>'}")
+
+
+def read_result(path):
+    """读取并解析一个标定结果文件"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_result_text(f.read(), source=path)
+
+
+def _format_value(value):
+    # 与标定程序(C++默认6位有效数字)的输出一致
+    return f"{value:g}"
+
+
+def format_extrinsic_txt(result):
+    """生成与自动标定程序输出相同格式的extrinsic.txt内容"""
+    rows = [f"[{','.join(_format_value(v) for v in row)}]" for row in result.extrinsic]
+    roll, pitch, yaw = result.euler
+    x, y, z = result.translation
+    lines = ["Extrinsic = "] + [row + "," for row in rows[:-1]] + [rows[-1]]
+    lines += [f"Roll = {_format_value(roll)}", f"Pitch = {_format_value(pitch)}", f"Yaw = {_format_value(yaw)}"]
+    lines += [f"x = {_format_value(x)}", f"y = {_format_value(y)}", f"z = {_format_value(z)}"]
+    return "\n".join(lines) + "\n"
+
+
+def format_calibration_txt(result):
+    """生成与手动标定程序输出相同格式的calibration_*.txt内容"""
+    intrinsic = result.intrinsic if result.intrinsic is not None else np.zeros((3, 3))
+    distortion = result.distortion if result.distortion is not None else np.zeros(5)
+
+    def bracket_rows(matrix):
+        return ",".join(f"[{','.join(_format_value(v) for v in row)}]" for row in matrix)
+
+    lines = ["Extrinsic:", "R:"]
+    lines += [" ".join(_format_value(v) for v in row) for row in result.rotation]
+    lines += ["t: " + " ".join(_format_value(v) for v in result.translation), "", "Intrinsic:"]
+    lines += [" ".join(_format_value(v) for v in row) for row in intrinsic]
+    lines += ["************* json format *************", "Extrinsic:", bracket_rows(result.extrinsic), ""]
+    lines += ["Intrinsic:", bracket_rows(intrinsic), "", "Distortion:", bracket_rows([distortion])]
+    return "\n".join(lines)
+
+
+def format_extrinsic_json(result):
+    """生成手动标定使用的外参JSON内容"""
+    return render_extrinsic_json(result.matrix())
+
+
+def format_calib_txt(result):
+    """生成自动标定使用的calib.txt内容，没有内参时内参为0"""
+    intrinsic = result.intrinsic if result.intrinsic is not None else np.zeros((3, 3))
+    fx, fy, cx, cy = (intrinsic[0][0], intrinsic[1][1], intrinsic[0][2], intrinsic[1][2])
+    return render_calib_txt(fx, fy, cx, cy, format_tr_line(result.matrix()))
+
+
+# 格式名 -> (生成函数, 输出文件后缀)
+FORMATS = {
+    "extrinsic_txt": (format_extrinsic_txt, "_extrinsic.txt"),
+    "calibration_txt": (format_calibration_txt, "_calibration.txt"),
+    "extrinsic_json": (format_extrinsic_json, "_extrinsic.json"),
+    "calib_txt": (format_calib_txt, "_calib.txt"),
+}
+
+
+def write_result(result, path, fmt):
+    """按指定格式把标定结果写入文件"""
+    render, _ = FORMATS[fmt]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(render(result))
+
+
+def read_results(records_dir, pattern="*.txt"):
+    """
+    解析目录下所有标定结果文件，返回 文件路径 -> CalibrationResult
+    无法解析的文件(如CMakeLists.txt)会被跳过
+    """
+    results = {}
+    for path in sorted(glob.glob(os.path.join(records_dir, pattern))):
+        try:
+            results[path] = read_result(path)
+        except (ValueError, UnicodeDecodeError) as e:
+            print(f"跳过 {path}: {e}")
+    return results
+
+
+def convert_records(records_dir, output_dir, formats=("extrinsic_json",), pattern="*.txt"):
+    """
+    把records目录下的所有标定结果一次性转换为指定格式
+    输出文件名为 原文件名 + 格式后缀，例如 calibration_0_extrinsic.json
+    返回 输入文件路径 -> CalibrationResult
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = read_results(records_dir, pattern)
+    for path, result in results.items():
+        stem = os.path.splitext(os.path.basename(path))[0]
+        for fmt in formats:
+            write_result(result, os.path.join(output_dir, stem + FORMATS[fmt][1]), fmt)
+    print(f"已转换 {len(results)} 个标定结果到: {output_dir}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量转换标定结果文件的格式')
+    parser.add_argument('records_dir', type=str, help='标定结果所在的文件夹，例如manual_calib/records')
+    parser.add_argument('--output', type=str, required=True, help='输出文件夹')
+    parser.add_argument('--format', nargs='+', choices=sorted(FORMATS), default=['extrinsic_json'],
+                        help='输出格式，可以同时指定多个')
+    parser.add_argument('--pattern', type=str, default='*.txt', help='要解析的文件名模式')
+    args = parser.parse_args()
+
+    convert_records(args.records_dir, args.output, args.format, args.pattern)
+
+
+if __name__ == "__main__":
+    main()
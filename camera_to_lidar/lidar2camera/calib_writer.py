@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+标定文件的批量生成：内参JSON、外参JSON和calib.txt的内容只渲染一次，
+再一次性写入(或硬链接)到所有帧文件夹中
+供data/organize_files.py以及auto_calib、manual_calib下的update.py共用
+"""
+
+import os
+import json
+from collections import defaultdict
+
+INTRINSIC_JSON_NAME = "center_camera-intrinsic.json"
+EXTRINSIC_JSON_NAME = "top_center_lidar-to-center_camera-extrinsic.json"
+CALIB_TXT_NAME = "calib.txt"
+
+# 打包时calib.txt中的初始外参
+DEFAULT_TR_LINE = "Tr: -0.994522 -0.00182427 0.104513 4.56915e-05 6.88468e-18 -0.999848 -0.0174524 0.155236 0.104528 -0.0173568 0.99437 0.0173913"
+
+
+def render_intrinsic_json(fx, fy, cx, cy, width=1920, height=1536, error=None):
+    """生成手动标定使用的内参JSON内容(去畸变后的图像，畸变系数为0)"""
+    intrinsic_data = {
+        "center_camera-intrinsic": {
+            "sensor_name": "center_camera",
+            "target_sensor_name": "center_camera",
+            "device_type": "camera",
+            "param_type": "intrinsic",
+            "param": {
+                "img_dist_w": width,
+                "img_dist_h": height,
+                "cam_K": {
+                    "rows": 3,
+                    "cols": 3,
+                    "type": 6,
+                    "continuous": True,
+                    "data": [
+                        [fx, 0, cx],
+                        [0, fy, cy],
+                        [0, 0, 1]
+                    ]
+                },
+                "cam_dist": {
+                    "rows": 1,
+                    "cols": 5,
+                    "type": 6,
+                    "continuous": True,
+                    "data": [
+                        [0, 0, 0, 0, 0]
+                    ]
+                }
+            }
+        }
+    }
+    if error is not None:
+        intrinsic_data["center_camera-intrinsic"]["error"] = error
+    return json.dumps(intrinsic_data, indent=4, ensure_ascii=False)
+
+
+def render_extrinsic_json(extrinsic_matrix):
+    """生成手动标定使用的外参JSON内容"""
+    return """{
+    "top_center_lidar-to-center_camera-extrinsic": {
+        "sensor_name": "top_center_lidar",
+        "target_sensor_name": "center_camera",
+        "device_type": "relational",
+        "param_type": "extrinsic",
+        "param": {
+            "time_lag": 0,
+            "sensor_calib": {
+                "rows": 4,
+                "cols": 4,
+                "type": 6,
+                "continuous": true,
+                "data": [
+                """ + f"""[{','.join([str(val) for val in extrinsic_matrix[0]])}],
+                [{','.join([str(val) for val in extrinsic_matrix[1]])}],
+                [{','.join([str(val) for val in extrinsic_matrix[2]])}],
+                [{','.join([str(val) for val in extrinsic_matrix[3]])}]""" + """
+                ]
+            }
+        }
+    }
+}"""
+
+
+def format_tr_line(extrinsic_matrix):
+    """将外参矩阵前三行转换为calib.txt的Tr行（3x4 = 12个数字）"""
+    tr_values = []
+    for i in range(3):
+        for j in range(4):
+            tr_values.append(str(extrinsic_matrix[i][j]))
+    return "Tr: " + " ".join(tr_values)
+
+
+def render_calib_txt(fx, fy, cx, cy, tr_line=DEFAULT_TR_LINE):
+    """生成自动标定使用的calib.txt内容"""
+    calib_content = f"P2: {fx} 0 {cx} 0 {fy} {cy} 0 0 1\n"
+    calib_content += "D: 0 0 0 0 0\n"
+    calib_content += tr_line
+    return calib_content
+
+
+def replace_tr_line(calib_content, tr_line):
+    """替换calib.txt内容中的Tr:行，其余行保持不变"""
+    updated_lines = []
+    for line in calib_content.splitlines(keepends=True):
+        if line.strip().startswith("Tr:"):
+            updated_lines.append(tr_line + ("\n" if line.endswith("\n") else ""))
+        else:
+            updated_lines.append(line)
+    return "".join(updated_lines)
+
+
+def atomic_write(path, content):
+    """
+    先写临时文件再重命名替换目标文件
+    目标文件可能是与其他帧共享的硬链接，原地改写会同时改掉所有帧，替换则只影响这一个路径
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def publish(content, paths, link_mode="write"):
+    """
+    将同一份内容写入所有路径，返回成功写入的路径列表
+    link_mode为write时每个路径写一份；为hardlink时只写第一份，其余路径硬链接到它
+    (跨文件系统等无法链接时回退为写入)
+    """
+    written = []
+    source = None
+    for path in paths:
+        try:
+            if link_mode == "hardlink" and source is not None:
+                tmp_path = f"{path}.tmp-{os.getpid()}"
+                try:
+                    os.link(source, tmp_path)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    atomic_write(path, content)
+            else:
+                atomic_write(path, content)
+                source = path
+            written.append(path)
+        except OSError as e:
+            print(f"更新文件失败 {path}: {e}")
+    return written
+
+
+def update_extrinsic(extrinsic_matrix, json_paths=(), calib_paths=(), link_mode="write"):
+    """
+    把新的外参一次性推送到所有帧：外参JSON只渲染一次；calib.txt按现有内容分组，
+    每组只替换一次Tr行，内容没有变化的文件不重写
+    返回成功更新的文件数
+    """
+    updated = len(publish(render_extrinsic_json(extrinsic_matrix), list(json_paths), link_mode))
+
+    tr_line = format_tr_line(extrinsic_matrix)
+    groups = defaultdict(list)
+    for calib_path in calib_paths:
+        try:
+            with open(calib_path, 'r', encoding='utf-8') as f:
+                groups[f.read()].append(calib_path)
+        except OSError as e:
+            print(f"更新文件失败 {calib_path}: {e}")
+    for calib_content, paths in groups.items():
+        new_content = replace_tr_line(calib_content, tr_line)
+        if new_content == calib_content:
+            updated += len(paths)
+            continue
+        updated += len(publish(new_content, paths, link_mode))
+    return updated
@@ -8,6 +8,9 @@ import json
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from calib_writer import atomic_write
+
 def generate_calib_txt(intrinsic_json_path, extrinsic_json_path, output_calib_path):
     """
     从内参和外参JSON文件生成calib.txt文件
@@ -50,9 +53,8 @@ def generate_calib_txt(intrinsic_json_path, extrinsic_json_path, output_calib_pa
                 tr_values.append(str(extrinsic_matrix[i][j]))
         lines.append("Tr: " + " ".join(tr_values))
         
-        # 写入calib.txt文件
-        with open(output_calib_path, 'w') as f:
-            f.write('\n'.join(lines) + '\n')
+        # 写入calib.txt文件(替换而不是原地改写，避免改到硬链接共享的其他帧)
+        atomic_write(output_calib_path, '\n'.join(lines) + '\n')
         
         print(f"成功生成: {output_calib_path}")
         return True